@@ -0,0 +1,96 @@
+"""
+Compares how many messages per second the primitive classes in `waygui.py` and the `Signature` codec next to them can
+encode and decode. Run it from this directory:
+
+    python benchmark.py [messages]
+"""
+import sys
+import time
+from io import BytesIO
+
+from waygui import *
+
+# A mix of what a client sends and receives most while drawing: globals being announced, buffers being attached and
+# damaged, and the occasional title.
+MESSAGES = [
+    ((UInt32, String, UInt32), 2, 0, (7, "xdg_wm_base", 6)),
+    ((ObjID, Int32, Int32), 3, 1, (8, 0, 0)),
+    ((Int32, Int32, Int32, Int32), 3, 9, (0, 0, 1920, 1080)),
+    ((String,), 9, 2, ("A window on Wayland from scratch",)),
+    ((Array,), 10, 0, (bytes(range(12)),)),
+]
+
+
+def encode_primitives(messages: int) -> bytes:
+    data = []
+    for i in range(messages):
+        types, obj_id, opcode, args = MESSAGES[i % len(MESSAGES)]
+        payload = b""
+        for arg_type, arg in zip(types, args):
+            payload += arg_type(arg).serialize()
+        data.append(Message(Header(obj_id, opcode), payload).serialize())
+    return b"".join(data)
+
+
+def decode_primitives(data: bytes, messages: int):
+    stream = BytesIO(data)
+    for i in range(messages):
+        types = MESSAGES[i % len(MESSAGES)][0]
+        Header.frombytes(stream)
+        [arg_type.frombytes(stream) for arg_type in types]
+
+
+def encode_codec(messages: int, signatures: List[Signature]) -> bytes:
+    # Flushed every 64 messages, the writer's buffer is reused after that like it would be after a send.
+    writer = MessageWriter()
+    data = []
+    for i in range(messages):
+        _, obj_id, opcode, args = MESSAGES[i % len(MESSAGES)]
+        writer.write(signatures[i % len(MESSAGES)], obj_id, opcode, *args)
+        if i % 64 == 63:
+            data.append(bytes(writer.getbuffer()))
+            writer.clear()
+    data.append(bytes(writer.getbuffer()))
+    return b"".join(data)
+
+
+def decode_codec(data: bytes, messages: int, signatures: List[Signature]):
+    view = memoryview(data)
+    offset = 0
+    for i in range(messages):
+        _, _, size = read_header(view, offset)
+        signatures[i % len(MESSAGES)].decode(view, offset + HEADER.size)
+        offset += size
+
+
+def rate(func, *args, repeat: int = 5) -> float:
+    # Best of a few runs, anything slower than that was only measuring something else getting in the way.
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    signatures = [Signature(*types) for types, *_ in MESSAGES]
+
+    data = encode_primitives(messages)
+    if encode_codec(messages, signatures) != data:
+        raise Exception("The codec and the primitive classes don't agree on the wire format.")
+
+    results = {
+        "encode": (rate(encode_primitives, messages), rate(encode_codec, messages, signatures)),
+        "decode": (rate(decode_primitives, data, messages), rate(decode_codec, data, messages, signatures)),
+    }
+
+    print(f"{messages} messages, {len(data)} bytes")
+    print(f"{'':8}{'primitives':>16}{'codec':>16}")
+    for name, (primitives, codec) in results.items():
+        print(f"{name:8}{messages / primitives:>12,.0f} /s{messages / codec:>12,.0f} /s  {primitives / codec:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
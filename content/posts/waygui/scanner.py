@@ -0,0 +1,307 @@
+"""
+Generates `Proxy` subclasses from Wayland protocol XML, much like wayland-scanner does for C. Every request becomes a
+method that writes its message straight into the connection's send buffer, with one precompiled struct for each run of
+integer arguments (the first one including the header). Events are decoded through a table indexed by opcode.
+
+Generated code is cached by the hash of the XML (and of this file), so it's only generated again when either changes:
+
+    python scanner.py [protocol.xml ...]
+"""
+import hashlib
+import importlib.util
+import keyword
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+from pathlib import Path
+from types import ModuleType
+from typing import List, Tuple
+
+# Where distributions install the XML (wayland-devel and wayland-protocols-devel on Fedora).
+PROTOCOLS = [
+    Path("/usr/share/wayland/wayland.xml"),
+    Path("/usr/share/wayland-protocols/stable/xdg-shell/xdg-shell.xml"),
+]
+CACHE_DIR = Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "waygui"
+
+INTEGER_FORMATS = {"int": "i", "uint": "I", "fixed": "i", "object": "I", "new_id": "I"}
+TYPE_HINTS = {"int": "int", "uint": "int", "fixed": "float", "string": "str", "array": "bytes", "fd": "int"}
+
+
+def class_name(interface: str) -> str:
+    return "".join(part.capitalize() for part in interface.split("_"))
+
+
+def identifier(name: str) -> str:
+    return name + "_" if keyword.iskeyword(name) or name == "self" else name
+
+
+def summary(element: ElementTree.Element) -> str | None:
+    description = element.find("description")
+    if description is None or not description.get("summary"):
+        return None
+    return description.get("summary").replace("\\", "\\\\").replace('"', '\\"').strip()
+
+
+class Generator:
+    def __init__(self, root: ElementTree.Element):
+        self.root = root
+        self.interfaces = {interface.get("name") for interface in root.iter("interface")}
+        self.constants: List[str] = []
+        self.decoders: List[str] = []
+
+    def struct(self, name: str, fmt: str) -> str:
+        self.constants.append(f'{name} = struct.Struct("={fmt}")')
+        return name
+
+    def proxy_class(self, interface: str) -> str:
+        # Interfaces from other protocols are looked up when they're needed, their module may well be loaded later.
+        return class_name(interface) if interface in self.interfaces else f'INTERFACES["{interface}"]'
+
+    def generate(self, source: str) -> str:
+        classes = [self.interface(interface) for interface in self.root.iter("interface")]
+        return "\n".join([
+            f"# Generated by scanner.py from {source}, edits will be lost.",
+            "from __future__ import annotations",
+            "",
+            "import struct",
+            "from enum import IntEnum, IntFlag",
+            "",
+            "from waygui import INTERFACES, UINT32, Proxy",
+            "",
+            "ZEROS = bytes(4)",
+            *self.constants,
+            # Decoders go first, the classes refer to them in their dispatch tables.
+            *self.decoders,
+            *classes,
+        ])
+
+    def interface(self, interface: ElementTree.Element) -> str:
+        name = interface.get("name")
+        lines = ["", "", f"class {class_name(name)}(Proxy):"]
+        if doc := summary(interface):
+            lines.append(f'    """{doc}"""')
+        lines += [f'    interface = "{name}"', f"    version = {interface.get('version', 1)}"]
+
+        for enum in interface.findall("enum"):
+            base = "IntFlag" if enum.get("bitfield") == "true" else "IntEnum"
+            lines += ["", f"    class {class_name(enum.get('name'))}({base}):"]
+            for entry in enum.findall("entry"):
+                entry_name = entry.get("name").upper()
+                lines.append(f"        {'_' if entry_name[0].isdigit() else ''}{entry_name} = {entry.get('value')}")
+
+        for opcode, request in enumerate(interface.findall("request")):
+            lines += [""] + self.request(name, opcode, request)
+
+        events = [self.event(name, event) for event in interface.findall("event")]
+        if events:
+            lines += ["", "    events = ("]
+            lines += [f'        ("{event}", {decoder}, {always}),' for event, decoder, always, _ in events]
+            lines.append("    )")
+
+        for *_, decoder_code in events:
+            self.decoders += ["", ""] + decoder_code
+        return "\n".join(lines)
+
+    def request(self, interface: str, opcode: int, request: ElementTree.Element) -> List[str]:
+        params = ["self"]
+        body = []
+        # The class of the object the request creates, if any, and the name it has in the method.
+        returns = new_id = None
+        # Runs of integer arguments as `(format, expression)` pairs, with strings and arrays in between. File descriptors
+        # aren't part of the payload, so they don't interrupt a run.
+        segments: List[list | str] = [[]]
+        fds = []
+
+        def integer(fmt: str, expression: str):
+            if not isinstance(segments[-1], list):
+                segments.append([])
+            segments[-1].append((fmt, expression))
+
+        for arg in request.findall("arg"):
+            name, arg_type = identifier(arg.get("name")), arg.get("type")
+            nullable = arg.get("allow-null") == "true"
+
+            if arg_type == "new_id":
+                new_id = name
+                if arg_interface := arg.get("interface"):
+                    returns = self.proxy_class(arg_interface)
+                    body.append(f"{name} = {returns}(self.connection)")
+                else:
+                    # Without an interface in the XML (like wl_registry.bind), it's sent along with its version.
+                    returns = "Proxy"
+                    params += ["interface: type[Proxy]", "version: int"]
+                    body += [f"{name} = interface(self.connection)", "_interface = interface.interface.encode() + b'\\0'"]
+                    segments.append("_interface")
+                    integer("I", "version")
+                integer("I", f"{name}.obj_id")
+            elif arg_type == "object":
+                params.append(f"{name}: Proxy{' | None' if nullable else ''}")
+                integer("I", f"({name}.obj_id if {name} is not None else 0)" if nullable else f"{name}.obj_id")
+            elif arg_type in ("int", "uint", "fixed"):
+                params.append(f"{name}: {TYPE_HINTS[arg_type]}")
+                integer(INTEGER_FORMATS[arg_type], f"round({name} * 256)" if arg_type == "fixed" else name)
+            elif arg_type == "string":
+                params.append(f"{name}: str{' | None' if nullable else ''}")
+                if nullable:
+                    body.append(f"_{name} = b'' if {name} is None else {name}.encode() + b'\\0'")
+                else:
+                    body.append(f"_{name} = {name}.encode() + b'\\0'")
+                segments.append(f"_{name}")
+            elif arg_type == "array":
+                params.append(f"{name}: bytes")
+                segments.append(name)
+            elif arg_type == "fd":
+                params.append(f"{name}: int")
+                fds.append(name)
+            else:
+                raise Exception(f"Unknown argument type '{arg_type}' in {interface}.{request.get('name')}.")
+
+        constant = f"_{interface}_{request.get('name')}".upper()
+        prefix = segments[0]
+        fixed_size = 8 + 4 * sum(len(segment) for segment in segments if isinstance(segment, list))
+        variable = [segment for segment in segments if isinstance(segment, str)]
+
+        if variable:
+            body.append(f"_size = {' + '.join([str(fixed_size)] + [f'(len({v}) + 7 & ~3)' for v in variable])}")
+            size, header = "_size", f"_size << 16 | {opcode}" if opcode else "_size << 16"
+        else:
+            size, header = str(fixed_size), hex(fixed_size << 16 | opcode)
+
+        prefix_struct = self.struct(constant, "II" + "".join(fmt for fmt, _ in prefix))
+        body += [
+            f"_writer = self.connection.queue({size}, {len(fds)})",
+            "_buffer, _offset = _writer.buffer, _writer.length",
+            f"{prefix_struct}.pack_into(_buffer, _offset, {', '.join(['self.obj_id', header] + [e for _, e in prefix])})",
+        ]
+        if len(segments) > 1:
+            body.append(f"_offset += {8 + 4 * len(prefix)}")
+
+        for i, segment in enumerate(segments[1:], 1):
+            if isinstance(segment, list):
+                run = self.struct(f"{constant}_{i}", "".join(fmt for fmt, _ in segment))
+                body += [
+                    f"{run}.pack_into(_buffer, _offset, {', '.join(e for _, e in segment)})",
+                    f"_offset += {4 * len(segment)}",
+                ]
+            else:
+                body += [
+                    f"_n = len({segment})",
+                    "UINT32.pack_into(_buffer, _offset, _n)",
+                    f"_buffer[_offset + 4:_offset + 4 + _n] = {segment}",
+                    "_buffer[_offset + 4 + _n:_offset + 4 + (_n + 3 & ~3)] = ZEROS[:-_n & 3]",
+                    "_offset += 4 + (_n + 3 & ~3)",
+                ]
+        # Nothing comes after the last one.
+        if body[-1].startswith("_offset +="):
+            body.pop()
+        if fds:
+            body.append(f"_writer.fds.append({fds[0]})" if len(fds) == 1 else f"_writer.fds.extend(({', '.join(fds)}))")
+        body.append(f"_writer.length += {size}")
+        if returns:
+            body.append(f"return {new_id}")
+
+        lines = [f"    def {identifier(request.get('name'))}({', '.join(params)}){f' -> {returns}' if returns else ''}:"]
+        if doc := summary(request):
+            lines.append(f'        """{doc}"""')
+        return lines + [f"        {line}" for line in body]
+
+    def event(self, interface: str, event: ElementTree.Element) -> Tuple[str, str, bool, List[str]]:
+        decoder = f"_decode_{interface}_{event.get('name')}"
+        body = []
+        results = []
+        run: List[Tuple[str, str]] = []
+        runs = []
+        # File descriptors are received in order, but aren't part of the payload.
+        pops = []
+        always = False
+
+        def flush_run():
+            if run:
+                runs.append(self.struct(f"{decoder.upper()}_{len(runs)}", "".join(fmt for fmt, _ in run)))
+                names = ", ".join(name for _, name in run)
+                body.append(f"{names}{',' if len(run) == 1 else ''} = {runs[-1]}.unpack_from(data, offset)")
+                body.append(f"offset += {4 * len(run)}")
+                run.clear()
+
+        for arg in event.findall("arg"):
+            name, arg_type = "arg_" + arg.get("name"), arg.get("type")
+            if arg_type in INTEGER_FORMATS:
+                run.append((INTEGER_FORMATS[arg_type], name))
+                if arg_type == "fixed":
+                    results.append(f"{name} / 256")
+                elif arg_type == "object":
+                    results.append(f"proxy.connection.objects.get({name})")
+                elif arg_type == "new_id":
+                    always = True
+                    results.append(f"{self.proxy_class(arg.get('interface'))}(proxy.connection, {name})")
+                else:
+                    results.append(name)
+                continue
+
+            if arg_type == "fd":
+                always = True
+                pops.append(f"{name} = fds.popleft()")
+            elif arg_type in ("string", "array"):
+                flush_run()
+                body.append("n, = UINT32.unpack_from(data, offset)")
+                if arg_type == "string":
+                    body.append(f"{name} = str(data[offset + 4:offset + 3 + n], 'utf8') if n else None")
+                else:
+                    body.append(f"{name} = data[offset + 4:offset + 4 + n]")
+                body.append("offset += 4 + (n + 3 & ~3)")
+            else:
+                raise Exception(f"Unknown argument type '{arg_type}' in {interface}.{event.get('name')}.")
+            results.append(name)
+
+        if not results:
+            body = ["return ()"]
+        elif not body and not pops and results == [name for _, name in run]:
+            # The common case of nothing but plain integers, they're returned just as they're unpacked.
+            constant = self.struct(f"{decoder.upper()}_0", "".join(fmt for fmt, _ in run))
+            body = [f"return {constant}.unpack_from(data, offset)"]
+        else:
+            flush_run()
+            # Nothing comes after the last one.
+            if body[-1].startswith("offset +="):
+                body.pop()
+            body = pops + body + [f"return {', '.join(results)}{',' if len(results) == 1 else ''}"]
+
+        code = [f"def {decoder}(proxy, data, offset, fds):"] + [f"    {line}" for line in body]
+        return event.get("name"), decoder, always, code
+
+
+def load_protocol(xml_path: Path, cache_dir: Path = CACHE_DIR) -> ModuleType:
+    """
+    Imports the classes generated from `xml_path`, generating them first unless they're cached already.
+    """
+    xml = xml_path.read_bytes()
+    digest = hashlib.sha256(xml + Path(__file__).read_bytes()).hexdigest()[:16]
+    stem = xml_path.stem.replace("-", "_")
+    module_path = cache_dir / f"{stem}_{digest}.py"
+
+    if not module_path.is_file():
+        code = Generator(ElementTree.fromstring(xml)).generate(xml_path.name)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = module_path.with_name(f".{module_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(code)
+        tmp_path.replace(module_path)
+        # Whatever was generated from an older version of the XML won't be needed again.
+        for old_path in cache_dir.glob(f"{stem}_*.py"):
+            if old_path != module_path and len(old_path.stem) == len(module_path.stem):
+                old_path.unlink(missing_ok=True)
+
+    spec = importlib.util.spec_from_file_location(module_path.stem, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    for xml_path in map(Path, sys.argv[1:]) if len(sys.argv) > 1 else PROTOCOLS:
+        module = load_protocol(xml_path)
+        print(f"{xml_path} -> {module.__file__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+Checks `Connection` and `ShmPool` in `waygui.py` end to end, against a fake compositor on the other end of a
+`socket.socketpair()`. Run it from this directory:
+
+    python test_waygui.py
+"""
+import array
+import mmap
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from typing import Callable, Dict, List, Set, Tuple
+
+from waygui import *
+
+REGISTRY_GLOBAL = Signature(UInt32, String, UInt32)
+# A made up interface for passing file descriptors around: a request with a file to read, and an event with what was
+# read and a file descriptor for a new file with the same contents.
+ECHO = 50
+ECHO_REQUEST = Signature(Fd)
+ECHO_EVENT = Signature(String, Fd)
+# Stands in for attaching a buffer to a surface and committing it, which takes a whole window to do for real.
+COMMIT = 99
+COMMIT_REQUEST = Signature(UInt32)
+
+
+class FakeCompositor:
+    """
+    Reads requests off its end of the socket in a thread and answers them with whatever the handler for the request's
+    (object, opcode) writes. Sends answers in 7 byte pieces, so that the client has to put messages back together.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.fds: List[int] = []
+        # Every request received, as (object, opcode, payload).
+        self.requests: List[Tuple[int, int, bytes]] = []
+        # How many times the client's requests arrived in a separate piece.
+        self.receives = 0
+        self.handlers: Dict[Tuple[int, int], Callable[[memoryview, MessageWriter], None]] = {
+            (1, 0): self.sync,
+            (1, 1): self.get_registry,
+            (ECHO, 0): self.echo,
+        }
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        buffer = b""
+        while True:
+            data, ancillary, _, _ = self.sock.recvmsg(0x10000, socket.CMSG_SPACE(Connection.MAX_FDS * 4))
+            if not data:
+                return
+            self.receives += 1
+            for _, _, fd_data in ancillary:
+                fds = array.array("i")
+                fds.frombytes(fd_data)
+                self.fds.extend(fds)
+
+            buffer += data
+            while (header := read_header(memoryview(buffer))) is not None and len(buffer) >= header[2]:
+                obj_id, opcode, size = header
+                message, buffer = memoryview(buffer[:size]), buffer[size:]
+                self.requests.append((obj_id, opcode, bytes(message[HEADER.size:])))
+
+                writer = MessageWriter()
+                if (handler := self.handlers.get((obj_id, opcode))) is not None:
+                    handler(message, writer)
+                self.send(writer)
+
+    def send(self, writer: MessageWriter):
+        data = bytes(writer.getbuffer())
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", writer.fds))] if writer.fds else []
+        for i in range(0, len(data), 7):
+            # File descriptors go with the first piece.
+            self.sock.sendmsg([data[i:i + 7]], ancillary if not i else [])
+        for fd in writer.fds:
+            os.close(fd)
+
+    def sync(self, message: memoryview, writer: MessageWriter):
+        callback, = Signature(NewID).decode(message, HEADER.size)
+        writer.write(Signature(UInt32), callback, 0, 0)
+        writer.write(Signature(UInt32), 1, 1, callback)
+
+    def get_registry(self, message: memoryview, writer: MessageWriter):
+        registry, = Signature(NewID).decode(message, HEADER.size)
+        # Enough of them to take several reads.
+        for name, interface in enumerate(["wl_compositor", "wl_shm", "xdg_wm_base"] * 1000):
+            writer.write(REGISTRY_GLOBAL, registry, 0, name, interface, 4)
+
+    def echo(self, message: memoryview, writer: MessageWriter):
+        fd = self.fds.pop(0)
+        text = os.pread(fd, 100, 0)
+        os.close(fd)
+        echoed = tempfile.TemporaryFile()
+        echoed.write(text)
+        echoed.flush()
+        writer.write(ECHO_EVENT, ECHO, 0, text.decode(), os.dup(echoed.fileno()))
+        echoed.close()
+
+    def open_fds(self, count: int) -> List[int]:
+        # Descriptors for the client to receive, each to a file of its own.
+        fds = []
+        for _ in range(count):
+            with tempfile.TemporaryFile() as file:
+                fds.append(os.dup(file.fileno()))
+        return fds
+
+
+class ShmCompositor(FakeCompositor):
+    """
+    Implements enough of `wl_shm` to check `ShmPool` against: maps the pool through the file descriptor it was created
+    with, like a real compositor does, and reads a buffer's pixels out of it when it's committed, then releases it.
+    """
+
+    def __init__(self, sock: socket.socket, shm: int):
+        super().__init__(sock)
+        self.handlers[(shm, 0)] = self.create_pool
+        self.handlers[(COMMIT, 0)] = self.commit
+        self.pool_fd: int | None = None
+        self.memory: mmap.mmap | None = None
+        # Buffer ID -> (offset, width, height, stride), for the buffers that haven't been destroyed.
+        self.buffers: Dict[int, Tuple[int, int, int, int]] = {}
+        # The pixels of every buffer committed, as (buffer ID, pixels).
+        self.committed: List[Tuple[int, List[int]]] = []
+        self.destroyed: List[int] = []
+
+    def create_pool(self, message: memoryview, writer: MessageWriter):
+        pool, size = Signature(NewID, Int32).decode(message, HEADER.size)
+        self.pool_fd = self.fds.pop(0)
+        self.memory = mmap.mmap(self.pool_fd, size)
+        self.handlers[(pool, 0)] = self.create_buffer
+        self.handlers[(pool, 1)] = self.destroy_pool
+        self.handlers[(pool, 2)] = self.resize
+
+    def create_buffer(self, message: memoryview, writer: MessageWriter):
+        buffer, offset, width, height, stride, _ = Signature(NewID, Int32, Int32, Int32, Int32, UInt32).decode(
+            message, HEADER.size
+        )
+        if offset + stride * height > len(self.memory):
+            raise Exception(f"Buffer {buffer} doesn't fit in the pool.")
+        self.buffers[buffer] = (offset, width, height, stride)
+        self.handlers[(buffer, 0)] = self.destroy_buffer
+
+    def resize(self, message: memoryview, writer: MessageWriter):
+        size, = Signature(Int32).decode(message, HEADER.size)
+        self.memory.close()
+        self.memory = mmap.mmap(self.pool_fd, size)
+
+    def destroy_pool(self, message: memoryview, writer: MessageWriter):
+        self.memory.close()
+        os.close(self.pool_fd)
+        self.pool_fd = None
+
+    def destroy_buffer(self, message: memoryview, writer: MessageWriter):
+        buffer = read_header(message)[0]
+        del self.buffers[buffer]
+        self.destroyed.append(buffer)
+        writer.write(Signature(UInt32), 1, 1, buffer)
+
+    def commit(self, message: memoryview, writer: MessageWriter):
+        buffer, = COMMIT_REQUEST.decode(message, HEADER.size)
+        offset, _, height, stride = self.buffers[buffer]
+        self.committed.append((buffer, array.array("I", self.memory[offset:offset + stride * height]).tolist()))
+        # Done reading it already, a real compositor would hold on to it until it has something newer to show.
+        writer.write(Signature(), buffer, 0)
+
+
+def temporary_file(contents: bytes):
+    file = tempfile.TemporaryFile()
+    file.write(contents)
+    file.flush()
+    return file
+
+
+def open_files() -> Set[int]:
+    # The inodes of every file this process has a descriptor for.
+    inodes = set()
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            inodes.add(os.stat(int(fd)).st_ino)
+        except OSError:
+            # The one `listdir()` had open.
+            pass
+    return inodes
+
+
+class ConnectionTest(unittest.TestCase):
+    def setUp(self):
+        client, server = socket.socketpair()
+        self.compositor = FakeCompositor(server)
+        self.connection = Connection(client)
+
+    def tearDown(self):
+        self.connection.close()
+        self.compositor.thread.join(5)
+        self.compositor.sock.close()
+
+    def test_roundtrip(self):
+        globals_ = []
+        registry = self.connection.new_id()
+        self.connection.listen(registry, 0, REGISTRY_GLOBAL, lambda *args: globals_.append(args))
+        self.connection.request(1, 1, Signature(NewID), registry)
+        self.connection.roundtrip()
+
+        # Every global has arrived by the time the roundtrip is done, even though they came in 7 byte pieces.
+        self.assertEqual(len(globals_), 3000)
+        self.assertEqual(globals_[0], (0, "wl_compositor", 4))
+        self.assertEqual(globals_[-1], (2999, "xdg_wm_base", 4))
+        # The compositor deleted the roundtrip's callback, so its ID is up for grabs again.
+        callback = registry + 1
+        self.assertEqual(self.connection.free_ids, [callback])
+        self.assertNotIn((callback, 0), self.connection.listeners)
+        self.assertEqual(self.connection.new_id(), callback)
+
+    def test_batched_sends(self):
+        for i in range(100):
+            self.connection.request(ECHO + 1, 0, Signature(UInt32, String), i, "queued")
+        # Nothing goes out until flushed.
+        self.assertEqual(self.compositor.requests, [])
+
+        self.connection.roundtrip()
+        self.assertEqual(len(self.compositor.requests), 101)
+        self.assertEqual([UINT32.unpack_from(payload)[0] for _, _, payload in self.compositor.requests[:100]],
+                         list(range(100)))
+        # All of them (and the roundtrip's sync) went out with a single send.
+        self.assertEqual(self.compositor.receives, 1)
+
+    def test_batched_sends_split_file_descriptors(self):
+        files = [temporary_file(b"") for _ in range(Connection.MAX_FDS + 2)]
+        for file in files:
+            self.connection.request(ECHO + 1, 0, Signature(Fd), file.fileno())
+        self.connection.roundtrip()
+
+        # No more file descriptors go with a send than the compositor accepts, the rest go with the next one.
+        self.assertEqual(len(self.compositor.fds), len(files))
+        self.assertEqual(self.compositor.receives, 2)
+        for fd in self.compositor.fds:
+            os.close(fd)
+        for file in files:
+            file.close()
+
+    def test_file_descriptor_passing(self):
+        echoed = []
+        self.connection.listen(ECHO, 0, ECHO_EVENT, lambda text, fd: echoed.append((text, fd)))
+        with temporary_file(b"Sent through a file descriptor") as file:
+            self.connection.request(ECHO, 0, ECHO_REQUEST, file.fileno())
+            self.connection.run(lambda: echoed)
+
+        # A different descriptor that refers to a file with the same contents.
+        text, fd = echoed[0]
+        self.assertEqual(text, "Sent through a file descriptor")
+        self.assertEqual(os.pread(fd, 100, 0), b"Sent through a file descriptor")
+        os.close(fd)
+
+    def test_dropped_events_close_their_file_descriptors(self):
+        dropped, kept = self.compositor.open_fds(2)
+        dropped_file = os.fstat(dropped).st_ino
+        writer = MessageWriter()
+        # Nothing wants the first one, only the second one's descriptor is for the listener.
+        writer.write(ECHO_EVENT, ECHO, 0, "dropped", dropped)
+        writer.write(ECHO_EVENT, ECHO + 1, 0, "kept", kept)
+        self.compositor.send(writer)
+
+        received = []
+        self.connection.listen(ECHO, 0, ECHO_EVENT, None)
+        self.connection.listen(ECHO + 1, 0, ECHO_EVENT, lambda text, fd: received.append((text, fd)))
+        self.connection.run(lambda: received)
+
+        text, fd = received[0]
+        self.assertEqual(text, "kept")
+        self.assertEqual(list(self.connection.fds), [])
+        self.assertNotIn(dropped_file, open_files())
+        os.close(fd)
+
+    def test_dropped_proxy_events_close_their_file_descriptors(self):
+        class Keyboard(Proxy):
+            interface = "test_keyboard"
+            events = (("keymap", lambda proxy, data, offset, fds: (fds.popleft(),), True),)
+
+        keyboard = Keyboard(self.connection)
+        keymap, = self.compositor.open_fds(1)
+        keymap_file = os.fstat(keymap).st_ino
+        writer = MessageWriter()
+        writer.write(Signature(Fd), keyboard.obj_id, 0, keymap)
+        self.compositor.send(writer)
+        # Nothing listens for the keymap.
+        self.connection.roundtrip()
+
+        self.assertEqual(list(self.connection.fds), [])
+        self.assertNotIn(keymap_file, open_files())
+        INTERFACES.pop(Keyboard.interface)
+
+
+class ShmPoolTest(unittest.TestCase):
+    def setUp(self):
+        client, server = socket.socketpair()
+        self.connection = Connection(client)
+        shm = self.connection.new_id()
+        self.compositor = ShmCompositor(server, shm)
+        self.pool = ShmPool(self.connection, shm, 4, 3)
+
+    def tearDown(self):
+        self.connection.close()
+        self.compositor.thread.join(5)
+        self.compositor.sock.close()
+
+    def draw(self, frame: Frame, color: int):
+        with self.pool.pixels(frame) as pixels, pixels.cast("I") as pixels:
+            pixels[:] = array.array("I", [color] * (frame.width * frame.height))
+
+    def commit(self, frame: Frame):
+        self.connection.request(COMMIT, 0, COMMIT_REQUEST, frame.obj_id)
+        self.connection.roundtrip()
+
+    def test_frames_are_shared_with_the_compositor(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        self.draw(first, 0xFF0000)
+        self.draw(second, 0x00FF00)
+        self.commit(first)
+        self.commit(second)
+
+        # What was written through the client's mapping is what the compositor reads through its own.
+        self.assertEqual(self.compositor.committed, [(first.obj_id, [0xFF0000] * 12), (second.obj_id, [0x00FF00] * 12)])
+        self.assertEqual((first.offset, second.offset), (0, 4 * 4 * 3))
+
+    def test_frames_are_only_reused_once_released(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        # Double buffered, so both are in use.
+        self.assertIsNone(self.pool.acquire())
+
+        self.draw(first, 0xFF0000)
+        self.commit(first)
+        self.assertFalse(first.busy)
+        self.assertTrue(second.busy)
+        self.assertIs(self.pool.acquire(), first)
+
+    def test_reconfigure(self):
+        shown = self.pool.acquire()
+        unused = next(frame for frame in self.pool.frames if frame is not shown)
+
+        # The compositor still has the shown frame, the other one can go right away.
+        self.pool.configure(8, 8)
+        self.connection.roundtrip()
+        self.assertEqual(self.compositor.destroyed, [unused.obj_id])
+        self.assertTrue(shown.stale)
+        self.assertEqual(self.pool.frames[0], shown)
+
+        # New frames go after the shown one, the pool grows to make room for them, and the compositor reads them
+        # through its remapped pool.
+        frame = self.pool.acquire()
+        self.assertEqual(frame.offset, shown.offset + shown.size)
+        self.assertEqual(self.pool.size, shown.size + 2 * 8 * 8 * 4)
+        self.draw(frame, 0x0000FF)
+        self.commit(frame)
+        self.assertEqual(self.compositor.committed[-1], (frame.obj_id, [0x0000FF] * 64))
+
+        # Once the shown frame is released, it's destroyed rather than reused. That request goes out with the next flush.
+        self.commit(shown)
+        self.connection.roundtrip()
+        self.assertNotIn(shown, self.pool.frames)
+        self.assertEqual(self.compositor.destroyed, [unused.obj_id, shown.obj_id])
+
+    def test_destroy(self):
+        self.pool.destroy()
+        self.connection.roundtrip()
+
+        self.assertEqual(self.compositor.buffers, {})
+        self.assertIsNone(self.compositor.pool_fd)
+        self.assertTrue(self.pool.memory.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
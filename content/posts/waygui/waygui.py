@@ -1,8 +1,13 @@
+import array
+import mmap
 import os
+import selectors
 import socket
 import struct
+from collections import deque
 from dataclasses import dataclass
 from io import BytesIO
+from typing import Callable, Dict, List, Sequence, Tuple
 
 
 class WlPrimitive:
@@ -133,6 +138,191 @@ class Message:
         return self.header.serialize() + self.payload
 
 
+# The classes above spell out the wire format one argument at a time, which is easy to follow but allocates a Python
+# object (and a `bytes` one or two) per argument. What follows encodes and decodes the same format straight into and out
+# of buffers with precompiled structs: one for an entire message when encoding, one per run of integers when decoding.
+
+HEADER = struct.Struct("=II")
+UINT32 = struct.Struct("=I")
+
+
+class Signature:
+    """
+    The argument types of a request or event, compiled for encoding and decoding its payload with precompiled structs.
+
+    Arguments are plain Python values rather than the primitives above: `int` for integers and objects, `str` (or None
+    for a null string) for strings, any bytes-like object for arrays and `int` for file descriptors.
+    """
+
+    # Encoding structs kept per signature, one for each combination of string and array lengths seen.
+    MAX_STRUCTS = 256
+
+    def __init__(self, *types: type[WlPrimitive]):
+        self.types = types
+        # `String`, `Array`, `Fd` or None for an integer, for each argument. Fd has to be checked before UInt32, as it
+        # subclasses it but isn't sent in the payload.
+        self.kinds = []
+        for arg_type in types:
+            for kind in (Fd, String, Array, Int32, UInt32):
+                if issubclass(arg_type, kind):
+                    self.kinds.append(kind if kind in (Fd, String, Array) else None)
+                    break
+            else:
+                raise TypeError(f"Can't encode arguments of type {arg_type.__name__}.")
+        self.fd_count = self.kinds.count(Fd)
+
+        # Encoded with a single struct for the whole message, header included. A string or array becomes its length
+        # followed by an "s" field padded to a multiple of 4 bytes, which struct fills with null bytes (taking care of
+        # the null terminator as well). Their lengths vary, so the format has a placeholder for each.
+        self.format = "=II" + "".join(
+            {None: "i" if issubclass(arg_type, Int32) else "I", Fd: "", String: "I{}s", Array: "I{}s"}[kind]
+            for arg_type, kind in zip(types, self.kinds)
+        )
+        self.fixed = all(kind is None for kind in self.kinds)
+        self.structs: Dict[Tuple[int, ...], struct.Struct] = {}
+
+        # Decoded with one struct for each run of integers, and one step for each string, array or file descriptor
+        # in between. The first run goes into `prefix`, what comes after into `steps`.
+        steps = []
+        run = prefix = [""]
+        for arg_type, kind in zip(types, self.kinds):
+            if kind is not None:
+                steps.append(kind)
+                run = None
+            else:
+                if run is None:
+                    run = [""]
+                    steps.append(run)
+                run[0] += "i" if issubclass(arg_type, Int32) else "I"
+        self.prefix = struct.Struct("=" + prefix[0])
+        self.steps = [struct.Struct("=" + step[0]) if isinstance(step, list) else step for step in steps]
+
+    def packer(self, lengths: Tuple[int, ...]) -> struct.Struct:
+        if (packer := self.structs.get(lengths)) is None:
+            if len(self.structs) >= self.MAX_STRUCTS:
+                self.structs.clear()
+            packer = struct.Struct(self.format.format(*(length + padding(length) for length in lengths)))
+            if packer.size > 0xFFFF:
+                raise ValueError(f"A message can't be larger than 65535 bytes, this one is {packer.size} bytes.")
+            self.structs[lengths] = packer
+        return packer
+
+    def encode(self, buffer: bytearray, offset: int, obj_id: int, opcode: int, args: Sequence,
+               fds: List[int]) -> int:
+        """
+        Writes a message into `buffer` at `offset`, growing it if it's too small.
+
+        :param fds: File descriptor arguments are appended to this, they're sent as ancillary data.
+        :return: The offset just past the message.
+        """
+        if len(args) != len(self.types):
+            raise TypeError(f"Expected {len(self.types)} arguments, got {len(args)}.")
+
+        if self.fixed:
+            packer = self.packer(())
+            if len(buffer) < offset + packer.size:
+                reserve(buffer, offset + packer.size)
+            packer.pack_into(buffer, offset, obj_id, (packer.size << 16) | opcode, *args)
+            return offset + packer.size
+
+        values = [obj_id, opcode]
+        lengths = []
+        for arg, kind in zip(args, self.kinds):
+            if kind is None:
+                values.append(arg)
+            elif kind is Fd:
+                fds.append(arg)
+            else:
+                if kind is String:
+                    # A null string is sent as a length of 0, anything else is one longer for its null terminator.
+                    if arg is None:
+                        arg, length = b"", 0
+                    else:
+                        arg = arg.encode("utf8")
+                        length = len(arg) + 1
+                else:
+                    arg = arg if isinstance(arg, bytes) else bytes(arg)
+                    length = len(arg)
+                values += (length, arg)
+                lengths.append(length)
+
+        packer = self.packer(tuple(lengths))
+        values[1] |= packer.size << 16
+        if len(buffer) < offset + packer.size:
+            reserve(buffer, offset + packer.size)
+        packer.pack_into(buffer, offset, *values)
+        return offset + packer.size
+
+    def decode(self, data: memoryview, offset: int, fds: deque | None = None) -> Sequence:
+        """
+        Reads the payload of a message from `data`, starting at `offset` (just past its header). Arrays are returned as
+        slices of `data`, so they're only valid until the buffer behind it is reused.
+
+        :param fds: File descriptors received alongside the message, one is taken for each file descriptor argument.
+        """
+        if not self.steps:
+            return self.prefix.unpack_from(data, offset)
+
+        args = list(self.prefix.unpack_from(data, offset))
+        offset += self.prefix.size
+        for step in self.steps:
+            if step is Fd:
+                args.append(fds.popleft())
+            elif step is String or step is Array:
+                size, = UINT32.unpack_from(data, offset)
+                offset += 4
+                if step is String:
+                    args.append(str(data[offset:offset + size - 1], "utf8") if size else None)
+                else:
+                    args.append(data[offset:offset + size])
+                offset += size + padding(size)
+            else:
+                args.extend(step.unpack_from(data, offset))
+                offset += step.size
+        return args
+
+
+def reserve(buffer: bytearray, size: int):
+    # Grown to at least double its size, so writing a batch of messages doesn't resize it over and over.
+    if len(buffer) < size:
+        buffer.extend(bytes(max(size, 2 * len(buffer)) - len(buffer)))
+
+
+def read_header(data: memoryview, offset: int = 0) -> Tuple[int, int, int] | None:
+    """
+    :return: The object ID, opcode and size of the message at `offset`, or None if `data` doesn't hold all of its
+    header yet.
+    """
+    if len(data) - offset < HEADER.size:
+        return None
+    obj_id, size_and_opcode = HEADER.unpack_from(data, offset)
+    return obj_id, size_and_opcode & 0xFFFF, size_and_opcode >> 16
+
+
+class MessageWriter:
+    """
+    Accumulates outgoing messages in one reusable buffer, so a batch of them goes out with a single send.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.buffer = bytearray(capacity)
+        self.length = 0
+        self.fds: List[int] = []
+
+    def write(self, signature: Signature, obj_id: int, opcode: int, *args):
+        """
+        Appends a message, its file descriptor arguments are collected in `fds`.
+        """
+        self.length = signature.encode(self.buffer, self.length, obj_id, opcode, args, self.fds)
+
+    def getbuffer(self) -> memoryview:
+        return memoryview(self.buffer)[:self.length]
+
+    def clear(self):
+        self.length = 0
+        self.fds.clear()
+
+
 def setup_socket():
     sock = socket.socket(family=socket.AF_UNIX, type=socket.SOCK_STREAM, proto=0)
 
@@ -146,8 +336,397 @@ def setup_socket():
     return sock
 
 
+class Proxy:
+    """
+    The client's end of a protocol object. Subclasses for each interface are generated from protocol XML by
+    `scanner.py`, which adds a method for each request and the decoders for its events.
+    """
+
+    # The interface's name and version in the protocol XML.
+    interface = ""
+    version = 0
+    # For each event, indexed by opcode: its name, its decoder, and whether it has to be decoded even when nothing
+    # listens for it (when it carries file descriptors or creates objects).
+    events: Tuple[Tuple[str, Callable, bool], ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        INTERFACES[cls.interface] = cls
+
+    def __init__(self, connection: "Connection", obj_id: int | None = None):
+        """
+        :param obj_id: For objects created by the compositor, or the display (which is always 1). A new ID otherwise.
+        """
+        self.connection = connection
+        self.obj_id = connection.new_id() if obj_id is None else obj_id
+        self.handlers: List[Callable | None] = [None] * len(self.events)
+        connection.objects[self.obj_id] = self
+
+    def on(self, event: str, callback: Callable):
+        for opcode, (name, _, _) in enumerate(self.events):
+            if name == event:
+                self.handlers[opcode] = callback
+                return
+        raise Exception(f"{self.interface} has no event named '{event}'.")
+
+    def dispatch(self, opcode: int, data: memoryview, offset: int, fds: deque):
+        if opcode >= len(self.events):
+            raise ConnectionError(f"Received event {opcode} for {self.interface}, which only has {len(self.events)}.")
+        callback = self.handlers[opcode]
+        _, decode, always = self.events[opcode]
+        if callback is not None:
+            callback(*decode(self, data, offset, fds))
+        elif always:
+            # Still creates the objects the event announces, and takes its file descriptors, nobody else will close them.
+            pending = list(fds)
+            decode(self, data, offset, fds)
+            for fd in pending[:len(pending) - len(fds)]:
+                os.close(fd)
+
+
+# Generated `Proxy` subclasses by interface name, so that protocols can refer to interfaces defined by other ones.
+INTERFACES: Dict[str, type[Proxy]] = {}
+
+
+class Connection:
+    """
+    A non-blocking connection to the compositor. Requests are only queued until `flush()` sends all of them at once,
+    events are read as they arrive and passed to whatever listens for them by `dispatch()`.
+    """
+
+    # The most file descriptors libwayland accepts alongside a single message.
+    MAX_FDS = 28
+    # Flushed once this much is queued, libwayland won't buffer more than that on its end either.
+    MAX_QUEUED = 4096
+
+    def __init__(self, sock: socket.socket | None = None):
+        """
+        :param sock: Any connected stream socket, one end of a `socket.socketpair()` works just as well. Connects to the
+        compositor given by the environment if omitted.
+        """
+        self.sock = sock or setup_socket()
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+        self.writer = MessageWriter()
+        # Received bytes sit in `buffer[start:end]`. Messages are decoded straight from it, so they have to be
+        # contiguous: rather than wrapping around, whatever partial message is left over moves back to the front.
+        self.buffer = bytearray(2 * 0x10000)
+        self.start = self.end = 0
+        self.fds: deque[int] = deque()
+
+        # Object 1 is always the display, the client picks IDs for everything it creates after that.
+        self.next_id = 2
+        self.free_ids: List[int] = []
+        self.listeners: Dict[Tuple[int, int], Tuple[Signature, Callable]] = {}
+        self.objects: Dict[int, Proxy] = {}
+
+        self.listen(1, 0, Signature(ObjID, UInt32, String), self.on_error)
+        self.listen(1, 1, Signature(UInt32), self.on_delete_id)
+
+    def fileno(self) -> int:
+        # So that it can be handed to `selectors` or `asyncio.get_running_loop().add_reader()` directly.
+        return self.sock.fileno()
+
+    def new_id(self) -> int:
+        if self.free_ids:
+            return self.free_ids.pop()
+        self.next_id += 1
+        return self.next_id - 1
+
+    def listen(self, obj_id: int, opcode: int, signature: Signature, callback: Callable | None):
+        """
+        Calls `callback` with the arguments of every `opcode` event the object `obj_id` receives. Array arguments point
+        into the receive buffer, they have to be copied if they're needed after `callback` returns, and file descriptors
+        are the callback's to close.
+
+        Events that carry file descriptors have to be listened to (with a `callback` of None to drop them) unless they're
+        for a `Proxy`, otherwise there's no telling how many of the descriptors received are theirs.
+        """
+        self.listeners[(obj_id, opcode)] = (signature, callback)
+
+    def request(self, obj_id: int, opcode: int, signature: Signature, *args):
+        self.queue(0, signature.fd_count).write(signature, obj_id, opcode, *args)
+
+    def queue(self, size: int, fd_count: int = 0) -> MessageWriter:
+        """
+        Makes room for a request of `size` bytes (at least) with `fd_count` file descriptors. Generated requests write
+        themselves into the returned writer directly, and bump its `length` past what they wrote.
+        """
+        # Whatever is queued goes first if this one wouldn't fit in the same send.
+        if self.writer.length >= self.MAX_QUEUED or len(self.writer.fds) + fd_count > self.MAX_FDS:
+            self.flush()
+        if len(self.writer.buffer) < self.writer.length + size:
+            reserve(self.writer.buffer, self.writer.length + size)
+        return self.writer
+
+    def flush(self):
+        """
+        Sends every queued request with as few `sendmsg()` calls as the socket allows, waiting for it to drain if it's
+        full. File descriptors go with the first one, the compositor receives duplicates of them, so they can be closed
+        once this returns.
+        """
+        data = self.writer.getbuffer()
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", self.writer.fds))] if self.writer.fds else []
+        try:
+            while data:
+                try:
+                    sent = self.sock.sendmsg([data], ancillary)
+                except BlockingIOError:
+                    self.wait(selectors.EVENT_WRITE)
+                    continue
+                data = data[sent:]
+                ancillary = []
+        finally:
+            data.release()
+        self.writer.clear()
+
+    def wait(self, events: int):
+        self.selector.modify(self.sock, events)
+        try:
+            self.selector.select()
+        finally:
+            self.selector.modify(self.sock, selectors.EVENT_READ)
+
+    def read(self) -> bool:
+        """
+        Reads whatever has arrived without blocking, along with any file descriptors sent with it.
+
+        :return: Whether anything was read.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.start > len(self.buffer) // 2:
+            self.buffer[:self.end - self.start] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, self.end - self.start
+        # Always room for at least the largest message there can be, so it only grows while a partial message sits past
+        # the middle.
+        if len(self.buffer) - self.end < 0xFFFF:
+            reserve(self.buffer, self.end + 0xFFFF)
+
+        view = memoryview(self.buffer)[self.end:]
+        try:
+            received, ancillary, flags, _ = self.sock.recvmsg_into([view], socket.CMSG_SPACE(self.MAX_FDS * 4))
+        except BlockingIOError:
+            return False
+        finally:
+            view.release()
+        if not received:
+            raise ConnectionError("The compositor closed the connection.")
+
+        for level, kind, data in ancillary:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds = array.array("i")
+                fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+                self.fds.extend(fds)
+        if flags & socket.MSG_CTRUNC:
+            raise ConnectionError("Received more file descriptors than there was room for.")
+
+        self.end += received
+        return True
+
+    def dispatch(self) -> int:
+        """
+        Reads what has arrived and passes every complete event to its listener, events nothing listens for are dropped
+        (closing whatever file descriptors they carry, as far as that's known, see `listen()`).
+
+        :return: The number of events dispatched.
+        """
+        self.read()
+        dispatched = 0
+        with memoryview(self.buffer) as view:
+            while (header := read_header(view[:self.end], self.start)) is not None:
+                obj_id, opcode, size = header
+                if size < HEADER.size:
+                    raise ConnectionError(f"Received a message of {size} bytes, which is smaller than its header.")
+                if self.end - self.start < size:
+                    break
+
+                if (listener := self.listeners.get((obj_id, opcode))) is not None:
+                    signature, callback = listener
+                    if callback is not None:
+                        callback(*signature.decode(view, self.start + HEADER.size, self.fds))
+                        dispatched += 1
+                    else:
+                        for _ in range(signature.fd_count):
+                            os.close(self.fds.popleft())
+                elif (proxy := self.objects.get(obj_id)) is not None:
+                    proxy.dispatch(opcode, view, self.start + HEADER.size, self.fds)
+                    dispatched += 1
+                self.start += size
+        return dispatched
+
+    def run(self, until: Callable[[], bool]):
+        """
+        Flushes the queued requests, then dispatches events as they arrive until `until()` is true.
+        """
+        self.flush()
+        while not until():
+            if not self.dispatch():
+                self.selector.select()
+
+    def roundtrip(self):
+        """
+        Waits for the compositor to handle every request sent so far, and for the events it sent in response.
+        """
+        done = []
+        callback = self.new_id()
+        self.listen(callback, 0, Signature(UInt32), done.append)
+        self.request(1, 0, Signature(NewID), callback)
+        self.run(lambda: done)
+
+    def on_error(self, obj_id: int, code: int, message: str):
+        raise ConnectionError(f"Protocol error {code} on object {obj_id}: {message}")
+
+    def on_delete_id(self, obj_id: int):
+        # The compositor is done with the object, so its ID can be used for a new one.
+        for key in [key for key in self.listeners if key[0] == obj_id]:
+            del self.listeners[key]
+        self.objects.pop(obj_id, None)
+        self.free_ids.append(obj_id)
+
+    def close(self):
+        self.selector.close()
+        self.sock.close()
+        for fd in self.fds:
+            os.close(fd)
+        self.fds.clear()
+
+
+# Pixel formats for `wl_shm` buffers, every compositor supports these two. Both are 4 bytes per pixel, in native byte
+# order, so a frame can be written a pixel at a time through `memoryview.cast("I")`.
+SHM_FORMAT_ARGB8888 = 0
+SHM_FORMAT_XRGB8888 = 1
+
+
+@dataclass
+class Frame:
+    # The wl_buffer for this frame, and where its pixels are in the pool.
+    obj_id: int
+    offset: int
+    width: int
+    height: int
+    stride: int
+    # From when it's handed out by `ShmPool.acquire()` until the compositor releases it, it may be reading the pixels.
+    busy: bool = False
+    # Left over from before the pool was last configured, it's destroyed once it's released rather than reused.
+    stale: bool = False
+
+    @property
+    def size(self) -> int:
+        return self.stride * self.height
+
+
+class ShmPool:
+    """
+    Shared memory that frames are drawn into, and that the compositor reads them from without a copy on either side.
+    It's a single memfd, mapped once, and split into as many frames as are needed to always have one to draw into
+    (two for double buffering, three for triple buffering).
+    """
+
+    def __init__(self, connection: Connection, shm: int, width: int, height: int, frames: int = 2,
+                 pixel_format: int = SHM_FORMAT_XRGB8888):
+        """
+        :param shm: ID of the bound `wl_shm` global.
+        """
+        self.connection = connection
+        self.count = frames
+        self.pixel_format = pixel_format
+        self.frames: List[Frame] = []
+
+        self.size = frames * width * height * 4
+        self.fd = os.memfd_create("waygui-shm", os.MFD_CLOEXEC)
+        os.ftruncate(self.fd, self.size)
+        self.memory = mmap.mmap(self.fd, self.size)
+
+        self.obj_id = connection.new_id()
+        connection.request(shm, 0, Signature(NewID, Fd, Int32), self.obj_id, self.fd, self.size)
+        self.configure(width, height)
+
+    def configure(self, width: int, height: int):
+        """
+        Lays out frames of a new size, like when the window is resized. Frames the compositor is still reading keep
+        their memory until it releases them, new ones go after those, growing the pool if there isn't room.
+        """
+        for frame in self.frames:
+            if frame.busy:
+                frame.stale = True
+            else:
+                self.destroy_frame(frame)
+        busy = [frame for frame in self.frames if frame.busy]
+
+        stride = width * 4
+        start = max((frame.offset + frame.size for frame in busy), default=0)
+        if start + self.count * stride * height > self.size:
+            self.grow(start + self.count * stride * height)
+
+        self.frames = busy
+        for i in range(self.count):
+            frame = Frame(self.connection.new_id(), start + i * stride * height, width, height, stride)
+            self.connection.request(
+                self.obj_id, 0, Signature(NewID, Int32, Int32, Int32, Int32, UInt32),
+                frame.obj_id, frame.offset, width, height, stride, self.pixel_format
+            )
+            self.connection.listen(frame.obj_id, 0, Signature(), lambda frame=frame: self.on_release(frame))
+            self.frames.append(frame)
+
+    def grow(self, size: int):
+        # Remapped in place (or moved by the kernel, without copying), the compositor remaps its side on resize too.
+        # Fails if any `pixels()` view of the old mapping is still around.
+        self.memory.resize(size)
+        self.size = size
+        self.connection.request(self.obj_id, 2, Signature(Int32), size)
+
+    def acquire(self) -> Frame | None:
+        """
+        :return: A frame the compositor isn't reading, to draw the next one into and then attach. None if it's still
+        reading all of them, `Connection.dispatch()` until it releases one.
+        """
+        for frame in self.frames:
+            if not frame.busy and not frame.stale:
+                frame.busy = True
+                return frame
+        return None
+
+    def pixels(self, frame: Frame) -> memoryview:
+        """
+        :return: The frame's pixels in the shared memory itself, anything written to it is what the compositor sees.
+        Should be released (or used as a context manager) once the frame is drawn, the pool can't grow while it exists.
+        """
+        return memoryview(self.memory)[frame.offset:frame.offset + frame.size]
+
+    def on_release(self, frame: Frame):
+        frame.busy = False
+        if frame.stale:
+            self.destroy_frame(frame)
+            self.frames.remove(frame)
+
+    def destroy_frame(self, frame: Frame):
+        self.connection.request(frame.obj_id, 0, Signature())
+
+    def destroy(self):
+        for frame in self.frames:
+            self.destroy_frame(frame)
+        self.frames.clear()
+        self.connection.request(self.obj_id, 1, Signature())
+        self.connection.flush()
+        # The compositor has its own mapping and duplicate of the fd, it keeps the memory alive for as long as it needs.
+        self.memory.close()
+        os.close(self.fd)
+
+
 def main():
-    pass
+    # Lists the globals the compositor advertises, which is the first thing any client has to find out.
+    connection = Connection()
+    registry = connection.new_id()
+    connection.listen(
+        registry, 0, Signature(UInt32, String, UInt32),
+        lambda name, interface, version: print(f"{name:>4} {interface} (version {version})")
+    )
+    connection.request(1, 1, Signature(NewID), registry)
+    connection.roundtrip()
+    connection.close()
 
 
 if __name__ == "__main__":
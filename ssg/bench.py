@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+from ssg.constants import *
+
+RESULTS_FILE = CACHE_DIR / "bench" / "latest.json"
+
+WORDS = (
+    "wayland compositor buffer surface protocol socket python window frame pixel latency render cache build static "
+    "template markdown server request header byte stream event loop thread process memory font glyph kernel driver"
+).split()
+
+CODE_SAMPLE = '''\
+```python
+def handle(event: dict) -> bool:
+    for key, value in event.items():
+        if value is None:
+            return False
+    return True
+```'''
+
+DIAGRAM = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="640" height="240" viewBox="0 0 640 240">'
+    '<rect x="20" y="20" width="600" height="200" fill="none" stroke="black"/></svg>'
+)
+
+
+def generate_corpus(content_dir: Path, posts: int, seed: int = 0):
+    """
+    Writes a content directory with `posts` generated posts, using the real site's config and home page. Generated posts
+    exercise what real ones do: headings (and so the TOC), inline markup, lists, code blocks and images.
+    """
+    rng = random.Random(seed)
+
+    def sentence() -> str:
+        words = rng.choices(WORDS, k=rng.randint(8, 20))
+        if rng.random() < 0.3:
+            words[rng.randrange(len(words))] = f"`{rng.choice(WORDS)}`"
+        return " ".join(words).capitalize() + "."
+
+    def paragraph() -> str:
+        return " ".join(sentence() for _ in range(rng.randint(3, 6)))
+
+    (content_dir / "posts").mkdir(parents=True)
+    (content_dir / "diagrams").mkdir()
+    (content_dir / "diagrams" / "bench.svg").write_text(DIAGRAM)
+    shutil.copy(CONTENT_DIR / "config.toml", content_dir / "config.toml")
+    if (CONTENT_DIR / "home.md").exists():
+        shutil.copy(CONTENT_DIR / "home.md", content_dir / "home.md")
+
+    first_date = date(2025, 1, 1)
+    for i in range(posts):
+        sections = []
+        for section in range(rng.randint(3, 6)):
+            sections.append(f"## {sentence().rstrip('.')}")
+            sections.extend(paragraph() for _ in range(rng.randint(2, 4)))
+            if section % 2 == 0:
+                sections.append("\n".join(f"- {sentence()}" for _ in range(rng.randint(2, 5))))
+            if rng.random() < 0.5:
+                sections.append(CODE_SAMPLE)
+            if rng.random() < 0.2:
+                sections.append("![A diagram.](../diagrams/bench.svg)")
+
+        post_date = (first_date + timedelta(days=i)).strftime("%d %b, %Y")
+        front_matter = f'---\ntitle: "{sentence().rstrip(".")}"\ndate: "{post_date}"\n---\n\n'
+        (content_dir / "posts" / f"{i:04}-post-{i}.md").write_text(front_matter + "\n\n".join(sections) + "\n")
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    # Samples are in seconds, summaries in milliseconds.
+    if not samples:
+        return {"count": 0}
+
+    cuts = statistics.quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+    return {
+        "count": len(samples),
+        "p50": round(cuts[49] * 1000, 3),
+        "p95": round(cuts[94] * 1000, 3),
+        "p99": round(cuts[98] * 1000, 3),
+        "max": round(max(samples) * 1000, 3),
+    }
+
+
+async def load_test(clients: int, websockets: int, duration: float, mutate_interval: float) -> dict:
+    """
+    Drives the live server's app in-process, with `clients` concurrent browsing sessions and `websockets` open reload
+    sockets (tabs, essentially), while posts are edited every `mutate_interval` seconds. Must run with `CONTENT_DIR`
+    pointed at a corpus from `generate_corpus()`, since it edits the posts in it.
+    """
+    from ssg.server import Server
+
+    server = Server()
+    post_files = sorted((CONTENT_DIR / "posts").rglob("*.md"))
+    slugs = [post.slug for post in server.builder.iter_posts()]
+    routes = ["/", "/blog", "/static/css/main.css", "/rss.xml", "/atom.xml", *(f"/post/{slug}" for slug in slugs)]
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors = Counter()
+    lags, reloads = [], []
+    last_edit = [time.perf_counter()]
+    edits = 0
+
+    async with server.app.test_app() as app:
+        client = app.test_client()
+        start = time.perf_counter()
+        deadline = start + duration
+
+        async def browse(seed: int):
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                route = rng.choice(routes)
+                request_start = time.perf_counter()
+                response = await client.get(route)
+                await response.get_data()
+                latencies["/post/<slug>" if route.startswith("/post/") else route].append(
+                    time.perf_counter() - request_start
+                )
+                if response.status_code != 200:
+                    errors[f"{route} {response.status_code}"] += 1
+
+        async def tab():
+            async with client.websocket("/ws") as websocket:
+                while True:
+                    await websocket.receive()
+                    reloads.append(time.perf_counter() - last_edit[0])
+
+        async def edit():
+            nonlocal edits
+            rng = random.Random(0)
+            while time.perf_counter() + mutate_interval < deadline:
+                await asyncio.sleep(mutate_interval)
+                with open(rng.choice(post_files), "a") as file:
+                    file.write(f"\nEdit number {edits}.\n")
+                last_edit[0] = time.perf_counter()
+                edits += 1
+
+        async def measure_lag(interval: float = 0.01):
+            # How late a timer fires is how long something else held the event loop.
+            while time.perf_counter() < deadline:
+                sleep_start = time.perf_counter()
+                await asyncio.sleep(interval)
+                lags.append(max(time.perf_counter() - sleep_start - interval, 0))
+
+        tabs = [asyncio.create_task(tab()) for _ in range(websockets)]
+        await asyncio.gather(*(browse(seed) for seed in range(clients)), edit(), measure_lag())
+        elapsed = time.perf_counter() - start
+
+        for task in tabs:
+            task.cancel()
+        await asyncio.gather(*tabs, return_exceptions=True)
+
+    requests = sum(len(samples) for samples in latencies.values())
+    return {
+        "clients": clients,
+        "websockets": websockets,
+        "duration": round(elapsed, 3),
+        "requests": requests,
+        "errors": dict(errors),
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency_ms": summarize([sample for samples in latencies.values() for sample in samples]),
+        "routes": {route: summarize(samples) for route, samples in sorted(latencies.items())},
+        "event_loop_lag_ms": summarize(lags),
+        "edits": edits,
+        "edit_to_reload_ms": summarize(reloads),
+    }
+
+
+def measure_build(env: dict) -> Dict[str, float]:
+    """
+    Runs `ssg build -m` in a child process.
+
+    :return: Its wall time in seconds and peak resident memory in MiB.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "ssg.cli", "build", "-m", "--no-daemon"], env=env, cwd=PROJECT_ROOT,
+        stdout=subprocess.DEVNULL
+    )
+    # Unlike `Popen.wait()`, this also returns the resource usage of that particular child.
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        raise Exception(f"Building the benchmark corpus failed with exit code {process.returncode}.")
+
+    # `ru_maxrss` is in KiB on Linux.
+    return {"seconds": round(elapsed, 3), "peak_rss_mb": round(usage.ru_maxrss / 1024, 1)}
+
+
+def bench(clients: int = 8, websockets: int = 2, duration: float = 10, posts: int = 50, mutate_interval: float = 0.5,
+          output: Path | None = None) -> dict:
+    """
+    Generates a corpus in a temporary directory, builds it from a cold and then a warm cache, and load tests the live
+    server against it. The builds and the server run in child processes which see the corpus as their content directory
+    (and a throwaway build directory and cache), so nothing real is touched.
+
+    :return: The results, which are also written to `output` (`.cache/bench/latest.json` by default) as JSON.
+    """
+    output = output or RESULTS_FILE
+
+    with tempfile.TemporaryDirectory(prefix="ssg-bench-") as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        generate_corpus(tmp_dir / "content", posts)
+
+        env = {
+            **os.environ,
+            "SSG_CONTENT_DIR": str(tmp_dir / "content"),
+            "SSG_BUILD_DIR": str(tmp_dir / "build"),
+            "SSG_CACHE_DIR": str(tmp_dir / ".cache"),
+        }
+        build = {"cold": measure_build(env), "warm": measure_build(env)}
+
+        parameters = {
+            "clients": clients, "websockets": websockets, "duration": duration, "mutate_interval": mutate_interval
+        }
+        process = subprocess.run(
+            [sys.executable, "-m", "ssg.bench", json.dumps(parameters)],
+            env=env, cwd=PROJECT_ROOT, stdout=subprocess.PIPE, text=True, check=True
+        )
+
+    # Whatever else ends up on stdout, the results are the last line.
+    results = {"corpus_posts": posts, "build": build, **json.loads(process.stdout.strip().splitlines()[-1])}
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(load_test(**json.loads(sys.argv[1])))))
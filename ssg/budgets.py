@@ -0,0 +1,256 @@
+import functools
+import gzip
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import urljoin, urlparse
+
+from ssg.bench import RESULTS_FILE as BENCH_RESULTS_FILE
+from ssg.constants import *
+
+BASELINE_FILE = PROJECT_ROOT / "budget-baseline.json"
+
+RESOURCE_KINDS = ("html", "css", "js", "font")
+FONT_SUFFIXES = (".woff2", ".woff", ".ttf", ".otf")
+CSS_URL = re.compile(r"""url\(\s*['"]?([^'")]+)['"]?\s*\)""")
+
+# Interpreter arguments for each startup metric.
+STARTUP_COMMANDS = {
+    "cli_import_ms": ["-m", "ssg.cli", "build", "--help"],
+    "build_import_ms": ["-c", "import ssg.build"],
+}
+
+# Timings vary from run to run far more than page weights do, so they're compared with `time_tolerance`.
+TIME_METRICS = ("build_seconds", "build_peak_rss_mb", *STARTUP_COMMANDS)
+
+
+class ResourceCollector(HTMLParser):
+    """
+    Collects the stylesheets, scripts and preloaded fonts a page loads, and which of those block rendering: stylesheets
+    (unless they're only for print) and scripts in the head that are neither async, deferred nor modules.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.in_head = False
+        self.stylesheets: List[str] = []
+        self.scripts: List[str] = []
+        self.fonts: List[str] = []
+        self.blocking: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        rel = (attrs.get("rel") or "").lower().split()
+
+        if tag == "head":
+            self.in_head = True
+        elif tag == "body":
+            self.in_head = False
+        elif tag == "link" and "stylesheet" in rel and attrs.get("href"):
+            self.stylesheets.append(attrs["href"])
+            if attrs.get("media", "all") != "print":
+                self.blocking.append(attrs["href"])
+        elif tag == "link" and "preload" in rel and attrs.get("as") == "font" and attrs.get("href"):
+            self.fonts.append(attrs["href"])
+        elif tag == "script" and attrs.get("src"):
+            self.scripts.append(attrs["src"])
+            if self.in_head and not ("async" in attrs or "defer" in attrs or attrs.get("type") == "module"):
+                self.blocking.append(attrs["src"])
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.in_head = False
+
+
+@functools.cache
+def file_sizes(file_path: Path) -> tuple[int, int]:
+    # Fonts and stylesheets are shared by every page, no point compressing them again for each one.
+    with open(file_path, "rb") as file:
+        data = file.read()
+    return len(data), len(gzip.compress(data, 9))
+
+
+def page_weight(build_dir: Path, html_file: Path) -> Dict[str, int]:
+    """
+    Adds up the raw and gzipped bytes of everything (from this site) a page loads by kind, fonts referenced from its
+    stylesheets included, and counts its render blocking requests, third party ones included.
+    """
+    page_url = "/" + str(html_file.relative_to(build_dir)).removesuffix("index.html")
+
+    def local_file(url: str, base_url: str) -> Path | None:
+        url = urlparse(urljoin(base_url, url))
+        if url.scheme or url.netloc:
+            return None
+        file_path = build_dir / url.path.lstrip("/")
+        return file_path if file_path.is_file() else None
+
+    with open(html_file) as file:
+        collector = ResourceCollector()
+        collector.feed(file.read())
+
+    resources = {kind: set() for kind in RESOURCE_KINDS}
+    resources["html"].add(html_file)
+
+    for url in collector.stylesheets:
+        if (css_file := local_file(url, page_url)) is None:
+            continue
+        resources["css"].add(css_file)
+
+        css_url = "/" + str(css_file.relative_to(build_dir))
+        for font_url in CSS_URL.findall(css_file.read_text()):
+            if font_url.endswith(FONT_SUFFIXES) and (font_file := local_file(font_url, css_url)) is not None:
+                resources["font"].add(font_file)
+
+    for kind, urls in (("js", collector.scripts), ("font", collector.fonts)):
+        resources[kind] |= {file_path for url in urls if (file_path := local_file(url, page_url)) is not None}
+
+    weight = {}
+    for kind, files in resources.items():
+        weight[f"{kind}_raw"] = sum(file_sizes(file_path)[0] for file_path in files)
+        weight[f"{kind}_gzip"] = sum(file_sizes(file_path)[1] for file_path in files)
+    weight["blocking_requests"] = len(set(collector.blocking))
+
+    return weight
+
+
+def analyze_build(build_dir: Path) -> Dict[str, Dict[str, int]]:
+    return {
+        "/" + str(html_file.relative_to(build_dir)).removesuffix("index.html"): page_weight(build_dir, html_file)
+        for html_file in sorted(build_dir.rglob("*.html"))
+    }
+
+
+def build_metrics() -> Dict[str, float]:
+    # Taken from the cold build of the last `ssg bench` run, if there was one.
+    if not BENCH_RESULTS_FILE.exists():
+        return {}
+
+    with open(BENCH_RESULTS_FILE) as file:
+        cold_build = json.load(file).get("build", {}).get("cold", {})
+
+    if not cold_build:
+        return {}
+    return {"build_seconds": cold_build["seconds"], "build_peak_rss_mb": cold_build["peak_rss_mb"]}
+
+
+def import_time(args: List[str], runs: int = 5) -> float:
+    """
+    :return: Milliseconds spent importing modules when running the interpreter with `args`, as reported by
+    `-X importtime`. The fastest of `runs` runs is taken, anything slower than that is the machine being busy.
+    """
+    samples = []
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", *args], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        )
+        total = 0
+        for line in process.stderr.splitlines():
+            # "import time: <self> | <cumulative> | <module>", where nested imports are indented under their parent.
+            fields = line.removeprefix("import time:").split("|")
+            if line.startswith("import time:") and fields[0].strip().isdigit() and not fields[2].startswith("  "):
+                total += int(fields[1])
+        samples.append(total / 1000)
+
+    return round(min(samples), 1)
+
+
+def startup_metrics() -> Dict[str, float]:
+    return {metric: import_time(args) for metric, args in STARTUP_COMMANDS.items()}
+
+
+def machine() -> Dict[str, str | int]:
+    # Stored with the baseline, timings are only comparable to ones taken on the same machine with the same interpreter.
+    return {
+        "node": platform.node(), "arch": platform.machine(), "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def format_size(size: int) -> str:
+    return f"{size / 1024:.1f}K" if size >= 1024 else f"{size}B"
+
+
+def check_budgets(update_baseline: bool = False, timing_baseline: bool = True) -> bool:
+    """
+    Checks the pages in `BUILD_DIR` and the build numbers from the latest benchmark against the budgets in
+    `config.toml`, and against the baseline in `budget-baseline.json` (when there is one) for regressions.
+
+    :param update_baseline: Store the current numbers as the new baseline instead of comparing against the old one.
+    :param timing_baseline: Compare build and startup times against the baseline too, not only page weights. Even then,
+    that only happens if the baseline was recorded on this machine, otherwise times are only checked against budgets.
+    :return: Whether everything is within budget and nothing regressed.
+    """
+    from ssg.build import Builder
+    budgets = Builder.read_config()["budgets"]
+
+    if not BUILD_DIR.is_dir():
+        raise Exception("There's no build to check, run 'ssg build -m' first.")
+
+    pages = analyze_build(BUILD_DIR.resolve())
+    build = build_metrics()
+    startup = startup_metrics()
+
+    print(f"{'Page':<60} {'HTML':>15} {'CSS':>15} {'JS':>15} {'Fonts':>15} {'Blocking':>8}")
+    for page, weight in pages.items():
+        sizes = (
+            f"{format_size(weight[f'{kind}_raw'])}/{format_size(weight[f'{kind}_gzip'])}" for kind in RESOURCE_KINDS
+        )
+        print(f"{page:<60} " + " ".join(f"{size:>15}" for size in sizes) + f" {weight['blocking_requests']:>8}")
+
+    if build:
+        print(f"\nBuild (cold, benchmark corpus): {build['build_seconds']}s, {build['build_peak_rss_mb']} MiB peak RSS")
+    else:
+        print("\nNo benchmark results, run 'ssg bench' to check build time and memory too.")
+    print(f"Startup (import time): {startup['cli_import_ms']}ms for 'ssg build --help', "
+          f"{startup['build_import_ms']}ms for the builder")
+
+    failures = []
+    for page, weight in pages.items():
+        for metric, value in weight.items():
+            if value > budgets[metric]:
+                failures.append(f"{page}: {metric} is {value}, over the budget of {budgets[metric]}")
+    for metric, value in (build | startup).items():
+        if value > budgets[metric]:
+            failures.append(f"{metric} is {value}, over the budget of {budgets[metric]}")
+
+    if update_baseline:
+        with open(BASELINE_FILE, "w") as file:
+            json.dump({"machine": machine(), "pages": pages, "build": build, "startup": startup}, file, indent=2)
+            file.write("\n")
+        print(f"\nStored the current numbers as the baseline in {BASELINE_FILE.name}.")
+    elif BASELINE_FILE.exists():
+        with open(BASELINE_FILE) as file:
+            baseline = json.load(file)
+
+        if timing_baseline and baseline.get("machine") != machine():
+            print(f"\n{BASELINE_FILE.name} was recorded on another machine, only checking times against their budgets.")
+            timing_baseline = False
+
+        def compare(name: str, metric: str, value: float, baseline_value: float):
+            tolerance = budgets["time_tolerance" if metric in TIME_METRICS else "tolerance"]
+            if value > baseline_value * (1 + tolerance):
+                failures.append(f"{name}{metric} regressed from {baseline_value} to {value}")
+
+        # Pages that are new since the baseline have nothing to regress from.
+        for page, weight in pages.items():
+            for metric, value in weight.items():
+                if metric in baseline["pages"].get(page, {}):
+                    compare(f"{page}: ", metric, value, baseline["pages"][page][metric])
+        for section, metrics in (("build", build), ("startup", startup)) if timing_baseline else ():
+            for metric, value in metrics.items():
+                if metric in baseline.get(section, {}):
+                    compare("", metric, value, baseline[section][metric])
+
+    if failures:
+        print("\nOver budget or regressed:")
+        print("\n".join(f"  {failure}" for failure in failures))
+        return False
+
+    print("\nEverything is within budget.")
+    return True
@@ -1,29 +1,52 @@
-import csv
+import fcntl
 import functools
 import hashlib
+import json
+import mimetypes
+import os
+import pickle
+import re
 import shutil
 import subprocess
+import tempfile
 import tomllib
-from datetime import date
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
 from mimetypes import types_map as mimetype_map
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, TextIO, Tuple
 
+from ssg.cache import Cache
+from ssg.compress import COMPRESSIBLE_SUFFIXES, SIDECAR_EXTENSIONS, compressors
 from ssg.constants import *
-from ssg.markdown import ExtendedRenderer
+from ssg.feeds import FeedWriter, entry_fragments
+from ssg.images import ContentImage, RASTER_SUFFIXES
+from ssg.images import generate_variants, raster_dimensions, svg_dimensions, variant_formats, variant_widths
+from ssg.post import Post, PostSummary
+from ssg.scheduler import Scheduler
+from ssg.tracing import phase
 
-import frontmatter
-import minify
-from feedgen.feed import FeedGenerator
 from jinja2 import ChoiceLoader
 from jinja2 import Environment
 from jinja2 import FileSystemLoader
 from jinja2 import PrefixLoader
 from jinja2 import select_autoescape
+from jinja2 import nodes
+from jinja2.ext import Extension
+from jinja2.parser import Parser
 from markupsafe import Markup
-from pygments.formatters.html import HtmlFormatter
 
-type PostList = Iterable[Dict]
+type PostList = Iterable[Post | PostSummary]
+
+# What `sw.js` precaches is written into it like this, see `Builder.build_service_worker()`.
+PRECACHE_URLS = re.compile(r"PRECACHE_URLS\s*=\s*(\[[^\]]*\])")
+
+# Eagerness levels of speculation rules, see https://developer.chrome.com/docs/web-platform/prerender-pages.
+SPECULATION_EAGERNESS = ("immediate", "eager", "moderate", "conservative")
+
+# Static assets referenced by the output file being rendered, see `Builder.static_url()`. Output files are rendered on
+# several threads at once, and each thread has its own context, so this can't be an attribute of the builder.
+asset_refs: ContextVar[List[str] | None] = ContextVar("asset_refs", default=None)
 
 
 def include_raw(file_path: str) -> Markup:
@@ -41,51 +64,255 @@ def include_raw(file_path: str) -> Markup:
     if not file_path.is_relative_to(include_path):
         raise Exception("Reading files outside of the include directory is not allowed.")
 
+    stat = file_path.stat()
+    return read_include(file_path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=64)
+def read_include(file_path: Path, mtime_ns: int, size: int) -> Markup:
+    # Keyed on the modification time and size as well, so an edited file is read again (which the live server relies on).
     with open(file_path) as file:
         return Markup(file.read())
 
 
+class FragmentCache(Extension):
+    """
+    Adds a `{% cache key, ... %}...{% endcache %}` tag to jinja, which renders what's inside it once and reuses that for
+    as long as the keys stay the same. Meant for the parts of the page chrome that are the same on every page, like the
+    header and footer, which would otherwise be rendered again (and the files they include read again) for every page.
+
+    Whatever a fragment uses that varies between pages has to be one of its keys, everything else is assumed to stay the
+    same until `Environment.fragment_cache` is cleared. Static assets referenced while rendering a fragment are recorded
+    along with it, so pages reusing it still get preload hints for them.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment: Environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache={}, fragment_cache_enabled=True)
+
+    def parse(self, parser: Parser) -> nodes.Node:
+        lineno = next(parser.stream).lineno
+
+        # The fragment's place in its template is part of the key, so different fragments can use the same keys.
+        keys = [nodes.Const(parser.name), nodes.Const(lineno), parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            keys.append(parser.parse_expression())
+
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(self.call_method("_render", [nodes.Tuple(keys, "load")]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key: tuple, caller: Callable[[], str]) -> str:
+        if not self.environment.fragment_cache_enabled:
+            return caller()
+
+        refs = asset_refs.get()
+        cached = self.environment.fragment_cache.get(key)
+        if cached is None:
+            start = len(refs) if refs is not None else 0
+            html = caller()
+            cached = self.environment.fragment_cache[key] = (html, refs[start:] if refs is not None else [])
+        elif refs is not None:
+            refs.extend(cached[1])
+
+        return cached[0]
+
+
+def lock_dir(dir_path: Path, shared: bool = False, blocking: bool = True) -> int | None:
+    """
+    Takes an advisory lock on a directory, held until the returned file descriptor is closed. Builds in other processes
+    (`ssg watch`, the daemon, `ssg build --no-daemon`) share the generations directory, each holds an exclusive lock on
+    its staging directory and a shared one on the generation it starts off from, so nobody deletes them from under it.
+
+    :return: The file descriptor, or `None` if `blocking` is off and someone else holds a conflicting lock.
+    """
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def make_staging_dir() -> Tuple[Path, int]:
+    """
+    :return: A new, empty generation directory, and the file descriptor holding the lock on it, see `lock_dir()`.
+    """
+    BUILD_GENERATIONS_DIR.mkdir(parents=True, exist_ok=True)
+    # Under the lock `swap_build_dir()` cleans up under, so the directory can't be deleted before it's locked.
+    generations_lock = lock_dir(BUILD_GENERATIONS_DIR)
+    try:
+        staging_dir = Path(tempfile.mkdtemp(prefix="build-", dir=BUILD_GENERATIONS_DIR))
+        return staging_dir, lock_dir(staging_dir)
+    finally:
+        os.close(generations_lock)
+
+
+def swap_build_dir(generation_dir: Path):
+    """
+    Atomically points `BUILD_DIR` to the given generation, keeping the one it pointed to before for `rollback()`. Any
+    other generations are deleted, unless a build in progress has them locked.
+    """
+    generations_lock = lock_dir(BUILD_GENERATIONS_DIR)
+    try:
+        _swap_build_dir(generation_dir)
+    finally:
+        os.close(generations_lock)
+
+
+def _swap_build_dir(generation_dir: Path):
+    previous_generation_dir = BUILD_DIR.resolve() if BUILD_DIR.is_dir() else None
+
+    if BUILD_DIR.is_dir() and not BUILD_DIR.is_symlink():
+        # Builds used to be written to `BUILD_DIR` directly, keep that one around as the previous generation.
+        previous_generation_dir = Path(tempfile.mkdtemp(prefix="build-", dir=BUILD_GENERATIONS_DIR))
+        BUILD_DIR.replace(previous_generation_dir)
+
+    # A symlink can't be replaced in place, but renaming a new symlink over it is atomic.
+    tmp_link = BUILD_GENERATIONS_DIR / "build.tmp"
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(generation_dir.relative_to(BUILD_DIR.parent))
+    tmp_link.replace(BUILD_DIR)
+
+    previous_link = BUILD_GENERATIONS_DIR / "previous"
+    previous_link.unlink(missing_ok=True)
+    if previous_generation_dir is not None and previous_generation_dir != generation_dir:
+        previous_link.symlink_to(previous_generation_dir.name)
+
+    for path in BUILD_GENERATIONS_DIR.iterdir():
+        if path.is_dir() and not path.is_symlink() and path not in (generation_dir, previous_generation_dir):
+            # Someone else's staging directory, or the generation their build started off from.
+            if (lock := lock_dir(path, blocking=False)) is None:
+                continue
+            try:
+                shutil.rmtree(path)
+            finally:
+                os.close(lock)
+
+
+def link_tree(src_dir: Path, dst_dir: Path):
+    """
+    Recreates `src_dir` inside `dst_dir` out of hardlinks, which is how partial builds start off from the previous
+    generation without copying it.
+    """
+    for root, dirs, files in os.walk(src_dir):
+        target_dir = dst_dir / Path(root).relative_to(src_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for file in files:
+            os.link(Path(root) / file, target_dir / file)
+
+
+def source_date() -> datetime:
+    """
+    The timestamp reproducible builds use in place of the current time: SOURCE_DATE_EPOCH if set, otherwise the time of
+    the last commit.
+    """
+    if "SOURCE_DATE_EPOCH" in os.environ:
+        return datetime.fromtimestamp(int(os.environ["SOURCE_DATE_EPOCH"]), timezone.utc)
+
+    try:
+        timestamp = subprocess.run(
+            ["git", "log", "-1", "--format=%ct"], cwd=PROJECT_ROOT, capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        timestamp = ""
+
+    if not timestamp:
+        raise Exception("Reproducible builds need either SOURCE_DATE_EPOCH to be set or a git checkout.")
+
+    return datetime.fromtimestamp(int(timestamp), timezone.utc)
+
+
+def parse_post_date(post_date: str) -> datetime:
+    # Posts only specify a day, example: "4 Aug, 2025".
+    return datetime.strptime(post_date, "%d %b, %Y").replace(tzinfo=timezone.utc)
+
+
+def output_digests(output_dir: Path) -> Dict[str, str]:
+    return {
+        str(file.relative_to(output_dir)): hashlib.sha256(file.read_bytes()).hexdigest()
+        for file in sorted(output_dir.rglob("*")) if file.is_file()
+    }
+
+
+def verify_reproducible(**builder_kwargs) -> List[str]:
+    """
+    Builds the site twice from scratch in reproducible mode and compares the output. Each build gets an empty cache of
+    its own, otherwise the second would mostly compare what the first cached with itself.
+
+    :return: Paths relative to the build directory that differ between the two builds.
+    """
+    digests = []
+    for _ in range(2):
+        with tempfile.TemporaryDirectory(prefix="ssg-cache-") as cache_dir:
+            Builder(reproducible=True, cache_dir=Path(cache_dir), **builder_kwargs).build()
+        digests.append(output_digests(BUILD_DIR.resolve()))
+
+    first, second = digests
+
+    return sorted(path for path in first.keys() | second.keys() if first.get(path) != second.get(path))
+
+
+def rollback():
+    """
+    Swaps `BUILD_DIR` back to the previous generation. Rolling back twice undoes the rollback.
+    """
+    previous_link = BUILD_GENERATIONS_DIR / "previous"
+    if not previous_link.is_symlink() or not previous_link.resolve().is_dir():
+        raise Exception("There is no previous build to roll back to.")
+
+    swap_build_dir(previous_link.resolve())
+
+
 class Builder:
-    def __init__(self, minified=True, live=False, include_drafts=False):
+    # What `build(only=...)` accepts, besides "post/<slug>" for a single post.
+    BUILD_TARGETS = ("static", "posts", "home", "blog", "feeds")
+
+    def __init__(self, minified=True, live=False, include_drafts=False, reproducible=False, compressed=False,
+                 cache_dir: Path = CACHE_DIR):
         self.minified = minified
         self.live = live
         self.include_drafts = include_drafts
+        self.compressed = compressed
+
+        # In reproducible mode nothing in the output depends on when the build ran, so two builds of the same commit are
+        # byte-for-byte identical. Setting SOURCE_DATE_EPOCH implies it, see https://reproducible-builds.org/specs/.
+        self.reproducible = reproducible or "SOURCE_DATE_EPOCH" in os.environ
+        self.build_date = source_date() if self.reproducible else datetime.now(timezone.utc)
 
         self.env = self.make_jinja_env()
 
-        self.hash_cache: dict = {}
-        self.load_hash_cache()
+        self.cache = Cache(cache_dir, **self.env.globals["cache"])
 
-    def load_hash_cache(self):
-        if not HASH_CACHE_FILE.exists():
-            self.hash_cache = {}
-            return
+        # Static assets referenced by each output file, keyed by the output path relative to the build directory. This
+        # is filled in from `asset_refs` while rendering and is later used to emit preload hints in `build_headers()`.
+        self.page_assets: Dict[str, List[str]] = {}
 
-        with open(HASH_CACHE_FILE) as file:
-            self.hash_cache = {
-                row[0]: {
-                    "last_mtime": row[1],
-                    "last_hash": row[2]
-                } for row in csv.reader(file)
-            }
+        # Images referenced from markdown content, filled in while rendering posts and written out by `build_images()`.
+        self.content_images: Dict[Path, ContentImage] = {}
 
-    def dump_hash_cache(self) -> None:
-        if not HASH_CACHE_FILE.parent.exists():
-            HASH_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        # During a build, output is written to a staging directory and swapped in once the build succeeds, see `build()`.
+        # Files identical to the ones in the previous generation are hardlinked from it instead of being written again.
+        self.output_dir: Path = BUILD_DIR
+        self.previous_dir: Path | None = None
 
-        with open(HASH_CACHE_FILE, "w") as file:
-            writer = csv.writer(file)
-            writer.writerows([
-                (path, data["last_mtime"], data["last_hash"])
-                for path, data in self.hash_cache.items()
-            ])
+    def __reduce__(self):
+        # Sent to a worker process (to render markdown in, see `plan_build()`), a builder becomes that process' own
+        # builder with the same options. It only ever needs what it reads from disk anyway, the rest is per build.
+        return worker_builder, (
+            self.minified, self.live, self.include_drafts, self.reproducible, self.compressed, self.cache.cache_dir
+        )
 
     def static_url(self, file_path: str) -> str:
         """
         Implements cache busting for static assets by appending the first 8 characters of the SHA1 hash of a file to its
-        name. It also maintains a CSV file containing:
-            name of the file, last modification time of that file, the last SHA1 hash calculated for that file
-        which serves as a cache, as recalculating the hash each build is wasteful.
+        name. The hash is cached against the file's modification time and size, as recalculating it each build is
+        wasteful.
 
         This is intended to be used both inside Jinja templates and inside `build_static()`.
 
@@ -104,41 +331,127 @@ class Builder:
             url_without_hash = "/static/" + str(file_path.relative_to(static_path)).removesuffix(".jinja")
             return url_without_hash
 
-        file_path_str = str(file_path)
-        cache_hit = (file_path_str in self.hash_cache and
-                     str(file_path.stat().st_mtime) == self.hash_cache[file_path_str]["last_mtime"])
-        if not cache_hit:
+        url_with_hash = str(self.with_hash(file_path).relative_to(static_path))
+        url_with_hash = "/static/" + url_with_hash.removesuffix(".jinja")
+
+        if (refs := asset_refs.get()) is not None:
+            refs.append(url_with_hash)
+
+        return url_with_hash
+
+    def file_hash(self, file_path: Path) -> str:
+        stat = file_path.stat()
+        # Relative, so a restored cache still applies in a checkout at another path. Content may live elsewhere though.
+        name = file_path.relative_to(PROJECT_ROOT) if file_path.is_relative_to(PROJECT_ROOT) else file_path
+        key = (str(name), stat.st_mtime_ns, stat.st_size)
+
+        sha1hash = self.cache.get_value("asset-hash", *key)
+        if sha1hash is None:
             with open(file_path, "rb") as file:
                 sha1hash = hashlib.sha1(file.read(), usedforsecurity=False).hexdigest()[:8]
+            self.cache.put_value("asset-hash", *key, value=sha1hash)
 
-            self.hash_cache[file_path_str] = {"last_mtime": str(file_path.stat().st_mtime), "last_hash": sha1hash}
-
-        sha1hash = self.hash_cache[str(file_path)]["last_hash"]
+        return sha1hash
 
+    def with_hash(self, file_path: Path, suffix: str = "") -> Path:
+        # Example: "foo.css.jinja" -> "foo-SHA1HASH.css.jinja", or with a suffix of "-480w": "foo-SHA1HASH-480w.css.jinja"
         suffixes = "".join(file_path.suffixes)
-        file_name_with_hash = str(file_path.name).removesuffix(suffixes) + "-" + sha1hash + suffixes
-        url_with_hash = str(file_path.with_name(file_name_with_hash).relative_to(static_path))
-        url_with_hash = "/static/" + url_with_hash.removesuffix(".jinja")
+        file_name_with_hash = str(file_path.name).removesuffix(suffixes) + "-" + self.file_hash(file_path) + suffix
+        return file_path.with_name(file_name_with_hash + suffixes)
 
-        return url_with_hash
+    def content_image(self, markdown_path: Path, src: str) -> ContentImage | None:
+        """
+        Resolves an image referenced from a markdown file to a fingerprinted URL, registering it to be written out by
+        `build_images()`. Raster images additionally get responsive variants in every format Pillow can encode.
+
+        This is passed to the markdown renderer as its `image_resolver`.
+
+        :param markdown_path: Path of the markdown file the image is referenced in.
+        :param src: The image source as written in the markdown, relative to the markdown file.
+        :return: The resolved image, or `None` for absolute and external URLs which are left untouched.
+        """
+        if src.startswith("/") or re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:", src):
+            return None
+
+        file_path = (markdown_path.parent / src).resolve()
+        if not file_path.is_relative_to(CONTENT_DIR):
+            raise Exception(f"Image '{src}' referenced in '{markdown_path}' is not inside the content directory.")
+        if not file_path.is_file():
+            raise Exception(f"Image '{src}' referenced in '{markdown_path}' does not exist.")
+
+        if not self.live and file_path in self.content_images:
+            return self.content_images[file_path]
+
+        if self.live:
+            image = ContentImage(file_path, f"/content/{file_path.relative_to(CONTENT_DIR)}")
+        else:
+            image = ContentImage(file_path, f"/static/content/{self.with_hash(file_path).relative_to(CONTENT_DIR)}")
+
+        if image.is_svg:
+            image.width, image.height = svg_dimensions(file_path)
+        elif file_path.suffix.lower() in RASTER_SUFFIXES:
+            image.width, image.height = raster_dimensions(file_path)
+
+            if not self.live and image.width:
+                widths = variant_widths(image.width, self.env.globals["images"]["widths"])
+                for image_format in variant_formats():
+                    image.variants[image_format] = [
+                        (width, "/static/content/" + str(
+                            self.with_hash(file_path, f"-{width}w").relative_to(CONTENT_DIR).with_suffix(f".{image_format}")
+                        ))
+                        for width in widths
+                    ]
+
+        self.content_images[file_path] = image
+        return image
 
     @staticmethod
-    def read_config() -> dict:
+    def read_config(today: date | None = None) -> dict:
         with open(CONTENT_DIR / "config.toml", "rb") as file:
             cfg = tomllib.load(file)
 
         # Default Values
         cfg["site"]["language"] = cfg["site"].get("language", "en")
         cfg["pygments"]["style"] = cfg["pygments"].get("style", "default")
-
-        if cfg["license"]["start"] != str(current_year := date.today().year):
+        cfg["headers"] = cfg.get("headers", {})
+        cfg["headers"]["html_max_age"] = cfg["headers"].get("html_max_age", 300)
+        cfg["headers"]["feed_max_age"] = cfg["headers"].get("feed_max_age", 3600)
+        cfg["images"] = cfg.get("images", {})
+        cfg["images"]["widths"] = cfg["images"].get("widths", [480, 960, 1440])
+        cfg["images"]["sizes"] = cfg["images"].get("sizes", "(max-width: 1050px) 100vw, 700px")
+        cfg["cache"] = cfg.get("cache", {})
+        cfg["cache"]["max_unused_builds"] = cfg["cache"].get("max_unused_builds", 10)
+        cfg["cache"]["max_size_mb"] = cfg["cache"].get("max_size_mb", 512)
+        cfg["deploy"] = cfg.get("deploy", {})
+        cfg["deploy"]["prune_after"] = cfg["deploy"].get("prune_after", 86400)
+        cfg["speculation"] = {
+            "prefetch": "moderate", "prerender": "", "prefetch_newest": True,
+        } | cfg.get("speculation", {})
+        for rule in ("prefetch", "prerender"):
+            if cfg["speculation"][rule] not in ("", *SPECULATION_EAGERNESS):
+                raise Exception(f"Unknown eagerness '{cfg['speculation'][rule]}' for {rule} in [speculation], expected "
+                                f"one of: {', '.join(SPECULATION_EAGERNESS)}, or an empty string to disable it.")
+        cfg["service_worker"] = {"enabled": True} | cfg.get("service_worker", {})
+        cfg["budgets"] = {
+            "html_raw": 100_000, "html_gzip": 25_000,
+            "css_raw": 60_000, "css_gzip": 15_000,
+            "js_raw": 20_000, "js_gzip": 8_000,
+            "font_raw": 300_000, "font_gzip": 300_000,
+            "blocking_requests": 3,
+            "build_seconds": 30, "build_peak_rss_mb": 500,
+            "cli_import_ms": 100, "build_import_ms": 350,
+            "tolerance": 0.05, "time_tolerance": 0.5,
+        } | cfg.get("budgets", {})
+
+        if cfg["license"]["start"] != str(current_year := (today or date.today()).year):
             cfg["license"]["start"] += f"-{current_year}"
 
         return cfg
 
     def load_config(self):
         # This is meant to be called by the live server on changes to config.toml
-        self.env.globals.update(self.read_config())
+        self.env.globals.update(self.read_config(self.build_date))
+        self.env.fragment_cache.clear()
 
     def make_jinja_env(self) -> Environment:
         env = Environment(
@@ -150,42 +463,135 @@ class Builder:
             ]),
             autoescape=select_autoescape(["jinja"]),
             trim_blocks=True,
+            extensions=[FragmentCache],
         )
+        # Templates may change between requests to the live server, it always renders everything.
+        env.fragment_cache_enabled = not self.live
 
-        env.globals.update(self.read_config())
+        env.globals.update(self.read_config(self.build_date))
 
         env.globals["include_raw"] = include_raw
         env.globals["static_url"] = self.static_url
-        env.globals["get_pygments_stylesheet"] = lambda: HtmlFormatter(
-            style=self.env.globals["pygments"]["style"]
-        ).get_style_defs()
+        env.globals["get_pygments_stylesheet"] = self.pygments_stylesheet
+        env.globals["speculation_rules"] = self.speculation_rules
+        env.globals["live"] = self.live
 
         return env
 
+    def speculation_rules(self) -> Markup | None:
+        """
+        Speculation rules letting the browser prefetch (or prerender) posts linked to from a page before they're
+        clicked, at the eagerness configured in the `[speculation]` section of `config.toml`. Not for the live server,
+        where a prerendered page would open a reload socket of its own.
+
+        :return: The rules as JSON, or None if there are none.
+        """
+        if self.live:
+            return None
+
+        rules = {}
+        for rule in ("prefetch", "prerender"):
+            if eagerness := self.env.globals["speculation"][rule]:
+                rules[rule] = [{"where": {"href_matches": "/post/*"}, "eagerness": eagerness}]
+
+        return Markup(json.dumps(rules)) if rules else None
+
+    def pygments_stylesheet(self) -> str:
+        from pygments.formatters.html import HtmlFormatter
+        return HtmlFormatter(style=self.env.globals["pygments"]["style"]).get_style_defs()
+
+    def minify_code(self, mimetype: str, code: str) -> str:
+        cached = self.cache.get("minify", mimetype, code)
+        if cached is None:
+            # Loads the native library, only worth it once there's something to minify.
+            with phase("minify"):
+                import minify
+                minified = minify.string(mimetype, code)
+            cached = self.cache.put("minify", mimetype, code, data=minified.encode())
+        return cached.decode()
+
+    def write_output(self, file_path: Path, data: str | bytes):
+        if isinstance(data, str):
+            data = data.encode()
+
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # In a partial build the file may be a hardlink into the previous generation, which must not be written through.
+        file_path.unlink(missing_ok=True)
+
+        if self.previous_dir is not None:
+            previous_path = self.previous_dir / file_path.relative_to(self.output_dir)
+            if previous_path.is_file() and previous_path.stat().st_size == len(data):
+                with open(previous_path, "rb") as file:
+                    unchanged = file.read() == data
+
+                if unchanged:
+                    os.link(previous_path, file_path)
+                    return
+
+        # Sidecars carried over from the previous generation are of the old contents. A build with compression on writes
+        # new ones afterwards, one without must not leave the old ones to be served.
+        if file_path.suffix in COMPRESSIBLE_SUFFIXES:
+            for extension in SIDECAR_EXTENSIONS:
+                file_path.with_name(f"{file_path.name}.{extension}").unlink(missing_ok=True)
+
+        with open(file_path, "wb") as file:
+            file.write(data)
+
+    def copy_output(self, src_path: Path, file_path: Path):
+        with open(src_path, "rb") as file:
+            self.write_output(file_path, file.read())
+
+    @staticmethod
+    def optimize_svgs(svgs: Dict[Path, str | bytes]) -> Dict[Path, bytes]:
+        """
+        Runs svgo over the given SVGs in a single invocation. This happens in a temporary directory rather than in the
+        output directory, as files there may be hardlinked to the previous build and must never be modified in place.
+
+        :param svgs: Maps output paths to SVG contents.
+        :return: Maps output paths to optimized SVG contents, or the input as-is if svgo isn't installed.
+        """
+        svgs = {path: data.encode() if isinstance(data, str) else data for path, data in svgs.items()}
+        if not svgs or not shutil.which("svgo"):
+            return svgs
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_paths = {path: Path(tmp_dir) / f"{i}.svg" for i, path in enumerate(svgs)}
+            for path, tmp_path in tmp_paths.items():
+                tmp_path.write_bytes(svgs[path])
+
+            subprocess.run(["svgo", "--multipass", "-r", tmp_dir])
+
+            return {path: tmp_path.read_bytes() for path, tmp_path in tmp_paths.items()}
+
     @staticmethod
     def handle_output(func):
         @functools.wraps(func)
         def wrapper(self, *args, **kwargs):
-            file_path, code = func(self, *args, **kwargs)
-            file_path = Path(file_path)
+            token = asset_refs.set([])
+            try:
+                file_path, code = func(self, *args, **kwargs)
+                file_path = Path(file_path)
+
+                if file_path.is_relative_to(self.output_dir):
+                    self.page_assets[str(file_path.relative_to(self.output_dir))] = asset_refs.get()
+            finally:
+                asset_refs.reset(token)
 
             if self.minified:
-                code = minify.string(mimetype_map[file_path.suffix], code)
+                code = self.minify_code(mimetype_map[file_path.suffix], code)
 
             if not self.live:
-                file_path.parent.mkdir(parents=True, exist_ok=True)
-                with open(file_path, "w") as file:
-                    file.write(code)
+                self.write_output(file_path, code)
 
             return code
 
         return wrapper
 
-    def load_post(self, file_path):
-        with open(file_path) as file:
-            raw = file.read()
-            post = frontmatter.loads(raw)
-            post["frontmatter_lineno_offset"] = raw[:raw.find(post.content)].count("\n")
+    def load_post(self, file_path: Path) -> Post | None:
+        """
+        Only parses the front matter, the post is rendered lazily when its html, toc or preview is first accessed.
+        """
+        post = Post(file_path, self)
 
         is_actual_blog_post = file_path.is_relative_to(CONTENT_DIR / "posts")
         if is_actual_blog_post:
@@ -207,22 +613,89 @@ class Builder:
 
             post["url"] = f"/post/{post['slug']}"
 
-        renderer = ExtendedRenderer(
-            frontmatter_linenos_offset=post["frontmatter_lineno_offset"],
-            code_style=self.env.globals["pygments"]["style"],
-            section_numbering=post.get("section_numbering", False),
+        return post
+
+    def markdown_cache_key(self, markdown: str, frontmatter_lineno_offset: int, section_numbering: bool = False,
+                           preview_only: bool = False) -> tuple:
+        return (
+            "preview" if preview_only else "markdown", markdown,
+            frontmatter_lineno_offset, section_numbering, self.env.globals["pygments"]["style"],
+            self.env.globals["images"]["sizes"], self.live,
+            # Changes to the renderer itself have to invalidate what it rendered before.
+            self.file_hash(SRC_DIR / "markdown.py"),
         )
-        post["html"] = renderer.render_markdown(post.content)
-        post["preview"] = renderer.preview
-        post["additional_stylesheets"] = renderer.additional_stylesheets
-        post["toc"] = renderer.toc
 
-        return post.to_dict()
+    def render_markdown(self, file_path: Path, markdown: str, frontmatter_lineno_offset: int,
+                        section_numbering: bool = False, preview_only: bool = False) -> Dict:
+        """
+        Renders a markdown file, or with `preview_only` only its first paragraph, which only requires parsing the rest.
+
+        :return: A dict with the rendered "html", "preview", "toc" and "additional_stylesheets", along with the "images"
+        it references. Only "preview" and "images" are set with `preview_only`.
+        """
+        cache_key = self.markdown_cache_key(markdown, frontmatter_lineno_offset, section_numbering, preview_only)
+
+        cached = self.cache.get(*cache_key)
+        if cached is not None:
+            rendered = pickle.loads(cached)
+            # Images referenced by the post still have to be registered for this build, and if any of them changed since
+            # then, the URLs baked into the cached html are stale.
+            images = [(src, self.content_image(file_path, src)) for src, _ in rendered["images"]]
+            if images == rendered["images"]:
+                return rendered
+
+        images = []
+
+        def resolve_image(src: str) -> ContentImage | None:
+            image = self.content_image(file_path, src)
+            if image is not None:
+                images.append((src, image))
+            return image
+
+        # The markdown parser takes a while to import, builds where every post comes out of the cache never need it.
+        from ssg.markdown import get_renderer
+        renderer = get_renderer(self.env.globals["pygments"]["style"], self.env.globals["images"]["sizes"])
+        options = {
+            "frontmatter_linenos_offset": frontmatter_lineno_offset,
+            "section_numbering": section_numbering,
+            "image_resolver": resolve_image,
+            "cache": self.cache,
+        }
+
+        with phase("mistletoe"):
+            if preview_only:
+                rendered = {"preview": renderer.render_preview(markdown, **options)}
+            else:
+                state = renderer.render_markdown(markdown, **options)
+                rendered = {
+                    "html": state.html,
+                    "preview": state.preview,
+                    "additional_stylesheets": state.additional_stylesheets,
+                    "toc": state.toc,
+                }
+        rendered["images"] = images
+
+        self.cache.put(*cache_key, data=pickle.dumps(rendered))
+        return rendered
+
+    def render_in_worker(self, *args) -> Tuple[Dict, Dict[str, dict]]:
+        """
+        `render_markdown()` as run by `plan_build()`, possibly in a worker process.
+
+        :return: The rendered markdown, along with the cache entries used to render it (highlighted code, lexers, ...) if
+        this is a worker's builder, which the build's cache has to take over to keep them, see `Cache.merge()`.
+        """
+        return self.render_markdown(*args), self.cache.take_used()
+
+    def iter_posts(self, stop: int = None) -> Iterator[Post]:
+        with phase("rglob"):
+            files = sorted((CONTENT_DIR / "posts").rglob("*.md"), reverse=True)[:stop]
+        for file_path in files:
+            if (post := self.load_post(file_path)) is not None:
+                yield post
 
-    def load_posts(self, stop: int = None) -> PostList:
-        files = sorted((CONTENT_DIR / "posts").rglob("*.md"), reverse=True)[:stop]
-        posts = [self.load_post(file_path) for file_path in files]
-        return [post for post in posts if post is not None]
+    def load_posts(self, stop: int = None) -> List[Post]:
+        return list(self.iter_posts(stop))
 
     # **************************************************************************************************************** #
     #                                                   Build Steps                                                    #
@@ -237,40 +710,67 @@ class Builder:
             raise Exception(f"File '{file_path}' does not reside inside the static directory.")
 
         file_path = file_path.relative_to(static_dir)
-        return (
-            (BUILD_DIR / "static") / file_path,
-            self.env.get_template(f"static/{str(file_path).removesuffix('.jinja')}.jinja").render()
-        )
+        with phase("jinja"):
+            code = self.env.get_template(f"static/{str(file_path).removesuffix('.jinja')}.jinja").render()
+        return (self.output_dir / "static") / file_path, code
 
     def build_static(self):
         static_dir = SRC_DIR / "static"
-        build_dir = BUILD_DIR / "static"
+        build_dir = self.output_dir / "static"
 
+        svgs = {}
         for file in static_dir.rglob("*"):
             if file.is_dir():
                 continue
 
+            token = asset_refs.set([])
             dst_path = build_dir / self.static_url(str(file.relative_to(static_dir))).removeprefix("/static/")
 
-            dst_path.parent.mkdir(parents=True, exist_ok=True)
-
             filetype = file.suffix.lstrip(".")
-            if self.minified and filetype in ("html", "css", "js", "svg", "jinja"):
-                if filetype == "jinja":
-                    mimetype = mimetype_map[file.suffixes[-2]]
-                    code = self.env.get_template("static/" + str(file.relative_to(static_dir))).render()
-                else:
-                    mimetype = mimetype_map[file.suffix]
-                    with open(file) as src_file:
-                        code = src_file.read()
-
-                with open(dst_path, "w") as dst_file:
-                    dst_file.write(minify.string(mimetype, code))
+            if filetype == "jinja":
+                code = self.env.get_template("static/" + str(file.relative_to(static_dir))).render()
+                if self.minified:
+                    code = self.minify_code(mimetype_map[file.suffixes[-2]], code)
+            elif self.minified and filetype in ("html", "css", "js", "svg"):
+                with open(file) as src_file:
+                    code = self.minify_code(mimetype_map[file.suffix], src_file.read())
+            else:
+                with open(file, "rb") as src_file:
+                    code = src_file.read()
+
+            if filetype == "svg":
+                svgs[dst_path] = code
             else:
-                shutil.copyfile(file, dst_path)
+                self.write_output(dst_path, code)
 
-        if shutil.which("svgo"):
-            subprocess.run(["svgo", "--multipass", "-r", str(BUILD_DIR)])
+            # The first entry is the asset itself, the rest were referenced while rendering it (fonts in a stylesheet).
+            self.page_assets[str(dst_path.relative_to(self.output_dir))] = asset_refs.get()[1:]
+            asset_refs.reset(token)
+
+        for dst_path, code in self.optimize_svgs(svgs).items():
+            self.write_output(dst_path, code)
+
+    def build_images(self):
+        """
+        Writes out every image referenced by the content rendered so far. SVGs are minified and passed through svgo,
+        raster images are copied as-is with their responsive variants generated in parallel.
+        """
+        svgs = {}
+        for image in self.content_images.values():
+            dst_path = self.output_dir / image.url.removeprefix("/")
+
+            if image.is_svg:
+                with open(image.source) as src_file:
+                    code = src_file.read()
+                svgs[dst_path] = self.minify_code(mimetype_map[".svg"], code) if self.minified else code
+            else:
+                self.copy_output(image.source, dst_path)
+
+        for dst_path, code in self.optimize_svgs(svgs).items():
+            self.write_output(dst_path, code)
+
+        for data, url in generate_variants(list(self.content_images.values()), self.cache):
+            self.write_output(self.output_dir / url.removeprefix("/"), data)
 
     @handle_output
     def build_home(self, recent_posts: PostList) -> Tuple[str | Path, str]:
@@ -280,72 +780,417 @@ class Builder:
             post = self.load_post(content_filepath)
             content = post["html"]
 
-        return (
-            BUILD_DIR / "index.html",
-            self.env.get_template("index.jinja").render(content=content, recent_posts=recent_posts)
-        )
+        with phase("jinja"):
+            html = self.env.get_template("index.jinja").render(content=content, recent_posts=recent_posts)
+        return self.output_dir / "index.html", html
 
     @handle_output
     def build_blog_index(self, posts: PostList) -> Tuple[str | Path, str]:
+        with phase("jinja"):
+            html = self.env.get_template("blog.jinja").render(posts=posts)
+        return self.output_dir / "blog/index.html", html
+
+    @handle_output
+    def build_blog_post(self, post: Post) -> Tuple[str | Path, str]:
+        content, additional_stylesheets = post["html"], post["additional_stylesheets"]
+        with phase("jinja"):
+            html = self.env.get_template("post.jinja").render(
+                post=post,
+                content=content,
+                additional_stylesheets=additional_stylesheets
+            )
+
         return (
-            BUILD_DIR / "blog/index.html",
-            self.env.get_template("blog.jinja").render(posts=posts)
+            self.output_dir / f"post/{post['slug']}/index.html",
+            html
         )
 
     @handle_output
-    def build_blog_post(self, post: Dict) -> Tuple[str | Path, str]:
-        html = self.env.get_template("post.jinja").render(
-            post=post,
-            content=post["html"],
-            additional_stylesheets=post["additional_stylesheets"]
+    def build_service_worker(self) -> Tuple[str | Path, str]:
+        """
+        Generates `sw.js`. Static assets the pages reference while rendering (stylesheets, and whatever those reference in
+        turn) are cached when it installs, everything else under `/static/` the first time it's requested, and served
+        from the cache from then on as their URLs are fingerprinted. Pages and feeds are served from the cache too, but
+        revalidated in the background on every request.
+
+        Its version is derived from the precached URLs, so when a hash changes the worker changes with it and purges the
+        cache of the previous version once it takes over. Never part of live builds, so it can't get in the way of
+        reloads.
+        """
+        precache = set()
+        pending = [url for file_path, urls in self.page_assets.items() if file_path.endswith(".html") for url in urls]
+        while pending:
+            url = pending.pop()
+            if url not in precache:
+                precache.add(url)
+                pending.extend(self.page_assets.get(url.removeprefix("/"), []))
+
+        # Pages a partial build didn't render still reference what they did in the previous generation, and that's still
+        # in the output as long as the file is.
+        rendered_all = all(
+            str(file.relative_to(self.output_dir)) in self.page_assets for file in self.output_dir.rglob("*.html")
         )
+        if not rendered_all and self.previous_dir is not None and (self.previous_dir / "sw.js").is_file():
+            if match := PRECACHE_URLS.search((self.previous_dir / "sw.js").read_text()):
+                precache |= {url for url in json.loads(match[1]) if (self.output_dir / url.lstrip("/")).is_file()}
+
+        precache = sorted(precache)
+        version = hashlib.sha256("\n".join(precache).encode()).hexdigest()[:8]
 
         return (
-            BUILD_DIR / f"post/{post['slug']}/index.html",
-            html
+            self.output_dir / "sw.js",
+            self.env.get_template("sw.js.jinja").render(version=version, precache=precache)
+        )
+
+    def feed_entry(self, post: Post | PostSummary) -> Tuple[str, str]:
+        """
+        The post as an RSS item and an Atom entry, with its whole content. Sanitizing that content takes a while, so both
+        are cached, keyed by a hash of the rendered post along with everything else that goes into them.
+        """
+        url = f"https://{self.env.globals['site']['fqdn']}/post/{post.slug}"
+        # Drafts have no date, they're dated to the build instead.
+        published = parse_post_date(post.date) if post.get("date") else self.build_date
+        updated = parse_post_date(post.last_modified) if post.get("last_modified") else published
+
+        key = (
+            post.content_hash, post.title, url, published.isoformat(), updated.isoformat(), post.preview,
+            self.file_hash(SRC_DIR / "feeds.py"),
         )
+        cached = self.cache.get("feed-entry", *key)
+        if cached is None:
+            # Summaries don't keep the html around, it comes out of the render cache again.
+            html = post.html if isinstance(post, Post) else self.load_post(post.file_path).html
+            fragments = entry_fragments(url, post.title, published, updated, post.preview, html)
+            cached = self.cache.put("feed-entry", *key, data=json.dumps(fragments).encode())
 
-    def build_feeds(self, posts: PostList) -> Tuple[str, str]:
+        return tuple(json.loads(cached))
+
+    def build_feeds(self, posts: PostList) -> Tuple[bytes, bytes]:
+        """
+        Writes the RSS and Atom feeds in one go, newest post first, from entries that mostly come out of the cache.
+        """
         fqdn = self.env.globals["site"]["fqdn"]
 
-        fg = FeedGenerator()
-        fg.title(self.env.globals["rss"]["title"])
-        fg.id(f"https://{fqdn}")
-        fg.link(href=f"https://{fqdn}/blog")
-        fg.description(self.env.globals["rss"]["description"])
-        fg.author(
-            name=self.env.globals["author"]["name"],
-            email=self.env.globals["author"]["mail"],
-        )
-        fg.language(self.env.globals["site"]["language"])
+        posts = list(posts)
+        entries = [self.feed_entry(post) for post in posts]
+
+        last_updated = self.build_date
+        if self.reproducible:
+            # The feed only changes when a post does, rather than on every build.
+            last_updated = max(
+                (parse_post_date(post.get("last_modified") or post.date) for post in posts if post.get("date")),
+                default=self.build_date,
+            )
+
+        rss_chunks, atom_chunks = [], []
+        writer = FeedWriter(rss_chunks.append, atom_chunks.append)
+        writer.start({
+            "id": f"https://{fqdn}",
+            "title": self.env.globals["rss"]["title"],
+            "description": self.env.globals["rss"]["description"],
+            "link": f"https://{fqdn}/blog",
+            "language": self.env.globals["site"]["language"],
+            "author": self.env.globals["author"]["name"],
+            "mail": self.env.globals["author"]["mail"],
+            "rss": f"https://{fqdn}/rss.xml",
+            "atom": f"https://{fqdn}/atom.xml",
+        }, last_updated)
+        for rss_item, atom_entry in entries:
+            writer.entry(rss_item, atom_entry)
+        writer.end()
+
+        rss_feed, atom_feed = "".join(rss_chunks).encode(), "".join(atom_chunks).encode()
+        if not self.live:
+            self.write_output(self.output_dir / "rss.xml", rss_feed)
+            self.write_output(self.output_dir / "atom.xml", atom_feed)
+
+        return rss_feed, atom_feed
+
+    def build_headers(self) -> Dict[str, Dict[str, str | List[str]]]:
+        """
+        Emits cache policies for the build output, both in the `_headers` format understood by Netlify and Cloudflare
+        Pages and as `_headers.json` for anything else. Fingerprinted assets under `/static/` never change under the same
+        name so they're cached forever, everything else gets a short TTL with an ETag to revalidate against.
 
-        for post in posts:
-            fe = fg.add_entry()
-            link = f"https://{fqdn}/post/{post['slug']}"
-            fe.id(link)
-            fe.title(post["title"])
-            fe.link(href=link)
+        Pages also get `Link: rel=preload` hints (which some CDNs turn into 103 Early Hints) for the stylesheets they
+        referenced while rendering and the fonts those stylesheets referenced in turn.
+        """
+        html_max_age = self.env.globals["headers"]["html_max_age"]
+        feed_max_age = self.env.globals["headers"]["feed_max_age"]
+
+        rules = {
+            "/static/*": {"Cache-Control": "public, max-age=31536000, immutable"}
+        }
+
+        # Pages a partial build didn't render keep the preload hints they had in the previous generation.
+        previous_rules = {}
+        if self.previous_dir is not None and (self.previous_dir / "_headers.json").is_file():
+            with open(self.previous_dir / "_headers.json") as file:
+                previous_rules = json.load(file)
+
+        for file in sorted(self.output_dir.rglob("*")):
+            file_path = str(file.relative_to(self.output_dir))
+            if file.is_dir() or file_path.startswith("static/") or file_path.startswith("_"):
+                continue
+
+            with open(file, "rb") as src_file:
+                etag = hashlib.sha1(src_file.read(), usedforsecurity=False).hexdigest()[:16]
+
+            max_age = feed_max_age if file.suffix == ".xml" else html_max_age
+            # Browsers check for a new service worker on every navigation anyway, but only past whatever max-age says.
+            if file_path == "sw.js":
+                max_age = 0
+            headers = {
+                "Cache-Control": f"public, max-age={max_age}, must-revalidate",
+                "ETag": f'"{etag}"',
+            }
 
-        fg.rss_file(BUILD_DIR / "rss.xml", pretty=True)
-        fg.atom_file(BUILD_DIR / "atom.xml", pretty=True)
+            preloads = []
+            for url in self.page_assets.get(file_path, []):
+                if url.endswith(".css"):
+                    preloads.append(f"<{url}>; rel=preload; as=style")
+                    for font_url in self.page_assets.get(url.removeprefix("/"), []):
+                        if font_url.endswith(".woff2"):
+                            preloads.append(f'<{font_url}>; rel=preload; as=font; type="font/woff2"; crossorigin')
+
+            # Pages are linked to without the trailing "index.html", so the rules have to match the clean URLs.
+            if file.name == "index.html":
+                url = "/" + file_path.removesuffix("index.html")
+                paths = [url] if url == "/" else [url.rstrip("/"), url]
+            else:
+                paths = ["/" + file_path]
+
+            if file_path not in self.page_assets and "Link" in previous_rules.get(paths[-1], {}):
+                preloads = previous_rules[paths[-1]]["Link"]
+            if preloads:
+                headers["Link"] = list(dict.fromkeys(preloads))
 
-        return fg.rss_str(pretty=True), fg.atom_str(pretty=True)
+            for path in paths:
+                rules[path] = headers
 
-    def build(self):
-        if BUILD_DIR.exists():
-            # This is necessary as deleted files will be preserved from previous builds otherwise.
-            shutil.rmtree(BUILD_DIR)
+        headers_file = ""
+        for path, headers in rules.items():
+            headers_file += path + "\n"
+            for name, values in headers.items():
+                for value in (values if isinstance(values, list) else [values]):
+                    headers_file += f"  {name}: {value}\n"
+            headers_file += "\n"
 
-        self.build_static()
-        self.dump_hash_cache()
+        self.write_output(self.output_dir / "_headers", headers_file)
+        self.write_output(self.output_dir / "_headers.json", json.dumps(rules, indent=2))
 
-        posts = self.load_posts()
-        self.build_feeds(posts[:10])
-        self.build_home(posts[:5])
-        self.build_blog_index(posts)
+        return rules
 
-        for post in posts:
-            self.build_blog_post(post)
+    def build_compressed(self):
+        """
+        Writes precompressed sidecars (`index.html.gz`, `index.html.br`, ...) next to every compressible output file, for
+        servers that can serve those directly instead of compressing on every request.
+        """
+        for file in sorted(self.output_dir.rglob("*")):
+            if not file.is_file() or file.suffix not in COMPRESSIBLE_SUFFIXES or file.name.startswith("_"):
+                continue
+
+            with open(file, "rb") as src_file:
+                data = src_file.read()
+
+            for extension, compress in compressors().items():
+                compressed = self.cache.get("compress", extension, data)
+                if compressed is None:
+                    compressed = self.cache.put("compress", extension, data, data=compress(data))
+
+                # Not worth serving if it doesn't actually save anything.
+                if len(compressed) < len(data):
+                    self.write_output(file.with_name(f"{file.name}.{extension}"), compressed)
+
+    def build_manifest(self) -> Dict[str, Dict[str, str | int]]:
+        """
+        Writes `_manifest.json`, mapping every output file to the SHA256 of its contents, its size and its type. Deploys
+        compare it against the manifest of what's already deployed to only transfer what changed, see `ssg.deploy`.
+        """
+        manifest = {}
+        for file in sorted(self.output_dir.rglob("*")):
+            file_path = str(file.relative_to(self.output_dir))
+            if not file.is_file() or file_path == "_manifest.json":
+                continue
+
+            with open(file, "rb") as src_file:
+                data = src_file.read()
+
+            # Sidecars (`index.html.br`) are typed as what they decompress to, along with their encoding.
+            mimetype, encoding = mimetypes.guess_type(file.name)
+            manifest[file_path] = {
+                "hash": hashlib.sha256(data).hexdigest(),
+                "size": len(data),
+                "type": mimetype or "application/octet-stream",
+            }
+            if encoding is not None:
+                manifest[file_path]["encoding"] = encoding
+
+        self.write_output(self.output_dir / "_manifest.json", json.dumps(manifest, indent=2))
+        return manifest
+
+    def plan_build(self, wanted: Callable[[str], bool]) -> Scheduler:
+        """
+        Lays out a build as a graph of tasks. Markdown that isn't cached yet is rendered first, in worker processes, and
+        each page is written as soon as what it needs is there: a post once it's rendered, the home page, blog index and
+        feeds once every post's summary is. Static assets don't depend on any of it. Whatever goes over all the output
+        (headers, compressed sidecars and the manifest) comes last.
+
+        Each post is loaded afresh for each task that needs it and dropped right after, renders come out of the cache, so
+        memory doesn't grow with the number of posts.
+
+        :param wanted: Whether a build target is to be built, see `build()`.
+        """
+        scheduler = Scheduler()
+        pages = []
+
+        if wanted("static"):
+            scheduler.add("static", self.build_static)
+
+        def build_post(file_path: Path):
+            self.build_blog_post(self.load_post(file_path))
+
+        def summarize(file_path: Path) -> PostSummary:
+            post = self.load_post(file_path)
+            # The whole post is rendered (or cached) anyway, rendering only its preview would mean parsing it again.
+            post.html
+            return PostSummary(post)
+
+        def cache_rendered(cache_key: tuple, result: Tuple[Dict, Dict[str, dict]]):
+            rendered, used_entries = result
+            self.cache.merge(used_entries)
+            self.cache.put(*cache_key, data=pickle.dumps(rendered))
+
+        needs_summaries = any(wanted(target) for target in ("home", "blog", "feeds"))
+        summaries = []
+        for post in self.iter_posts():
+            build_page = wanted("posts") or wanted(f"post/{post.slug}")
+            if not (build_page or needs_summaries):
+                continue
+
+            render_args = (
+                post.file_path, post.content, post.frontmatter_lineno_offset, post.get("section_numbering", False)
+            )
+            cache_key = self.markdown_cache_key(*render_args[1:])
+
+            rendered = []
+            if cache_key not in self.cache:
+                # This builder pickles into one of its own in the worker process, see `__reduce__()`.
+                scheduler.add(
+                    f"render:{post.slug}", functools.partial(self.render_in_worker, *render_args), kind="cpu"
+                )
+                rendered = [scheduler.add(
+                    f"cache:{post.slug}", functools.partial(cache_rendered, cache_key), inputs=[f"render:{post.slug}"]
+                )]
+
+            if build_page:
+                pages.append(scheduler.add(f"post:{post.slug}", functools.partial(build_post, post.file_path),
+                                           after=rendered))
+            if needs_summaries:
+                summaries.append(scheduler.add(f"summary:{post.slug}", functools.partial(summarize, post.file_path),
+                                               after=rendered))
+
+        if wanted("feeds"):
+            pages.append(scheduler.add("feeds", lambda *posts: self.build_feeds(list(posts)), inputs=summaries[:10]))
+        if wanted("home"):
+            pages.append(scheduler.add("home", lambda *posts: self.build_home(list(posts)), inputs=summaries[:5]))
+        if wanted("blog"):
+            pages.append(scheduler.add("blog", lambda *posts: self.build_blog_index(list(posts)), inputs=summaries))
+
+        # Content images are registered while rendering, so they can only be written out once everything is rendered.
+        scheduler.add("images", self.build_images, after=pages + summaries)
+
+        if self.env.globals["service_worker"]["enabled"] and not self.live:
+            # Precaches what the pages reference, so it comes after all of them.
+            scheduler.add("service-worker", self.build_service_worker,
+                          after=pages + (["static"] if wanted("static") else []))
+        scheduler.add("headers", self.build_headers, after=[*scheduler.tasks.keys()])
+
+        last = "headers"
+        if self.compressed:
+            last = scheduler.add("compressed", self.build_compressed, after=[last])
+
+        # Last, since it covers everything else.
+        scheduler.add("manifest", self.build_manifest, after=[last])
+
+        return scheduler
+
+    def build(self, only: Iterable[str] | None = None, output: TextIO | None = None):
+        """
+        Builds the site into a fresh staging directory, which only replaces `BUILD_DIR` once the whole build succeeds.
+        `BUILD_DIR` is a symlink to the current generation and is swapped atomically, so anything serving from it never
+        sees a partially written site, and a failed build leaves the previous one in place.
+
+        :param only: Build targets to restrict the build to, out of `BUILD_TARGETS` and "post/<slug>". The staging
+        directory starts off as a hardlinked copy of the previous generation, so everything else stays as it was. Does a
+        full build if there is no previous generation to start from.
+        :param output: Where to report on the build, stdout by default.
+        """
+        targets = set(only) if only else None
+        for target in targets or ():
+            if target not in self.BUILD_TARGETS and not target.startswith("post/"):
+                raise Exception(f"Unknown build target '{target}', expected one of: {', '.join(self.BUILD_TARGETS)}, "
+                                f"post/<slug>.")
+
+        if not BUILD_DIR.is_dir():
+            targets = None
+
+        def wanted(target: str) -> bool:
+            return targets is None or target in targets
+
+        staging_dir, staging_lock = make_staging_dir()
+        # `mkdtemp()` creates the directory as private, but it has to be readable by whatever serves the site.
+        staging_dir.chmod(0o755)
+
+        # A long-lived builder (see `ssg.daemon`) shouldn't stamp every build with the time it was created, or with the
+        # commit that was checked out back then.
+        previous_year = self.build_date.year
+        self.build_date = source_date() if self.reproducible else datetime.now(timezone.utc)
+        if self.build_date.year != previous_year:
+            # The copyright years in the footer were worked out from the date the config was last read on.
+            self.load_config()
+
+        self.output_dir = staging_dir
+        self.previous_dir = BUILD_DIR.resolve() if BUILD_DIR.is_dir() else None
+        previous_lock = lock_dir(self.previous_dir, shared=True) if self.previous_dir is not None else None
+        self.cache.stats.clear()
+        # Fragments are only reused within a build, templates may have changed since the last one.
+        self.env.fragment_cache.clear()
+        try:
+            if targets is not None:
+                link_tree(self.previous_dir, staging_dir)
+
+            self.content_images = {}
+            scheduler = self.plan_build(wanted)
+            scheduler.run()
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            os.close(staging_lock)
+            raise
+        finally:
+            if previous_lock is not None:
+                os.close(previous_lock)
+            self.output_dir = BUILD_DIR
+            self.previous_dir = None
+            # Whatever was computed before a failure is still worth keeping.
+            self.cache.save()
+
+        try:
+            swap_build_dir(staging_dir)
+        finally:
+            os.close(staging_lock)
+        print(self.cache.report(), file=output)
+        print(scheduler.report(), file=output)
+
+
+@functools.cache
+def worker_builder(minified: bool, live: bool, include_drafts: bool, reproducible: bool, compressed: bool,
+                   cache_dir: Path) -> Builder:
+    builder = Builder(minified=minified, live=live, include_drafts=include_drafts, reproducible=reproducible,
+                      compressed=compressed, cache_dir=cache_dir)
+    # The worker's cache is never saved, what it uses is handed back to the build's instead, see `render_in_worker()`.
+    builder.cache.used = set()
+    return builder
 
 
 if __name__ == "__main__":
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Set
+
+from ssg.constants import *
+from ssg.tracing import record_cache_lookup
+
+MANIFEST_VERSION = 1
+# Unreferenced objects younger than this are left alone by `Cache.gc()`, another build (or the daemon) may have just
+# written them and not saved its manifest yet, or still be writing them under their temporary name.
+GC_GRACE_SECONDS = 3600
+
+
+class Cache:
+    """
+    A content-addressed store for everything the build can avoid recomputing: asset hashes, rendered markdown,
+    highlighted code, minified output, compressed sidecars, image variants and font subsets.
+
+    Entries are looked up by a namespace and a list of key parts, which are hashed together into a key. Each key maps to
+    an object named after the SHA256 of its contents, so identical outputs are only stored once. The manifest tracks
+    which build last used each entry, which is what garbage collection in `save()` goes by.
+
+    Layout:
+        .cache/manifest.json
+        .cache/objects/ab/cdef0123...
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_unused_builds: int = 10, max_size_mb: int = 512):
+        self.cache_dir = cache_dir
+        self.objects_dir = cache_dir / "objects"
+        self.manifest_file = cache_dir / "manifest.json"
+
+        self.max_unused_builds = max_unused_builds
+        self.max_size = max_size_mb * 1024 * 1024
+
+        self.build_number = 0
+        self.entries: Dict[str, dict] = {}
+        self.load()
+        # Keys of the entries looked up or written since `take_used()` was last called, only recorded if this is a set.
+        # Worker processes don't save their cache, they hand those entries back to the build's, see `merge()`.
+        self.used: Set[str] | None = None
+
+        # namespace -> [hits, misses]
+        self.stats: Dict[str, list] = defaultdict(lambda: [0, 0])
+        # Builds look things up from several threads at once.
+        self.stats_lock = threading.Lock()
+
+    def load(self):
+        if not self.manifest_file.exists():
+            return
+
+        with open(self.manifest_file) as file:
+            manifest = json.load(file)
+
+        # An incompatible manifest is simply discarded, it's only a cache.
+        if manifest.get("version") != MANIFEST_VERSION:
+            return
+
+        self.build_number = manifest["build"]
+        self.entries = manifest["entries"]
+
+    @staticmethod
+    def key(namespace: str, *parts: str | bytes | int | float) -> str:
+        digest = hashlib.sha256(namespace.encode())
+        for part in parts:
+            part = part if isinstance(part, bytes) else str(part).encode()
+            # Length-prefixed so that ("ab", "c") and ("a", "bc") don't collide.
+            digest.update(len(part).to_bytes(8, "little") + part)
+        return digest.hexdigest()
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest[2:]
+
+    def _lookup(self, namespace: str, parts: tuple) -> dict | None:
+        key = self.key(namespace, *parts)
+        entry = self.entries.get(key)
+
+        if entry is not None and "object" in entry and not self.object_path(entry["object"]).exists():
+            entry = None
+
+        with self.stats_lock:
+            self.stats[namespace][0 if entry is not None else 1] += 1
+        record_cache_lookup(namespace, entry is not None)
+        if entry is not None:
+            entry["last_used"] = self.build_number
+            if self.used is not None:
+                self.used.add(key)
+
+        return entry
+
+    def __contains__(self, key: tuple) -> bool:
+        # Unlike `get()`, checking doesn't count as a hit or a miss. Takes the namespace followed by the parts.
+        entry = self.entries.get(self.key(*key))
+        return entry is not None and ("object" not in entry or self.object_path(entry["object"]).exists())
+
+    def get(self, namespace: str, *parts) -> bytes | None:
+        entry = self._lookup(namespace, parts)
+        if entry is None:
+            return None
+
+        with open(self.object_path(entry["object"]), "rb") as file:
+            return file.read()
+
+    def get_path(self, namespace: str, *parts) -> Path | None:
+        # Same as `get()`, but for callers that only need to copy the object somewhere rather than read it.
+        entry = self._lookup(namespace, parts)
+        return self.object_path(entry["object"]) if entry is not None else None
+
+    def put(self, namespace: str, *parts, data: bytes) -> bytes:
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self.object_path(digest)
+
+        if not object_path.exists():
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            # Written under a temporary name first, so an interrupted build can't leave a truncated object behind. The name
+            # is unique to the thread, as another one (or another process) may be writing the same object right now.
+            tmp_path = object_path.with_name(f"{object_path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            tmp_path.replace(object_path)
+
+        key = self.key(namespace, *parts)
+        self.entries[key] = {
+            "namespace": namespace,
+            "object": digest,
+            "size": len(data),
+            "last_used": self.build_number,
+        }
+        if self.used is not None:
+            self.used.add(key)
+
+        return data
+
+    def get_value(self, namespace: str, *parts) -> str | None:
+        # Small values (like asset hashes) are kept in the manifest itself instead of as separate objects.
+        entry = self._lookup(namespace, parts)
+        return entry["value"] if entry is not None else None
+
+    def put_value(self, namespace: str, *parts, value: str) -> str:
+        key = self.key(namespace, *parts)
+        self.entries[key] = {
+            "namespace": namespace,
+            "value": value,
+            "last_used": self.build_number,
+        }
+        if self.used is not None:
+            self.used.add(key)
+        return value
+
+    def take_used(self) -> Dict[str, dict]:
+        """
+        :return: The entries looked up or written since the last call, if `used` is being recorded.
+        """
+        if self.used is None:
+            return {}
+
+        used = {key: self.entries[key] for key in self.used if key in self.entries}
+        self.used = set()
+        return used
+
+    def merge(self, entries: Dict[str, dict]):
+        """
+        Adds entries another process' cache looked up or wrote (see `take_used()`) to this one, as used by this build.
+        Their objects are already in the shared objects directory.
+        """
+        for key, entry in entries.items():
+            self.entries[key] = {**entry, "last_used": self.build_number}
+
+    def gc(self):
+        """
+        Drops entries that haven't been used in the last `max_unused_builds` builds, then the least recently used ones
+        until the objects fit in `max_size`, and finally deletes any objects no longer referenced by an entry, as long as
+        they're older than `GC_GRACE_SECONDS`. Temporary files of interrupted writes go once they're that old too.
+        """
+        self.entries = {
+            key: entry for key, entry in self.entries.items()
+            if self.build_number - entry["last_used"] <= self.max_unused_builds
+        }
+
+        objects = [entry for entry in self.entries.values() if "object" in entry]
+        refcounts = Counter(entry["object"] for entry in objects)
+        sizes = {entry["object"]: entry["size"] for entry in objects}
+        total_size = sum(sizes.values())
+
+        if total_size > self.max_size:
+            for key, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_used"]):
+                if total_size <= self.max_size:
+                    break
+                if "object" not in entry:
+                    continue
+
+                del self.entries[key]
+                refcounts[entry["object"]] -= 1
+                if refcounts[entry["object"]] == 0:
+                    total_size -= sizes.pop(entry["object"])
+
+        if self.objects_dir.exists():
+            cutoff = time.time() - GC_GRACE_SECONDS
+            for object_path in self.objects_dir.glob("*/*"):
+                if object_path.parent.name + object_path.name in sizes:
+                    continue
+                try:
+                    if object_path.stat().st_mtime < cutoff:
+                        object_path.unlink()
+                except FileNotFoundError:
+                    # Renamed into place, or cleaned up by someone else, in the meantime.
+                    pass
+
+    def dump_manifest(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.manifest_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as file:
+            json.dump({"version": MANIFEST_VERSION, "build": self.build_number, "entries": self.entries}, file)
+        tmp_file.replace(self.manifest_file)
+
+    def save(self):
+        # Called once at the end of every build.
+        self.gc()
+        self.build_number += 1
+        self.dump_manifest()
+
+    def report(self) -> str:
+        lines = []
+        total_hits = total_misses = 0
+        for namespace, (hits, misses) in sorted(self.stats.items()):
+            lines.append(f"  {namespace:<16} {hits:>6} hits {misses:>6} misses")
+            total_hits += hits
+            total_misses += misses
+
+        lines.insert(0, f"Cache: {total_hits} hits, {total_misses} misses")
+        return "\n".join(lines)
+
+    def export(self, tar_path: Path):
+        mode = "w:gz" if tar_path.name.endswith((".tar.gz", ".tgz")) else "w"
+        with tarfile.open(tar_path, mode) as tar:
+            if self.manifest_file.exists():
+                tar.add(self.manifest_file, arcname=self.manifest_file.name)
+            if self.objects_dir.exists():
+                tar.add(self.objects_dir, arcname=self.objects_dir.name)
+
+    def import_(self, tar_path: Path):
+        """
+        Merges an exported cache into this one. Entries already present locally keep whichever was used more recently.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with tarfile.open(tar_path) as tar:
+                tar.extractall(tmp_dir, filter="data")
+
+            imported = Cache(Path(tmp_dir))
+            for key, entry in imported.entries.items():
+                if "object" in entry:
+                    object_path = self.object_path(entry["object"])
+                    if not object_path.exists():
+                        object_path.parent.mkdir(parents=True, exist_ok=True)
+                        shutil.move(imported.object_path(entry["object"]), object_path)
+
+                # Build numbers from another machine aren't comparable, so imported entries count as used last build.
+                entry["last_used"] = max(self.build_number - 1, 0)
+                self.entries.setdefault(key, entry)
+
+        self.dump_manifest()
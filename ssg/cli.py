@@ -1,5 +1,8 @@
+import os
 import sys
+import json
 import argparse
+from pathlib import Path
 
 
 def main(argv=None):
@@ -26,6 +29,47 @@ def main(argv=None):
     build_parser.add_argument(
         "-d", "--include-drafts", action="store_true", help="Include draft posts."
     )
+    build_parser.add_argument(
+        "-c", "--compress", action="store_true", help="Write precompressed .gz/.br/.zst sidecars next to text files."
+    )
+    build_parser.add_argument(
+        "-r", "--reproducible", action="store_true",
+        help="Derive timestamps from post dates and git history (or SOURCE_DATE_EPOCH) instead of the current time."
+    )
+    build_parser.add_argument(
+        "--verify-reproducible", action="store_true",
+        help="Build twice in reproducible mode and fail if the output differs."
+    )
+    build_parser.add_argument(
+        "--only", action="append", metavar="TARGET",
+        help="Only rebuild this target (static, posts, home, blog, feeds or post/<slug>), keeping the rest of the "
+             "previous build. Can be given more than once."
+    )
+    build_parser.add_argument(
+        "--no-daemon", action="store_true", help="Build in this process even if a daemon is running."
+    )
+
+    subparser.add_parser(
+        "daemon", help="Keep a warm builder running in the background, which 'ssg build' hands builds off to."
+    )
+    subparser.add_parser("status", help="Show the status of the running daemon.")
+
+    watch_parser = subparser.add_parser(
+        "watch", help="Build with minification and rebuild whatever is affected whenever a file changes."
+    )
+    watch_parser.add_argument(
+        "-d", "--include-drafts", action="store_true", help="Include draft posts."
+    )
+    watch_parser.add_argument(
+        "-c", "--compress", action="store_true", help="Write precompressed .gz/.br/.zst sidecars next to text files."
+    )
+    watch_parser.add_argument(
+        "--debounce", type=int, default=200, help="Milliseconds to wait for changes to settle. (Default: 200)"
+    )
+
+    subparser.add_parser(
+        "rollback", help="Swap build/ back to the previous build. Running it again undoes the rollback."
+    )
 
     live_parser = subparser.add_parser("live", help="Start a live server, only build pages on request.")
     live_parser.add_argument(
@@ -40,6 +84,71 @@ def main(argv=None):
     live_parser.add_argument(
         "-d", "--include-drafts", action="store_true", help="Include draft posts."
     )
+    live_parser.add_argument(
+        "--request-log", type=Path, metavar="FILE",
+        help="Append a JSON line to FILE for every request, with the time spent in each phase of serving it."
+    )
+
+    serve_parser = subparser.add_parser(
+        "serve", help="Serve the build/ directory like a CDN would, to benchmark against locally."
+    )
+    serve_parser.add_argument(
+        "-b", "--bind", help="Bind to this address. (Default: 0.0.0.0)", dest="address", default="0.0.0.0"
+    )
+    serve_parser.add_argument(
+        "-p", "--port", help="Bind to this port. (Default: 8000)", dest="port", type=int, default=8000
+    )
+
+    bench_parser = subparser.add_parser(
+        "bench", help="Load test the live server against a generated corpus while its posts are being edited."
+    )
+    bench_parser.add_argument(
+        "-c", "--clients", type=int, default=8, help="Concurrent browsing clients. (Default: 8)"
+    )
+    bench_parser.add_argument(
+        "-w", "--websockets", type=int, default=2, help="Open reload websockets, one per tab. (Default: 2)"
+    )
+    bench_parser.add_argument(
+        "-t", "--duration", type=float, default=10, help="Seconds to run for. (Default: 10)"
+    )
+    bench_parser.add_argument(
+        "-n", "--posts", type=int, default=50, help="Posts to generate for the corpus. (Default: 50)"
+    )
+    bench_parser.add_argument(
+        "--edit-interval", type=float, default=0.5, help="Seconds between edits to posts. (Default: 0.5)"
+    )
+    bench_parser.add_argument(
+        "-o", "--output", type=Path, help="Where to write the results. (Default: .cache/bench/latest.json)"
+    )
+
+    budgets_parser = subparser.add_parser(
+        "check-budgets",
+        help="Check page weights in build/ and the latest 'ssg bench' build numbers against the budgets in config.toml "
+             "and the stored baseline, fail if anything is over budget or regressed."
+    )
+    budgets_parser.add_argument(
+        "--update-baseline", action="store_true", help="Store the current numbers as the baseline to compare against."
+    )
+    budgets_parser.add_argument(
+        "--no-timing-baseline", action="store_false", dest="timing_baseline",
+        help="Only compare page weights against the baseline, build and startup times are only checked against their "
+             "budgets. For machines other than the one the baseline was measured on, like CI."
+    )
+
+    deploy_parser = subparser.add_parser(
+        "deploy", help="Copy only what changed since the last deploy from build/ to a target directory."
+    )
+    deploy_parser.add_argument(
+        "-t", "--target", type=Path, required=True, help="Directory the site is deployed to."
+    )
+    deploy_parser.add_argument(
+        "--prune-after", type=int,
+        help="Seconds a file has to be gone from the build before it's deleted from the target. "
+             "(Default: prune_after in the [deploy] section of config.toml)"
+    )
+    deploy_parser.add_argument(
+        "-n", "--dry-run", action="store_true", help="Only show what would be uploaded and pruned."
+    )
 
     create_parser = subparser.add_parser(
         "create", help="Create a new post."
@@ -53,18 +162,100 @@ def main(argv=None):
         help="Do not regenerate font subsets, only font-face rules stylesheet template."
     )
 
+    cache_parser = subparser.add_parser(
+        "cache", help="Export or import the build cache, so it can be restored between CI runs."
+    )
+    cache_subparser = cache_parser.add_subparsers(title="action", dest="action", required=True)
+    cache_subparser.add_parser("export", help="Write the build cache to a tarball.").add_argument(
+        "tar", type=Path, help="Path of the tarball, compressed if it ends in .tar.gz or .tgz."
+    )
+    cache_subparser.add_parser("import", help="Merge a tarball written by 'ssg cache export' into the cache.").add_argument(
+        "tar", type=Path, help="Path of the tarball."
+    )
+
     args = parser.parse_args(argv)
 
     match args.command:
+        case "build" if args.verify_reproducible:
+            from ssg.build import verify_reproducible
+            differences = verify_reproducible(minified=args.minify, include_drafts=args.include_drafts)
+            if differences:
+                print("Build is not reproducible, these files differ between builds:")
+                print("\n".join(f"  {path}" for path in differences))
+                sys.exit(1)
+            print("Build is reproducible.")
         case "build":
-            from ssg.build import Builder
-            Builder(
-                minified=args.minify,
-                include_drafts=args.include_drafts
-            ).build()
+            options = {
+                "minified": args.minify,
+                "include_drafts": args.include_drafts,
+                "reproducible": args.reproducible,
+                "compressed": args.compress,
+            }
+
+            response = None
+            # The daemon has its own environment, so it wouldn't see SOURCE_DATE_EPOCH being set for this build.
+            if not args.no_daemon and "SOURCE_DATE_EPOCH" not in os.environ:
+                from ssg.daemon import request
+                response = request({"command": "build", "options": options, "only": args.only})
+
+            if response is None:
+                from ssg.build import Builder
+                Builder(**options).build(args.only)
+            elif response["ok"]:
+                print(response["output"], end="")
+                print(f"Built by daemon in {response['duration']}s")
+            else:
+                print(response["error"], file=sys.stderr)
+                sys.exit(1)
+        case "daemon":
+            from ssg.daemon import Daemon
+            Daemon().run()
+        case "status":
+            from ssg.daemon import request
+            status = request({"command": "status"})
+            if status is None:
+                print("No daemon running.")
+                sys.exit(1)
+
+            print(f"Daemon running (pid {status['pid']}, up {status['uptime']}s, {status['builds']} builds)")
+            if status["last_build"] is not None:
+                last_build = status["last_build"]
+                print(f"Last build: {', '.join(last_build['only'] or ['everything'])} in {last_build['duration']}s")
+            for file_path in status["stale_files"]:
+                print(f"Stale: {file_path} changed since the daemon started, restart it to pick that up.")
+        case "watch":
+            from ssg.watch import watch
+            watch(args.debounce, include_drafts=args.include_drafts, compressed=args.compress)
+        case "rollback":
+            from ssg.build import rollback
+            rollback()
         case "live":
             from ssg.server import Server
-            Server(args.address, args.port, args.minify, args.include_drafts).run()
+            Server(args.address, args.port, args.minify, args.include_drafts, args.request_log).run()
+        case "serve":
+            from ssg.serve import StaticServer
+            StaticServer(args.address, args.port).run()
+        case "bench":
+            from ssg.bench import bench
+            results = bench(args.clients, args.websockets, args.duration, args.posts, args.edit_interval, args.output)
+            print(json.dumps(results, indent=2))
+        case "check-budgets":
+            from ssg.budgets import check_budgets
+            if not check_budgets(args.update_baseline, args.timing_baseline):
+                sys.exit(1)
+        case "deploy":
+            from ssg.deploy import deploy, print_summary
+            prune_after = args.prune_after
+            if prune_after is None:
+                from ssg.build import Builder
+                prune_after = Builder.read_config()["deploy"]["prune_after"]
+            print_summary(deploy(args.target, prune_after, args.dry_run), args.dry_run)
+        case "cache":
+            from ssg.cache import Cache
+            if args.action == "export":
+                Cache().export(args.tar)
+            else:
+                Cache().import_(args.tar)
         case "subset-fonts":
             from ssg.fonts.subset import build as subset_fonts
             subset_fonts(args.css_only)
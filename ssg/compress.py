@@ -0,0 +1,32 @@
+import gzip
+from typing import Callable, Dict
+
+COMPRESSIBLE_SUFFIXES = (".html", ".css", ".js", ".svg", ".xml", ".json", ".txt")
+# Every sidecar extension `compressors()` can return, whether or not its library is installed right now.
+SIDECAR_EXTENSIONS = ("gz", "br", "zst")
+
+
+def compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    """
+    :return: Maps the file extension used for sidecars to a function compressing data at maximum compression level.
+    """
+    # The gzip header contains a timestamp, it's zeroed to keep the output reproducible.
+    algorithms = {"gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+
+    # brotli and zstandard are optional, gzip sidecars are always written. They're only imported here so that builds
+    # without compression don't pay for importing them.
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        algorithms["br"] = lambda data: brotli.compress(data, quality=11)
+
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        algorithms["zst"] = lambda data: zstandard.ZstdCompressor(level=19).compress(data)
+
+    return algorithms
@@ -1,11 +1,17 @@
+import os
 from pathlib import Path
 
 __all__ = [
-    "PROJECT_ROOT", "CONTENT_DIR", "SRC_DIR", "BUILD_DIR", "HASH_CACHE_FILE",
+    "PROJECT_ROOT", "CONTENT_DIR", "SRC_DIR", "BUILD_DIR", "BUILD_GENERATIONS_DIR", "CACHE_DIR", "DAEMON_SOCKET",
 ]
 
 PROJECT_ROOT = Path(__file__).parent.parent.resolve()
-CONTENT_DIR = PROJECT_ROOT / "content"
 SRC_DIR = PROJECT_ROOT / "ssg"
-BUILD_DIR = PROJECT_ROOT / "build"
-HASH_CACHE_FILE = PROJECT_ROOT / ".cache/hashes.csv"
+
+# These can be pointed elsewhere through the environment, which is how `ssg bench` builds and serves a generated corpus
+# without touching the real content, output or cache. They're read once, on first import.
+CONTENT_DIR = Path(os.environ.get("SSG_CONTENT_DIR", PROJECT_ROOT / "content")).resolve()
+BUILD_DIR = Path(os.environ.get("SSG_BUILD_DIR", PROJECT_ROOT / "build")).absolute()
+BUILD_GENERATIONS_DIR = BUILD_DIR.parent / ".build"
+CACHE_DIR = Path(os.environ.get("SSG_CACHE_DIR", PROJECT_ROOT / ".cache")).absolute()
+DAEMON_SOCKET = CACHE_DIR / "daemon.sock"
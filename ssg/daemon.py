@@ -0,0 +1,173 @@
+import asyncio
+import io
+import json
+import os
+import socket
+import time
+import traceback
+from pathlib import Path
+
+from ssg.constants import *
+
+# Nothing heavy may be imported at the top of this module: `request()` is what every `ssg build` calls first, and the
+# whole point of the daemon is to not pay for importing jinja2, mistletoe, pygments and friends on every invocation.
+
+
+def request(command: dict) -> dict | None:
+    """
+    Sends a command to the daemon and waits for its response.
+
+    :param command: A JSON-serializable dict with at least a "command" key.
+    :return: The daemon's response, or None if no daemon is running.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(DAEMON_SOCKET))
+        except (FileNotFoundError, ConnectionRefusedError):
+            # Either there never was a daemon, or it died and left its socket behind.
+            return None
+
+        sock.sendall(json.dumps(command).encode() + b"\n")
+        with sock.makefile("rb") as file:
+            response = file.readline()
+
+    if not response:
+        raise Exception("The daemon closed the connection without responding.")
+
+    return json.loads(response)
+
+
+class Daemon:
+    """
+    Keeps warm builders around (imports done, templates compiled, cache manifest loaded) and builds on request over a
+    Unix socket. The protocol is one JSON object per line each way: the client sends a command, the daemon answers and
+    closes the connection.
+
+    Commands:
+        {"command": "build", "options": {"minified": true, ...}, "only": ["post/<slug>", ...]}
+        {"command": "status"}
+    """
+
+    def __init__(self):
+        from ssg.build import Builder
+        self.builder_class = Builder
+
+        # One builder per combination of options, most people only ever use one.
+        self.builders = {}
+        self.lock: asyncio.Lock | None = None
+
+        self.started = time.time()
+        self.builds = 0
+        self.last_build: dict | None = None
+        # Changes to the generator's own code can't be picked up without restarting.
+        self.stale_files = set()
+
+    def get_builder(self, options: dict):
+        key = tuple(sorted(options.items()))
+        if key not in self.builders:
+            builder = self.builder_class(**options)
+            if self.builders:
+                # Each builder saving its own copy of the manifest would throw away what the others added to it.
+                builder.cache = next(iter(self.builders.values())).cache
+            self.builders[key] = builder
+        return self.builders[key]
+
+    def build(self, options: dict, only: list | None) -> str:
+        builder = self.get_builder(options)
+
+        # Collected for the client rather than printed, the daemon's own output goes to its stdout.
+        output = io.StringIO()
+        builder.build(only, output=output)
+        return output.getvalue()
+
+    async def handle_build(self, command: dict) -> dict:
+        options = {
+            key: bool(value) for key, value in command.get("options", {}).items()
+            if key in ("minified", "include_drafts", "reproducible", "compressed")
+        }
+        only = command.get("only")
+
+        async with self.lock:
+            start = time.perf_counter()
+            try:
+                output = await asyncio.to_thread(self.build, options, only)
+            finally:
+                self.builds += 1
+                self.last_build = {
+                    "only": only,
+                    "duration": round(time.perf_counter() - start, 3),
+                    "finished": time.time(),
+                }
+
+        return {"ok": True, "output": output, "duration": self.last_build["duration"]}
+
+    def status(self) -> dict:
+        return {
+            "ok": True,
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started, 1),
+            "builds": self.builds,
+            "last_build": self.last_build,
+            "warm_builders": [dict(key) for key in self.builders],
+            "stale_files": sorted(self.stale_files),
+        }
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            command = json.loads(await reader.readline())
+            match command.get("command"):
+                case "build":
+                    response = await self.handle_build(command)
+                case "status":
+                    response = self.status()
+                case unknown:
+                    response = {"ok": False, "error": f"Unknown command '{unknown}'."}
+        except Exception:
+            response = {"ok": False, "error": traceback.format_exc()}
+
+        writer.write(json.dumps(response).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    async def watch(self):
+        from watchfiles import awatch
+
+        # Templates, posts and static files are all re-read (or re-validated against their mtime) on every build
+        # anyway, only the config is held in memory.
+        async for changes in awatch(CONTENT_DIR, SRC_DIR):
+            for _, file_path in changes:
+                file_path = Path(file_path)
+                if file_path == CONTENT_DIR / "config.toml":
+                    async with self.lock:
+                        for builder in self.builders.values():
+                            builder.load_config()
+                elif file_path.suffix == ".py":
+                    self.stale_files.add(str(file_path.relative_to(PROJECT_ROOT)))
+                    print(f"{file_path.relative_to(PROJECT_ROOT)} changed, restart the daemon to pick it up.")
+
+    async def serve(self):
+        self.lock = asyncio.Lock()
+
+        if request({"command": "status"}) is not None:
+            raise Exception(f"A daemon is already listening on {DAEMON_SOCKET}.")
+
+        DAEMON_SOCKET.parent.mkdir(parents=True, exist_ok=True)
+        DAEMON_SOCKET.unlink(missing_ok=True)
+
+        server = await asyncio.start_unix_server(self.handle_connection, path=DAEMON_SOCKET)
+        # The socket is as good as a shell on the build, keep it to ourselves.
+        DAEMON_SOCKET.chmod(0o600)
+        print(f"Listening on {DAEMON_SOCKET}")
+
+        try:
+            async with server:
+                await asyncio.gather(server.serve_forever(), self.watch())
+        finally:
+            DAEMON_SOCKET.unlink(missing_ok=True)
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
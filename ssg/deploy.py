@@ -0,0 +1,121 @@
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from ssg.constants import *
+
+MANIFEST_FILE = "_manifest.json"
+# Kept next to what's deployed, it tracks files that are no longer part of the site but haven't been pruned yet.
+STATE_FILE = ".ssg-deploy.json"
+
+
+def read_json(file_path: Path) -> dict:
+    if not file_path.is_file():
+        return {}
+    with open(file_path) as file:
+        return json.load(file)
+
+
+def write_json(file_path: Path, data: dict):
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=2)
+    tmp_path.replace(file_path)
+
+
+def upload_order(file_path: str) -> int:
+    """
+    Pages have to go up after everything they reference, or a visitor might get a page that links to an asset that isn't
+    there yet. The same goes for the service worker, which precaches assets. The manifest goes up last of all, only once
+    it's there does the deploy count as done.
+    """
+    if file_path == MANIFEST_FILE:
+        return 3
+    if file_path.startswith("_") or file_path.removesuffix(".gz").removesuffix(".br").removesuffix(".zst").endswith(
+            (".html", ".xml", "sw.js")):
+        return 2
+    return 1
+
+
+def copy_file(src_path: Path, dst_path: Path):
+    # Written under a temporary name first, so nothing ever serves a half copied file.
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dst_path.with_name(f".{dst_path.name}.tmp")
+    shutil.copyfile(src_path, tmp_path)
+    tmp_path.replace(dst_path)
+
+
+def deploy(target: Path, prune_after: int, dry_run: bool = False) -> Dict[str, List[str]]:
+    """
+    Brings `target` up to date with `BUILD_DIR`, transferring only the files whose hash differs from the manifest of what
+    was deployed there before. Files that are no longer part of the site are only pruned once they've been stale for
+    `prune_after` seconds, since pages cached by browsers and CDNs may still reference them until then.
+
+    :param target: A local directory, which is what gets served or synced elsewhere.
+    :param dry_run: Only work out what would be done.
+    :return: The paths uploaded, pruned and pending pruning.
+    """
+    if not (BUILD_DIR / MANIFEST_FILE).is_file():
+        raise Exception("There's no build manifest to deploy from, run 'ssg build' first.")
+
+    build_dir = BUILD_DIR.resolve()
+    # rsync-style trailing slashes don't change anything here, the contents of the build always go into `target`.
+    target = Path(str(target).rstrip("/") or "/").absolute()
+    if target == build_dir or target.is_relative_to(build_dir):
+        raise Exception("Can't deploy into the build directory itself.")
+
+    manifest = read_json(build_dir / MANIFEST_FILE)
+    deployed = read_json(target / MANIFEST_FILE)
+    state = read_json(target / STATE_FILE)
+
+    uploads = sorted(
+        (
+            file_path for file_path, entry in manifest.items()
+            if deployed.get(file_path, {}).get("hash") != entry["hash"] or not (target / file_path).is_file()
+        ),
+        key=lambda file_path: (upload_order(file_path), file_path)
+    )
+    uploads.append(MANIFEST_FILE)
+
+    # Stale since the time they were first seen missing from the manifest, files that came back are no longer stale.
+    now = time.time()
+    stale = {file_path: since for file_path, since in state.get("stale", {}).items() if file_path not in manifest}
+    for file_path in deployed.keys() - manifest.keys():
+        stale.setdefault(file_path, now)
+
+    prunes = sorted(file_path for file_path, since in stale.items() if now - since >= prune_after)
+    pending = sorted(stale.keys() - set(prunes))
+
+    if not dry_run:
+        target.mkdir(parents=True, exist_ok=True)
+        for file_path in uploads:
+            copy_file(build_dir / file_path, target / file_path)
+
+        for file_path in prunes:
+            (target / file_path).unlink(missing_ok=True)
+            # Directories left empty go too, but never the target itself.
+            parent = (target / file_path).parent
+            while parent != target and parent.is_dir() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+            del stale[file_path]
+
+        write_json(target / STATE_FILE, {"stale": stale})
+
+    return {"uploaded": uploads, "pruned": prunes, "pending": pending}
+
+
+def print_summary(result: Dict[str, List[str]], dry_run: bool = False):
+    verb = "Would upload" if dry_run else "Uploaded"
+    for file_path in result["uploaded"]:
+        print(f"  + {file_path}")
+    for file_path in result["pruned"]:
+        print(f"  - {file_path}")
+
+    # The manifest is always uploaded, it doesn't count as a change.
+    print(
+        f"{verb} {len(result['uploaded']) - 1} changed files, {'would prune' if dry_run else 'pruned'} "
+        f"{len(result['pruned'])} stale files, {len(result['pending'])} more stale files waiting to be pruned."
+    )
@@ -0,0 +1,188 @@
+from datetime import datetime
+from email.utils import format_datetime
+from html import escape
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urljoin, urlsplit
+
+# Dropped from feed content along with everything inside them, feed readers won't run, apply, embed or submit them anyway.
+DROPPED_ELEMENTS = ("script", "style", "template", "noscript", "iframe", "frame", "frameset", "object", "applet", "form")
+# Dropped too, but these never have anything inside them.
+DROPPED_VOID_ELEMENTS = ("embed",)
+URL_ATTRIBUTES = ("href", "src", "poster", "cite", "action", "formaction", "background", "xlink:href")
+# Anything else (javascript:, data:, vbscript:, ...) is dropped along with the attribute. Relative URLs are made absolute
+# first, so they end up as https.
+URL_SCHEMES = ("http", "https", "mailto")
+
+
+class FeedSanitizer(HTMLParser):
+    """
+    Prepares rendered post html for feed readers, which show it outside the site: scripts, styles, embedded content,
+    forms, event handlers and URLs with any scheme but http(s) and mailto go, and links and images are made absolute.
+    Tags that need no changes are passed through exactly as they were written.
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=False)
+        self.base_url = base_url
+        self.output: List[str] = []
+        # How many dropped elements the parser is currently inside of.
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_ELEMENTS:
+            self.dropping += 1
+        if not self.dropping and tag not in DROPPED_VOID_ELEMENTS:
+            self.output.append(self.rewrite_tag(tag, attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        # Browsers ignore the slash on anything but void and foreign elements, so `<iframe/>` still has content.
+        if tag in DROPPED_ELEMENTS:
+            self.dropping += 1
+        if not self.dropping and tag not in DROPPED_VOID_ELEMENTS:
+            self.output.append(self.rewrite_tag(tag, attrs))
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_ELEMENTS:
+            self.dropping = max(self.dropping - 1, 0)
+        elif not self.dropping:
+            self.output.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.output.append(data)
+
+    def handle_entityref(self, name):
+        if not self.dropping:
+            self.output.append(f"&{name};")
+
+    def handle_charref(self, name):
+        if not self.dropping:
+            self.output.append(f"&#{name};")
+
+    def absolute_url(self, url: str) -> str | None:
+        url = urljoin(self.base_url, url)
+        # Parsing strips the whitespace and control characters browsers ignore too, so "java\tscript:" is caught.
+        return url if urlsplit(url).scheme.lower() in URL_SCHEMES else None
+
+    def rewrite_tag(self, tag: str, attrs: List[Tuple[str, str | None]]) -> str:
+        rewritten = []
+        for name, value in attrs:
+            if name.startswith("on"):
+                continue
+            if value is not None and name in URL_ATTRIBUTES:
+                value = self.absolute_url(value)
+            elif value is not None and name == "srcset":
+                candidates = [candidate.split() for candidate in value.split(",") if candidate.strip()]
+                candidates = [(self.absolute_url(url), descriptor) for url, *descriptor in candidates]
+                value = ", ".join(" ".join([url, *descriptor]) for url, descriptor in candidates if url is not None)
+                value = value or None
+            if value is None and (name in URL_ATTRIBUTES or name == "srcset"):
+                continue
+            rewritten.append((name, value))
+
+        if rewritten == attrs:
+            return self.get_starttag_text()
+
+        attributes = "".join(
+            f" {name}" if value is None else f' {name}="{escape(value)}"' for name, value in rewritten
+        )
+        return f"<{tag}{attributes}>"
+
+
+def sanitize_html(html: str, base_url: str) -> str:
+    sanitizer = FeedSanitizer(base_url)
+    sanitizer.feed(html)
+    sanitizer.close()
+    return "".join(sanitizer.output)
+
+
+def rfc3339(timestamp: datetime) -> str:
+    return timestamp.isoformat()
+
+
+def entry_fragments(url: str, title: str, published: datetime, updated: datetime, summary: str,
+                    content: str) -> Tuple[str, str]:
+    """
+    :param summary: Html shown by readers that don't show the full content.
+    :param content: Html of the whole post.
+    :return: The post as an RSS `<item>` and as an Atom `<entry>`, indented to sit inside the rest of the feed.
+    """
+    summary, content = sanitize_html(summary, url), sanitize_html(content, url)
+    rss_item = (
+        "    <item>\n"
+        f"      <title>{escape(title, quote=False)}</title>\n"
+        f"      <link>{escape(url)}</link>\n"
+        f'      <guid isPermaLink="false">{escape(url)}</guid>\n'
+        f"      <pubDate>{format_datetime(published)}</pubDate>\n"
+        f"      <description>{escape(summary, quote=False)}</description>\n"
+        f"      <content:encoded>{escape(content, quote=False)}</content:encoded>\n"
+        "    </item>\n"
+    )
+    atom_entry = (
+        "  <entry>\n"
+        f"    <id>{escape(url)}</id>\n"
+        f"    <title>{escape(title, quote=False)}</title>\n"
+        f'    <link href="{escape(url)}"/>\n'
+        f"    <published>{rfc3339(published)}</published>\n"
+        f"    <updated>{rfc3339(updated)}</updated>\n"
+        f'    <summary type="html">{escape(summary, quote=False)}</summary>\n'
+        f'    <content type="html">{escape(content, quote=False)}</content>\n'
+        "  </entry>\n"
+    )
+    return rss_item, atom_entry
+
+
+class FeedWriter:
+    """
+    Writes an RSS and an Atom feed side by side as it goes, so that both come out of a single pass over the entries
+    without building a document tree for either. The output goes wherever the `write` callables put it.
+    """
+
+    def __init__(self, write_rss: Callable[[str], object], write_atom: Callable[[str], object]):
+        self.write_rss = write_rss
+        self.write_atom = write_atom
+
+    def start(self, channel: Dict[str, str], updated: datetime):
+        """
+        :param channel: The feed's "id", "title", "description", "link" (to the blog), "language", "author" and "mail",
+        along with the URLs of the feeds themselves as "rss" and "atom".
+        """
+        title, link = escape(channel["title"], quote=False), escape(channel["link"])
+        self.write_rss(
+            "<?xml version='1.0' encoding='UTF-8'?>\n"
+            '<rss xmlns:atom="http://www.w3.org/2005/Atom" xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+            'version="2.0">\n'
+            "  <channel>\n"
+            f"    <title>{title}</title>\n"
+            f"    <link>{link}</link>\n"
+            f"    <description>{escape(channel['description'], quote=False)}</description>\n"
+            f'    <atom:link href="{escape(channel["rss"])}" rel="self" type="application/rss+xml"/>\n'
+            "    <docs>http://www.rssboard.org/rss-specification</docs>\n"
+            "    <generator>ssg</generator>\n"
+            f"    <language>{escape(channel['language'], quote=False)}</language>\n"
+            f"    <lastBuildDate>{format_datetime(updated)}</lastBuildDate>\n"
+        )
+        self.write_atom(
+            "<?xml version='1.0' encoding='UTF-8'?>\n"
+            f'<feed xmlns="http://www.w3.org/2005/Atom" xml:lang="{escape(channel["language"])}">\n'
+            f"  <id>{escape(channel['id'])}</id>\n"
+            f"  <title>{title}</title>\n"
+            f"  <updated>{rfc3339(updated)}</updated>\n"
+            "  <author>\n"
+            f"    <name>{escape(channel['author'], quote=False)}</name>\n"
+            f"    <email>{escape(channel['mail'], quote=False)}</email>\n"
+            "  </author>\n"
+            f'  <link href="{link}"/>\n'
+            f'  <link href="{escape(channel["atom"])}" rel="self"/>\n'
+            "  <generator>ssg</generator>\n"
+            f"  <subtitle>{escape(channel['description'], quote=False)}</subtitle>\n"
+        )
+
+    def entry(self, rss_item: str, atom_entry: str):
+        self.write_rss(rss_item)
+        self.write_atom(atom_entry)
+
+    def end(self):
+        self.write_rss("  </channel>\n</rss>\n")
+        self.write_atom("</feed>\n")
@@ -3,8 +3,10 @@ from copy import deepcopy
 from pathlib import Path
 from typing import List
 
+from ssg.cache import Cache
 from ssg.constants import *
 
+import fontTools
 from fontTools.subset import main as subset
 from fontTools.ttLib import TTFont
 from jinja2 import Environment, DictLoader
@@ -15,7 +17,6 @@ OUTPUT_FONT_DIR = SRC_DIR / "static/fonts/"
 WOFF_DIR = OUTPUT_FONT_DIR / "WOFF"
 WOFF2_DIR = OUTPUT_FONT_DIR / "WOFF2"
 
-
 def all_chars(input_font: Path) -> set:
     # Returns all characters defined in a font.
     return set(TTFont(input_font).getBestCmap())
@@ -67,25 +68,34 @@ def remaining_blocks(input_font: Path) -> list:
     return group_nums(remaining_chars)
 
 
-def subset_to_woff_and_woff2(input_font: Path, output_font_name: str, unicode_range: str):
-    subset(args=[
-        str(input_font),
-        "--output-file=" + str(WOFF2_DIR / f"{output_font_name}.woff2"),
-        f"--unicodes={unicode_range}",
-        "--flavor=woff2",
-        "--layout-features=*",
-    ])
+def cached_subset(cache: Cache, input_font: Path, output_file: Path, unicode_range: str, flavor: str):
+    with open(input_font, "rb") as file:
+        key = (file.read(), unicode_range, flavor, fontTools.version)
+
+    data = cache.get("font-subset", *key)
+    if data is not None:
+        with open(output_file, "wb") as file:
+            file.write(data)
+        return
 
     subset(args=[
         str(input_font),
-        "--output-file=" + str(WOFF_DIR / f"{output_font_name}.woff"),
+        "--output-file=" + str(output_file),
         f"--unicodes={unicode_range}",
-        "--flavor=woff",
+        f"--flavor={flavor}",
         "--layout-features=*",
     ])
 
+    with open(output_file, "rb") as file:
+        cache.put("font-subset", *key, data=file.read())
+
+
+def subset_to_woff_and_woff2(cache: Cache, input_font: Path, output_font_name: str, unicode_range: str):
+    cached_subset(cache, input_font, WOFF2_DIR / f"{output_font_name}.woff2", unicode_range, "woff2")
+    cached_subset(cache, input_font, WOFF_DIR / f"{output_font_name}.woff", unicode_range, "woff")
 
-def build_libertinus(input_font_dir: Path, subsets: dict, css_only=False):
+
+def build_libertinus(cache: Cache, input_font_dir: Path, subsets: dict, css_only=False):
     defaults = {
         "LibertinusMath-Regular.woff2": {
             "family": "Libertinus Math",
@@ -118,7 +128,7 @@ def build_libertinus(input_font_dir: Path, subsets: dict, css_only=False):
         # TODO: Not sure if I should subset the math font, so it remains a special case for now.
         if "math" in font.name.lower():
             if not css_only:
-                subset_to_woff_and_woff2(font, font.stem, "0000-10FFFF")
+                subset_to_woff_and_woff2(cache, font, font.stem, "0000-10FFFF")
 
             css_props.append(deepcopy(defaults[font.name]))
             css_props[-1]["sources"].extend([
@@ -142,7 +152,7 @@ def build_libertinus(input_font_dir: Path, subsets: dict, css_only=False):
 
             output_name = f"{font.stem}-{block_name}"
             if not css_only:
-                subset_to_woff_and_woff2(font, output_name, unicode_range)
+                subset_to_woff_and_woff2(cache, font, output_name, unicode_range)
 
             css_props[-1]["sources"].extend([
                 (f"fonts/WOFF2/{output_name}.woff2", "woff2"),
@@ -166,17 +176,24 @@ def build_libertinus(input_font_dir: Path, subsets: dict, css_only=False):
 
 
 def build(css_only=False):
+    from ssg.build import Builder
+    # Honors the size limits in config.toml, like the builder's own cache.
+    cache = Cache(**Builder.read_config()["cache"])
+
     # Clean output directory
     if not css_only and OUTPUT_FONT_DIR.exists():
         shutil.rmtree(OUTPUT_FONT_DIR)
     WOFF_DIR.mkdir(parents=True, exist_ok=True)
     WOFF2_DIR.mkdir(exist_ok=True)
 
-    build_libertinus(INPUT_FONT_DIR / "Libertinus", {
+    build_libertinus(cache, INPUT_FONT_DIR / "Libertinus", {
         "basic": (0x0, 0xFF),
         "extras": remaining_blocks
     }, css_only)
 
+    cache.save()
+    print(cache.report())
+
 
 if __name__ == "__main__":
     build()
@@ -0,0 +1,115 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Tuple
+from xml.etree import ElementTree
+
+from ssg.cache import Cache
+
+RASTER_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+
+
+@dataclass
+class ContentImage:
+    """
+    An image referenced from markdown content, along with everything the renderer needs to emit markup for it and
+    everything the build needs to write it out.
+    """
+    source: Path
+    url: str
+    width: int | None = None
+    height: int | None = None
+    # Maps an image format ("avif", "webp") to a list of (width, url) pairs.
+    variants: Dict[str, List[Tuple[int, str]]] = field(default_factory=dict)
+
+    @property
+    def is_svg(self) -> bool:
+        return self.source.suffix == ".svg"
+
+    def srcset(self, image_format: str) -> str:
+        return ", ".join(f"{url} {width}w" for width, url in self.variants[image_format])
+
+
+def svg_dimensions(file_path: Path) -> Tuple[int | None, int | None]:
+    root = ElementTree.parse(file_path).getroot()
+
+    width, height = root.get("width", ""), root.get("height", "")
+    # Only unitless or pixel dimensions can be used as intrinsic sizes, anything else falls back to the viewBox.
+    match = re.fullmatch(r"([\d.]+)(px)?", width), re.fullmatch(r"([\d.]+)(px)?", height)
+    if all(match):
+        return round(float(match[0].group(1))), round(float(match[1].group(1)))
+
+    view_box = root.get("viewBox", "").replace(",", " ").split()
+    if len(view_box) == 4:
+        return round(float(view_box[2])), round(float(view_box[3]))
+
+    return None, None
+
+
+def raster_dimensions(file_path: Path) -> Tuple[int | None, int | None]:
+    # Pillow is optional and slow to import, it's only imported once there's an image to look at. Without it raster
+    # images are still fingerprinted but no responsive variants are generated.
+    try:
+        from PIL import Image
+    except ImportError:
+        return None, None
+
+    # Only reads the image header, the pixel data is loaded lazily.
+    with Image.open(file_path) as image:
+        return image.size
+
+
+def variant_formats() -> List[str]:
+    try:
+        from PIL import features
+    except ImportError:
+        return []
+    return [fmt for fmt in ("avif", "webp") if features.check(fmt)]
+
+
+def variant_widths(original_width: int, widths: List[int]) -> List[int]:
+    # Upscaling is pointless, if the image is narrower than every configured width only its own width is used.
+    return [width for width in widths if width < original_width] or [original_width]
+
+
+def make_variant(source: Path, width: int, image_format: str) -> bytes:
+    """
+    Resizes `source` to `width` pixels wide and encodes it as `image_format`. This runs in a separate process, so it
+    must only depend on its arguments.
+    """
+    from PIL import Image
+
+    with Image.open(source) as image:
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.Resampling.LANCZOS) if width != image.width else image.copy()
+
+    output = BytesIO()
+    resized.save(output, format=image_format.upper(), quality=70 if image_format == "avif" else 80)
+    return output.getvalue()
+
+
+def generate_variants(images: List[ContentImage], cache: Cache, jobs: int | None = None) -> List[Tuple[bytes, str]]:
+    """
+    Generates every responsive variant missing from the cache in parallel.
+
+    :return: A list of (image data, url) pairs for every variant of the given images.
+    """
+    variants, missing = [], []
+    for image in images:
+        for image_format, image_variants in image.variants.items():
+            for width, url in image_variants:
+                # The file name already contains the hash of the source image, the width and the format.
+                data = cache.get("image-variant", Path(url).name)
+                if data is None:
+                    missing.append((image.source, width, image_format, url))
+                else:
+                    variants.append((data, url))
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for (_, _, _, url), data in zip(missing, executor.map(make_variant, *zip(*[t[:3] for t in missing]))):
+                variants.append((cache.put("image-variant", Path(url).name, data=data), url))
+
+    return variants
@@ -0,0 +1,41 @@
+// Prefetches links to posts in browsers that don't support speculation rules, at the same eagerness those would.
+(() => {
+    if (HTMLScriptElement.supports && HTMLScriptElement.supports("speculationrules")) return;
+
+    const eagerness = document.currentScript.dataset.eagerness;
+    const isPostLink = (target) => target instanceof Element && target.closest('a[href^="/post/"]');
+    const prefetched = new Set();
+
+    const prefetch = (link) => {
+        if (prefetched.has(link.pathname) || link.pathname === location.pathname) return;
+        prefetched.add(link.pathname);
+
+        const hint = document.createElement("link");
+        hint.rel = "prefetch";
+        hint.href = link.href;
+        document.head.append(hint);
+    };
+
+    if (eagerness === "immediate" || eagerness === "eager") {
+        document.querySelectorAll('a[href^="/post/"]').forEach(prefetch);
+        return;
+    }
+
+    // Pressing down on a link is a sure sign it's about to be followed, at any eagerness.
+    for (const event of ["pointerdown", "touchstart"]) {
+        document.addEventListener(event, (e) => {
+            const link = isPostLink(e.target);
+            if (link) prefetch(link);
+        }, {passive: true});
+    }
+
+    if (eagerness !== "moderate") return;
+
+    // Hovering over a link for a moment is almost as sure, that's what "moderate" waits for.
+    let timer;
+    document.addEventListener("pointerover", (e) => {
+        const link = isPostLink(e.target);
+        if (link) timer = setTimeout(() => prefetch(link), 200);
+    });
+    document.addEventListener("pointerout", () => clearTimeout(timer));
+})();
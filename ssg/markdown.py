@@ -1,13 +1,23 @@
 import ast
+import functools
+import html
+import importlib
 import re
+import threading
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, List
 
-from mistletoe import block_token
+from ssg.post import HeadingNode
+from ssg.tracing import phase
+
+from mistletoe import block_token, span_token
 from mistletoe.html_renderer import HtmlRenderer
 from mistletoe.block_token import BlockToken, Document, Paragraph, tokenize
 from pygments.formatters.html import HtmlFormatter
 from pygments import highlight
-from pygments.lexers import get_lexer_by_name, guess_lexer
-from pygments.styles import get_style_by_name
+from pygments.lexer import Lexer
+from pygments.lexers import find_lexer_class_by_name, guess_lexer
 from pygments.util import ClassNotFound
 
 
@@ -21,7 +31,6 @@ class CustomBlock(BlockToken):
     """
 
     pattern = re.compile(r"::: *((\S*)[^\n]*)")
-    _open_info = None
 
     def __init__(self, match):
         lines, (self.block_type, self.info_string) = match
@@ -34,47 +43,127 @@ class CustomBlock(BlockToken):
             return False
 
         info_string, block_type = match_obj.groups()
-        if not block_type:
-            return False
-
-        cls._open_info = block_type, info_string
-        return True
+        return bool(block_type)
 
     @classmethod
     def read(cls, lines):
-        next(lines)
+        # The opening line is matched again instead of having `start()` stash what it matched on the class, which would
+        # be shared by every parse.
+        info_string, block_type = cls.pattern.match(next(lines)).groups()
         line_buffer = []
         for line in lines:
             if line.lstrip().startswith(":::"):
                 break
             line_buffer.append(line)
-        return line_buffer, cls._open_info
+        return line_buffer, (block_type, info_string)
 
 
-class BaseRenderer(HtmlRenderer):
-    def __init__(self, *extras, **kwargs):
-        # noinspection PyTypeChecker
-        super().__init__(CustomBlock, *extras, **kwargs)
+# Registered once, rather than by every renderer instance (which is what passing it to `HtmlRenderer()` would do).
+block_token.add_token(CustomBlock)
 
-        # This allows the parsing process to request additional css as it sees fit per document.
-        self.additional_stylesheets = []
-        self.preview = ""
+# mistletoe keeps the document being parsed in a module global (for link reference definitions), so only one document
+# can be parsed at a time. Rendering a parsed document doesn't touch any global state.
+PARSE_LOCK = threading.Lock()
 
 
-class PygmentsRenderer(BaseRenderer):
-    def __init__(self, frontmatter_linenos_offset=0, code_style="sas", *extras, **kwargs):
+def parse(markdown: str) -> Document:
+    with PARSE_LOCK:
+        return Document(markdown)
+
+
+@functools.cache
+def lexer_by_name(language: str, cache=None) -> Lexer | None:
+    """
+    Looking up a lexer by name goes through pygments' whole mapping of lexers, and when the name isn't in there, through
+    every installed plugin as well. So each language is only looked up once per process, and with a cache, only once
+    ever: what it resolved to is kept in there, and later builds import the module the lexer lives in directly.
+    """
+    lexer_class = None
+    resolved = cache.get_value("lexer", language) if cache is not None else None
+
+    if resolved:
+        module_name, _, class_name = resolved.partition(":")
+        try:
+            lexer_class = getattr(importlib.import_module(module_name), class_name, None)
+        except ImportError:
+            # The lexer moved since it was resolved, pygments was probably upgraded. It's just looked up again.
+            pass
+
+    # An empty string means it was looked up before, and there's no lexer by that name.
+    if lexer_class is None and resolved != "":
+        try:
+            lexer_class = find_lexer_class_by_name(language)
+        except ClassNotFound:
+            pass
+
+        if cache is not None:
+            cache.put_value(
+                "lexer", language, value=f"{lexer_class.__module__}:{lexer_class.__name__}" if lexer_class else ""
+            )
+
+    return lexer_class() if lexer_class is not None else None
+
+
+@functools.cache
+def code_formatter(style: str, linenos: bool, hl_lines: frozenset) -> HtmlFormatter:
+    # Formatters aren't modified while formatting, so one per combination of options can be shared by every render.
+    return HtmlFormatter(style=style, linenos=linenos, hl_lines=sorted(hl_lines))
+
+
+@dataclass
+class RenderState:
+    """
+    Everything specific to rendering one document. Renderers are shared, so this is kept in a context variable for the
+    duration of a render instead of on the renderer, which makes a renderer safe to use from several threads (or asyncio
+    tasks) at once.
+    """
+    frontmatter_linenos_offset: int = 0
+    section_numbering: bool = False
+    # A callable that takes the image source as written in the markdown and returns a `ssg.images.ContentImage`, or
+    # `None` to render the image as-is.
+    image_resolver: Callable | None = None
+    # An `ssg.cache.Cache` for highlighted code blocks, if any.
+    cache: object = None
+
+    # Filled in while rendering.
+    html: str = ""
+    additional_stylesheets: List[str] = field(default_factory=list)
+    preview: str = ""
+    is_first_paragraph: bool = True
+    toc: "HeadingNode" = field(default_factory=lambda: HeadingNode())
+    counter_stack: List[int] = field(default_factory=list)
+    last_level: int | None = None
+    last_parent: "HeadingNode" = None
+
+    def __post_init__(self):
+        self.last_parent = self.toc
+
+
+render_state: ContextVar[RenderState] = ContextVar("render_state")
+
+
+class BaseRenderer(HtmlRenderer):
+    def __init__(self, *extras, **kwargs):
         super().__init__(*extras, **kwargs)
+        self.render_map["CustomBlock"] = self.render_custom_block
 
-        # Frontmatter is stripped from the markdown before being parsed, this number stores how many lines were used up
-        # by the frontmatter. Add this as `Token.line_number + self.line_number_offset` to get absolute line number
-        # in the file.
-        self.frontmatter_linenos_offset = frontmatter_linenos_offset
+    @property
+    def state(self) -> RenderState:
+        return render_state.get()
+
+    def render_document(self, token: Document) -> str:
+        # Same as `HtmlRenderer.render_document()`, minus collecting footnotes on the (shared) renderer, they're unused.
+        inner = "\n".join([self.render(child) for child in token.children])
+        return f"{inner}\n" if inner else ""
 
-        self.formatter = HtmlFormatter()
-        self.formatter.style = get_style_by_name(code_style)
+    def render_custom_block(self, token: CustomBlock) -> str:
+        return self.render_inner(token)
 
-        self.is_first_paragraph = True
-        self.preview = ""
+
+class PygmentsRenderer(BaseRenderer):
+    def __init__(self, code_style="sas", *extras, **kwargs):
+        super().__init__(*extras, **kwargs)
+        self.code_style = code_style
 
     def parse_code_block_arguments(self, token: block_token.CodeFence):
         """
@@ -114,8 +203,10 @@ class PygmentsRenderer(BaseRenderer):
                 if isinstance(lines, list):
                     args["highlight"] = lines
 
+        # Frontmatter is stripped from the markdown before being parsed, `frontmatter_linenos_offset` is how many lines
+        # were used up by it. Adding it to `Token.line_number` gives the absolute line number in the file.
         # noinspection PyUnresolvedReferences
-        offset = token.line_number + self.frontmatter_linenos_offset if args["absolute_numbering"] else 0
+        offset = token.line_number + self.state.frontmatter_linenos_offset if args["absolute_numbering"] else 0
 
         hl_lines = []
         for line in args["highlight"]:
@@ -136,32 +227,37 @@ class PygmentsRenderer(BaseRenderer):
         lexer = None
         args = self.parse_code_block_arguments(token)
 
-        if token.language:
-            try:
-                lexer = get_lexer_by_name(token.language)
-            except ClassNotFound:
-                pass
+        # Once per post is plenty, every extra <link> is another render blocking request to the browser.
+        state = self.state
+        if "pygments.css.jinja" not in state.additional_stylesheets:
+            state.additional_stylesheets.append("pygments.css.jinja")
 
-        if lexer is None:
-            lexer = guess_lexer(code)
+        key = (code, token.language, args["linenos"], sorted(set(args["highlight"])), self.code_style)
+        if state.cache is not None and (cached := state.cache.get("highlight", *key)) is not None:
+            return cached.decode()
 
-        self.additional_stylesheets.append("pygments.css.jinja")
+        with phase("pygments"):
+            if token.language:
+                lexer = lexer_by_name(token.language, state.cache)
 
-        self.formatter.linenos = args["linenos"]
-        self.formatter.hl_lines = set(args["highlight"])
-        return highlight(code, lexer, self.formatter)
+            if lexer is None:
+                lexer = guess_lexer(code)
 
+            formatter = code_formatter(self.code_style, args["linenos"], frozenset(args["highlight"]))
+            highlighted = highlight(code, lexer, formatter)
+
+        if state.cache is not None:
+            state.cache.put("highlight", *key, data=highlighted.encode())
+        return highlighted
 
-class SummaryRenderer(BaseRenderer):
-    def __init__(self, *extras, **kwargs):
-        super().__init__(*extras, **kwargs)
-        self.is_first_paragraph = True
 
+class SummaryRenderer(BaseRenderer):
     def render_paragraph(self, token: Paragraph) -> str:
         ret = super().render_paragraph(token)
-        if self.is_first_paragraph and isinstance(token.parent, Document):
-            self.is_first_paragraph = False
-            self.preview = ret
+        state = self.state
+        if state.is_first_paragraph and isinstance(token.parent, Document):
+            state.is_first_paragraph = False
+            state.preview = ret
         return ret
 
 
@@ -171,97 +267,139 @@ class CustomBlocksRenderer(BaseRenderer):
             return '<aside>{}</aside>'.format(self.render_inner(token))
 
 
-class HeadingNode:
-    def __init__(self, content: str = ""):
-        self.content = content
-        self.children = []
-        self.parent = None
+class ImageRenderer(BaseRenderer):
+    def __init__(self, image_sizes="100vw", *extras, **kwargs):
+        super().__init__(*extras, **kwargs)
+        self.image_sizes = image_sizes
+
+    def render_image(self, token: span_token.Image) -> str:
+        image_resolver = self.state.image_resolver
+        image = image_resolver(token.src) if image_resolver else None
+        if image is None:
+            return super().render_image(token)
+
+        attrs = f'src="{self.escape_url(image.url)}" alt="{self.render_to_plain(token)}"'
+        if token.title:
+            attrs += f' title="{html.escape(token.title)}"'
+        if image.width and image.height:
+            # Intrinsic dimensions let the browser reserve space before the image loads, avoiding layout shift.
+            attrs += f' width="{image.width}" height="{image.height}"'
+        img = f'<img {attrs} loading="lazy" decoding="async">'
 
-    def add_child(self, child: "HeadingNode"):
-        self.children.append(child)
-        child.parent = self
+        if not image.variants:
+            return img
 
-    def add_sibling(self, child: "HeadingNode"):
-        self.parent.children.append(child)
-        child.parent = self.parent
+        sources = "".join(
+            f'<source type="image/{image_format}" srcset="{image.srcset(image_format)}" sizes="{self.image_sizes}">'
+            for image_format in image.variants
+        )
+        return f"<picture>{sources}{img}</picture>"
 
 
 class TOCRenderer(BaseRenderer):
     MAX_DEPTH = 4
 
-    def __init__(self, section_numbering=False, *extras, **kwargs):
-        super().__init__(*extras, **kwargs)
-        self.section_numbering = section_numbering
-        self.counter_stack = []
-        self.last_level = None
-        self.toc = HeadingNode()
-        self.last_parent = self.toc
-
-    @property
-    def current_section_number(self) -> str:
-        section_number = ".".join([str(c) for c in self.counter_stack])
+    @staticmethod
+    def current_section_number(state: RenderState) -> str:
+        section_number = ".".join([str(c) for c in state.counter_stack])
         if section_number.isdigit():
             # Adds a trailing dot for top-level headings.
             # Example: "1 Heading" becomes "1. Heading", but "1.1 Sub Heading" remains as is.
             section_number += "."
         return section_number
 
-    def update_tree_and_counters(self, content: str, curr_level: int):
-        if self.last_level is None:
+    @staticmethod
+    def update_tree_and_counters(state: RenderState, content: str, curr_level: int):
+        if state.last_level is None:
             # The top-level heading isn't necessarily h1 (blog posts use h2 as the top-most heading).
-            self.last_level = curr_level - 1
+            state.last_level = curr_level - 1
 
-        level_diff = abs(curr_level - self.last_level)
+        level_diff = abs(curr_level - state.last_level)
         curr_node = HeadingNode(content)
-        if self.last_level < curr_level:
-            self.counter_stack.extend([1] * level_diff)
+        if state.last_level < curr_level:
+            state.counter_stack.extend([1] * level_diff)
 
             # Phantom parents for when you skip more one or more heading levels.
             # Not sure what's the "correct" behaviour to implement here, but my reasoning with phantom parents is that,
             # if you see empty nodes in the table of contents, it'll serve as a soft warning to "correct" the mistake.
             for _ in range(1, level_diff):
                 phantom_parent = HeadingNode()
-                self.last_parent.add_child(phantom_parent)
-                self.last_parent = phantom_parent
+                state.last_parent.add_child(phantom_parent)
+                state.last_parent = phantom_parent
 
-            self.last_parent.add_child(curr_node)
+            state.last_parent.add_child(curr_node)
 
-        elif self.last_level == curr_level:
-            self.counter_stack[-1] += 1
+        elif state.last_level == curr_level:
+            state.counter_stack[-1] += 1
 
-            self.last_parent.add_sibling(curr_node)
+            state.last_parent.add_sibling(curr_node)
 
         else:
             # FIXME: This will break for elements with level greater than the determined top level.
             # Example: if the top-most items are of heading level 2, then a heading level 1 later in the document will
             # break this block.
 
-            self.counter_stack = self.counter_stack[:-level_diff]
-            self.counter_stack[-1] += 1
+            state.counter_stack = state.counter_stack[:-level_diff]
+            state.counter_stack[-1] += 1
 
             for _ in range(level_diff):
-                self.last_parent = self.last_parent.parent
+                state.last_parent = state.last_parent.parent
 
-            self.last_parent.add_sibling(curr_node)
+            state.last_parent.add_sibling(curr_node)
 
-        self.last_level = curr_level
-        self.last_parent = curr_node
+        state.last_level = curr_level
+        state.last_parent = curr_node
 
     def render_heading(self, token: block_token.Heading) -> str:
-        ret = super().render_heading(token)
         if token.level > self.MAX_DEPTH:
-            return ret
+            return super().render_heading(token)
 
-        match = re.match(r"(^<.*>)(.*)(</.*>$)", ret)
-        open_tag, content, close_tag = match.group(1), match.group(2), match.group(3)
+        # The TOC entry is the heading's rendered content, straight from its tokens.
+        state = self.state
+        content = self.render_inner(token)
+        self.update_tree_and_counters(state, content, token.level)
+        if state.section_numbering:
+            content = f"<span class=section-numbers>{self.current_section_number(state)} </span>" + content
 
-        self.update_tree_and_counters(content, token.level)
-        if self.section_numbering:
-            content = f"<span class=section-numbers>{self.current_section_number} </span>" + content
+        return f"<h{token.level}>{content}</h{token.level}>"
+
+
+class ExtendedRenderer(PygmentsRenderer, SummaryRenderer, CustomBlocksRenderer, TOCRenderer, ImageRenderer):
+    """
+    Holds no state specific to a document, so one instance (see `get_renderer()`) can render any number of them, from any
+    number of threads at once.
+    """
+
+    def render_markdown(self, markdown: str, **options) -> RenderState:
+        """
+        :param options: Per-render options, see `RenderState`.
+        :return: The state of the render, with the additional stylesheets, preview and TOC it collected. The html is on
+        `html`.
+        """
+        state = RenderState(**options)
+        token = render_state.set(state)
+        try:
+            state.html = self.render(parse(markdown))
+        finally:
+            render_state.reset(token)
+        return state
+
+    def render_preview(self, markdown: str, **options) -> str:
+        """
+        Only renders the first top-level paragraph, though the rest still has to be parsed to find it.
+        """
+        document = parse(markdown)
+        paragraph = next((child for child in document.children if isinstance(child, Paragraph)), None)
+        if paragraph is None:
+            return ""
 
-        return open_tag + content + close_tag
+        token = render_state.set(RenderState(**options))
+        try:
+            return self.render(paragraph)
+        finally:
+            render_state.reset(token)
 
 
-class ExtendedRenderer(PygmentsRenderer, SummaryRenderer, CustomBlocksRenderer, TOCRenderer):
-    def render_markdown(self, markdown: str) -> str:
-        return self.render(Document(markdown))
+@functools.cache
+def get_renderer(code_style: str = "sas", image_sizes: str = "100vw") -> ExtendedRenderer:
+    return ExtendedRenderer(code_style=code_style, image_sizes=image_sizes)
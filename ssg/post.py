@@ -0,0 +1,174 @@
+import hashlib
+import re
+from functools import cached_property
+from pathlib import Path
+from typing import Tuple
+
+from frontmatter.default_handlers import YAMLHandler
+
+from ssg.tracing import phase
+
+FM_BOUNDARY = re.compile(r"-{3,}\s*")
+
+
+def read_frontmatter(file_path: Path) -> Tuple[dict, int]:
+    """
+    Parses only the front matter block at the top of a markdown file, without reading the rest of it.
+
+    :return: The front matter, and the number of lines it takes up (including both delimiters).
+    """
+    lines = []
+    with open(file_path) as file:
+        lineno = 0
+        for line in file:
+            lineno += 1
+            if line.strip():
+                break
+        else:
+            return {}, 0
+
+        if not FM_BOUNDARY.fullmatch(line):
+            return {}, 0
+
+        for line in file:
+            lineno += 1
+            if FM_BOUNDARY.fullmatch(line):
+                break
+            lines.append(line)
+        else:
+            # No closing delimiter, so this isn't front matter after all.
+            return {}, 0
+
+    metadata = YAMLHandler().load("".join(lines))
+    return metadata if isinstance(metadata, dict) else {}, lineno
+
+
+# Lives here rather than next to the renderer that builds it, so that unpickling a cached table of contents doesn't
+# have to import the markdown parser.
+class HeadingNode:
+    def __init__(self, content: str = ""):
+        self.content = content
+        self.children = []
+        self.parent = None
+
+    def add_child(self, child: "HeadingNode"):
+        self.children.append(child)
+        child.parent = self
+
+    def add_sibling(self, child: "HeadingNode"):
+        self.parent.children.append(child)
+        child.parent = self.parent
+
+
+class Post:
+    """
+    A markdown file from the content directory. Only its front matter is parsed up front, the body is read and rendered
+    on first access to `html`, `toc` or `additional_stylesheets`. `preview` only renders the first paragraph, unless the
+    whole post has already been rendered anyway.
+
+    Front matter keys are available both as attributes and items, so `post.title` and `post["title"]` both work, which
+    keeps it a drop-in replacement for the plain dicts templates used to get.
+    """
+
+    RENDERED_KEYS = ("content", "html", "preview", "toc", "additional_stylesheets")
+
+    def __init__(self, file_path: Path, builder):
+        self.file_path = file_path
+        self.builder = builder
+        with phase("frontmatter"):
+            self.metadata, self.frontmatter_lines = read_frontmatter(file_path)
+
+    def __getattr__(self, key):
+        # Only called for attributes that don't exist on the object itself.
+        try:
+            return self.__dict__["metadata"][key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __getitem__(self, key):
+        if key in self.RENDERED_KEYS:
+            return getattr(self, key)
+        return self.metadata[key]
+
+    def __setitem__(self, key, value):
+        self.metadata[key] = value
+
+    def __contains__(self, key):
+        return key in self.metadata or key in self.RENDERED_KEYS
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    @cached_property
+    def _body(self) -> Tuple[str, int]:
+        with open(self.file_path) as file:
+            for _ in range(self.frontmatter_lines):
+                next(file)
+            body = file.read()
+
+        content = body.strip()
+        # Used to map line numbers in the markdown back to line numbers in the file.
+        lineno_offset = self.frontmatter_lines + body[:len(body) - len(body.lstrip())].count("\n")
+        return content, lineno_offset
+
+    @property
+    def content(self) -> str:
+        return self._body[0]
+
+    @property
+    def frontmatter_lineno_offset(self) -> int:
+        return self._body[1]
+
+    @cached_property
+    def _rendered(self) -> dict:
+        return self.builder.render_markdown(
+            self.file_path, self.content, self.frontmatter_lineno_offset, self.metadata.get("section_numbering", False)
+        )
+
+    @cached_property
+    def html(self) -> str:
+        return self._rendered["html"]
+
+    @cached_property
+    def content_hash(self) -> str:
+        # What the feeds key their cached entries on, they'd have to read the html again to hash it otherwise.
+        return hashlib.sha256(self.html.encode()).hexdigest()
+
+    @cached_property
+    def toc(self):
+        return self._rendered["toc"]
+
+    @cached_property
+    def additional_stylesheets(self) -> list:
+        return self._rendered["additional_stylesheets"]
+
+    @cached_property
+    def preview(self) -> str:
+        if "_rendered" in self.__dict__:
+            return self._rendered["preview"]
+
+        return self.builder.render_markdown(
+            self.file_path, self.content, self.frontmatter_lineno_offset, preview_only=True
+        )["preview"]
+
+
+class PostSummary:
+    """
+    The parts of a post that the home page, blog index and feeds need. A build keeps one of these for each post instead of
+    the post itself, so memory doesn't grow with the size of the rendered content.
+    """
+
+    __slots__ = ("file_path", "slug", "title", "date", "last_modified", "url", "preview", "content_hash")
+
+    def __init__(self, post: Post):
+        self.file_path = post.file_path
+        self.slug = post.get("slug")
+        self.title = post.get("title")
+        self.date = post.get("date")
+        self.last_modified = post.get("last_modified")
+        self.url = post.get("url")
+        self.preview = post.preview
+        self.content_hash = post.content_hash
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
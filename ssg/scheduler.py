@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+
+@dataclass
+class Task:
+    name: str
+    func: Callable[..., Any]
+    # Names of the tasks this one depends on. Their results are passed to `func` in this order.
+    inputs: Tuple[str, ...] = ()
+    # Names of tasks that only have to be done before this one starts, their results aren't passed along.
+    after: Tuple[str, ...] = ()
+    # "io" tasks run on threads, "cpu" tasks in worker processes, so `func` and its inputs have to be picklable.
+    kind: str = "io"
+    started: float | None = None
+    finished: float | None = None
+
+    @property
+    def dependencies(self) -> Tuple[str, ...]:
+        return self.inputs + self.after
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+
+class Scheduler:
+    """
+    Runs a graph of tasks, each as soon as everything it depends on is done, so independent ones overlap. Waiting on
+    files and subprocesses happens on threads, while CPU bound work goes to a pool of worker processes, as the GIL would
+    otherwise serialize it.
+    """
+
+    # Starting worker processes takes a while (each has to import everything again), so with fewer CPU bound tasks than
+    # this they run on threads too.
+    MIN_PROCESS_TASKS = 8
+
+    def __init__(self, processes: int | None = None):
+        self.processes = processes or os.cpu_count() or 1
+        self.tasks: Dict[str, Task] = {}
+
+    def add(self, name: str, func: Callable[..., Any], inputs: Iterable[str] = (), after: Iterable[str] = (),
+            kind: str = "io") -> str:
+        if name in self.tasks:
+            raise Exception(f"There's already a task named '{name}'.")
+        if kind not in ("io", "cpu"):
+            raise Exception(f"Unknown task kind '{kind}', expected 'io' or 'cpu'.")
+
+        self.tasks[name] = Task(name, func, tuple(inputs), tuple(after), kind)
+        return name
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Runs every task. If one fails, nothing that hasn't started yet is started, and its exception is raised once the
+        ones already running are done.
+
+        A result is dropped as soon as every task that takes it as an input has started (rendered posts would otherwise
+        pile up until the end of the build), so only those of tasks no other task takes as an input are returned.
+
+        :return: Maps task names to their results.
+        """
+        for task in self.tasks.values():
+            for name in task.dependencies:
+                if name not in self.tasks:
+                    raise Exception(f"Task '{task.name}' depends on '{name}', which doesn't exist.")
+
+        cpu_tasks = sum(task.kind == "cpu" for task in self.tasks.values())
+        use_processes = self.processes > 1 and cpu_tasks >= self.MIN_PROCESS_TASKS
+
+        results: Dict[str, Any] = {}
+        finished = set()
+        # How many tasks that take each result as an input haven't started yet.
+        consumers = Counter(name for task in self.tasks.values() for name in task.inputs)
+        pending = dict(self.tasks)
+        running: Dict[Future, Task] = {}
+
+        # Spawned rather than forked, forking a process with threads running can leave locks held forever in the child.
+        with ThreadPoolExecutor() as threads, (
+            ProcessPoolExecutor(self.processes, multiprocessing.get_context("spawn")) if use_processes else threads
+        ) as processes:
+            executors: Dict[str, Executor] = {"io": threads, "cpu": processes}
+            try:
+                while pending or running:
+                    ready = [task for task in pending.values() if finished.issuperset(task.dependencies)]
+                    for task in ready:
+                        del pending[task.name]
+                        task.started = time.perf_counter()
+                        future = executors[task.kind].submit(task.func, *(results[name] for name in task.inputs))
+                        running[future] = task
+
+                        for name in task.inputs:
+                            consumers[name] -= 1
+                            if not consumers[name]:
+                                results.pop(name, None)
+
+                    if not running:
+                        raise Exception(f"Tasks depend on each other in a cycle: {', '.join(sorted(pending))}.")
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = running.pop(future)
+                        task.finished = time.perf_counter()
+                        results[task.name] = future.result()
+                        finished.add(task.name)
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+
+        return results
+
+    def critical_path(self) -> List[Task]:
+        """
+        :return: The chain of tasks that determined how long the run took, from the first to start to the last to
+        finish. Each one is preceded by whichever of its dependencies finished last, which is what it was waiting on.
+        """
+        finished = [task for task in self.tasks.values() if task.finished is not None]
+        if not finished:
+            return []
+
+        path = [max(finished, key=lambda task: task.finished)]
+        while path[-1].dependencies:
+            path.append(max((self.tasks[name] for name in path[-1].dependencies), key=lambda task: task.finished))
+
+        return path[::-1]
+
+    def report(self) -> str:
+        path = self.critical_path()
+        if not path:
+            return "Critical path: nothing ran."
+
+        total = path[-1].finished - min(task.started for task in self.tasks.values() if task.started is not None)
+        steps = " -> ".join(f"{task.name} ({task.duration:.3f}s)" for task in path)
+        return f"Critical path ({sum(task.duration for task in path):.3f}s of {total:.3f}s): {steps}"
@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import unquote
+
+from ssg.constants import *
+
+# Sidecar extensions written by `Builder.build_compressed()`, in order of preference, with their content codings.
+ENCODINGS = {"br": "br", "zst": "zstd", "gz": "gzip"}
+
+KEEP_ALIVE_TIMEOUT = 5
+MAX_HEADER_LINES = 100
+
+STATUS_REASONS = {
+    200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 416: "Range Not Satisfiable",
+}
+
+
+@dataclass
+class IndexedFile:
+    path: Path
+    size: int
+    etag: str
+    content_type: str
+    # Maps a content coding to the (path, size, etag) of its precompressed sidecar.
+    sidecars: Dict[str, Tuple[Path, int, str]] = field(default_factory=dict)
+
+
+def file_etag(file_path: Path) -> str:
+    # Same as the ETags in `_headers`, so the server and the headers file never disagree.
+    with open(file_path, "rb") as file:
+        return '"' + hashlib.sha1(file.read(), usedforsecurity=False).hexdigest()[:16] + '"'
+
+
+def content_type(file_path: Path) -> str:
+    mimetype = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+    if mimetype.startswith("text/") or mimetype in ("application/javascript", "application/json", "application/xml",
+                                                    "image/svg+xml"):
+        mimetype += "; charset=utf-8"
+    return mimetype
+
+
+def build_index(build_dir: Path) -> Dict[str, IndexedFile]:
+    """
+    Maps every URL path the build output can be requested under to the file that answers it, including the clean URLs
+    pages are linked to with (`/post/<slug>` and `/post/<slug>/` for `post/<slug>/index.html`).
+    """
+    index = {}
+    for file in sorted(build_dir.rglob("*")):
+        relative_path = str(file.relative_to(build_dir))
+        if not file.is_file() or file.name.startswith("_") or file.suffix.lstrip(".") in ENCODINGS:
+            continue
+
+        indexed = IndexedFile(file, file.stat().st_size, file_etag(file), content_type(file))
+        for extension, coding in ENCODINGS.items():
+            sidecar = file.with_name(f"{file.name}.{extension}")
+            if sidecar.is_file():
+                # A different representation needs a different strong ETag.
+                indexed.sidecars[coding] = (sidecar, sidecar.stat().st_size, indexed.etag[:-1] + f'-{extension}"')
+
+        if file.name == "index.html":
+            url = "/" + relative_path.removesuffix("index.html")
+            for path in ([url] if url == "/" else [url.rstrip("/"), url]):
+                index[path] = indexed
+        index["/" + relative_path] = indexed
+
+    return index
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    codings = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if match := re.search(r"q=([\d.]+)", params):
+            quality = float(match.group(1))
+        if coding:
+            codings[coding.strip().lower()] = quality
+    return codings
+
+
+def parse_range(header: str, size: int) -> Tuple[int, int] | None:
+    """
+    Parses a single byte range. Multiple ranges are allowed to be ignored, which means serving the whole file.
+
+    :return: (start, end) inclusive, or None if the header doesn't apply.
+    :raises ValueError: If the range can't be satisfied.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+
+    start, end = match.groups()
+    if start == "":
+        # A suffix range, the last N bytes.
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so W/"x" matches "x".
+    return header.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+class StaticServer:
+    """
+    Serves the build output the way a CDN would, to benchmark against locally: precompressed sidecars are negotiated
+    through Accept-Encoding, files are sent with sendfile(), responses carry strong ETags and the policies from
+    `_headers.json`, conditional and range requests are honoured, and connections are kept alive.
+
+    The path index is built once at startup, and again whenever `BUILD_DIR` is swapped to a new generation.
+    """
+
+    def __init__(self, host="0.0.0.0", port=8000):
+        self.host = host
+        self.port = port
+
+        self.generation: str | None = None
+        self.index: Dict[str, IndexedFile] = {}
+        self.exact_rules: Dict[str, Dict[str, str | List[str]]] = {}
+        self.prefix_rules: List[Tuple[str, Dict[str, str | List[str]]]] = []
+        # Held while a new generation is being indexed, so that requests arriving meanwhile don't index it again.
+        self.refresh_lock = asyncio.Lock()
+        self.load(self.current_generation())
+
+    @staticmethod
+    def current_generation() -> str:
+        if not BUILD_DIR.is_dir():
+            raise Exception("There's nothing to serve, run 'ssg build' first.")
+        return os.readlink(BUILD_DIR) if BUILD_DIR.is_symlink() else str(BUILD_DIR)
+
+    def load(self, generation: str):
+        """
+        Indexes the current generation of `BUILD_DIR` and reads its header rules. Hashes every file in it, so this is
+        kept off the event loop once serving, see `refresh()`.
+        """
+        build_dir = BUILD_DIR.resolve()
+        index = build_index(build_dir)
+
+        exact_rules, prefix_rules = {}, []
+        if (build_dir / "_headers.json").is_file():
+            with open(build_dir / "_headers.json") as file:
+                for path, headers in json.load(file).items():
+                    if path.endswith("*"):
+                        prefix_rules.append((path.removesuffix("*"), headers))
+                    else:
+                        exact_rules[path] = headers
+
+        self.index, self.exact_rules, self.prefix_rules = index, exact_rules, prefix_rules
+        self.generation = generation
+
+    async def refresh(self):
+        """
+        Picks up a new generation of `BUILD_DIR` once per swap, indexing it in a thread while other connections are
+        served.
+        """
+        if self.current_generation() == self.generation:
+            return
+
+        async with self.refresh_lock:
+            generation = self.current_generation()
+            if generation != self.generation:
+                await asyncio.to_thread(self.load, generation)
+
+    def policy_headers(self, path: str) -> List[Tuple[str, str]]:
+        headers = {}
+        for prefix, rule in self.prefix_rules:
+            if path.startswith(prefix):
+                headers.update(rule)
+        headers.update(self.exact_rules.get(path, {}))
+
+        # The ETag depends on the representation being served, which the rules don't know about.
+        headers.pop("ETag", None)
+        return [
+            (name, value) for name, values in headers.items()
+            for value in (values if isinstance(values, list) else [values])
+        ]
+
+    async def respond(self, writer: asyncio.StreamWriter, method: str, status: int, headers: List[Tuple[str, str]],
+                      body: bytes | Tuple[Path, int, int] = b"", keep_alive: bool = True):
+        """
+        :param body: Either the body itself, or a (file path, offset, length) triple to sendfile() from.
+        """
+        length = len(body) if isinstance(body, bytes) else body[2]
+        head = [
+            f"HTTP/1.1 {status} {STATUS_REASONS[status]}",
+            f"Date: {formatdate(usegmt=True)}",
+            f"Content-Length: {length}" if status != 304 else None,
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+            *(f"{name}: {value}" for name, value in headers),
+        ]
+        writer.write(("\r\n".join(line for line in head if line is not None) + "\r\n\r\n").encode("latin-1"))
+
+        if method == "HEAD" or status == 304:
+            await writer.drain()
+        elif isinstance(body, bytes):
+            writer.write(body)
+            await writer.drain()
+        else:
+            await writer.drain()
+            file_path, offset, count = body
+            with open(file_path, "rb") as file:
+                # Uses os.sendfile() where the transport allows, so the file never passes through userspace.
+                await asyncio.get_running_loop().sendfile(writer.transport, file, offset, count)
+
+    async def handle_request(self, writer: asyncio.StreamWriter, method: str, target: str,
+                             request_headers: Dict[str, str], keep_alive: bool):
+        if method not in ("GET", "HEAD"):
+            return await self.respond(writer, method, 405, [("Allow", "GET, HEAD")], b"Method Not Allowed\n",
+                                      keep_alive)
+
+        await self.refresh()
+        path = unquote(target.split("?", 1)[0].split("#", 1)[0])
+        indexed = self.index.get(path)
+        if indexed is None:
+            not_found = self.index.get("/404.html")
+            if not_found is None:
+                return await self.respond(writer, method, 404, [("Content-Type", "text/plain; charset=utf-8")],
+                                          b"Not Found\n", keep_alive)
+            return await self.respond(writer, method, 404, [("Content-Type", not_found.content_type)],
+                                      (not_found.path, 0, not_found.size), keep_alive)
+
+        headers = [("Content-Type", indexed.content_type), *self.policy_headers(path)]
+        file_path, size, etag = indexed.path, indexed.size, indexed.etag
+
+        range_header = request_headers.get("range")
+        if indexed.sidecars:
+            headers.append(("Vary", "Accept-Encoding"))
+            accepted = parse_accept_encoding(request_headers.get("accept-encoding", ""))
+            # Ranges of a compressed representation are hardly ever asked for, those get the identity encoding.
+            if range_header is None:
+                for coding, (sidecar, sidecar_size, sidecar_etag) in indexed.sidecars.items():
+                    if accepted.get(coding, accepted.get("*", 0)) > 0:
+                        file_path, size, etag = sidecar, sidecar_size, sidecar_etag
+                        headers.append(("Content-Encoding", coding))
+                        break
+
+        headers += [("ETag", etag), ("Accept-Ranges", "bytes")]
+
+        if "if-none-match" in request_headers and etag_matches(request_headers["if-none-match"], etag):
+            return await self.respond(writer, method, 304, headers, keep_alive=keep_alive)
+
+        # A range only applies to the representation the client already has part of.
+        if range_header is not None and request_headers.get("if-range", etag) == etag:
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                return await self.respond(writer, method, 416, [("Content-Range", f"bytes */{size}")],
+                                          keep_alive=keep_alive)
+
+            if byte_range is not None:
+                start, end = byte_range
+                headers.append(("Content-Range", f"bytes {start}-{end}/{size}"))
+                return await self.respond(writer, method, 206, headers, (file_path, start, end - start + 1), keep_alive)
+
+        await self.respond(writer, method, 200, headers, (file_path, 0, size), keep_alive)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    async with asyncio.timeout(KEEP_ALIVE_TIMEOUT):
+                        request_line = await reader.readline()
+                        request_headers = {}
+                        for _ in range(MAX_HEADER_LINES):
+                            line = await reader.readline()
+                            if line in (b"\r\n", b"\n", b""):
+                                break
+                            name, _, value = line.decode("latin-1").partition(":")
+                            request_headers[name.strip().lower()] = value.strip()
+                except TimeoutError:
+                    break
+
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, "GET", 400, [], b"Bad Request\n", keep_alive=False)
+                    break
+
+                connection = request_headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+                # Bodies aren't used for anything, but have to be read past to get to the next request. Without a
+                # valid length there's no telling where the next request starts.
+                try:
+                    content_length = int(request_headers.get("content-length", 0) or 0)
+                    if content_length < 0:
+                        raise ValueError(content_length)
+                except ValueError:
+                    await self.respond(writer, method, 400, [], b"Bad Request\n", keep_alive=False)
+                    break
+                if content_length:
+                    await reader.readexactly(content_length)
+
+                await self.handle_request(writer, method, target, request_headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"Serving {BUILD_DIR} on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
@@ -1,20 +1,24 @@
 import functools
 import inspect
+import json
+import time
 from mimetypes import types_map as mimetype_map
 from pathlib import Path
 
 import ssg.build as build
 import ssg.constants as consts
+from ssg.tracing import Trace, current_trace, phase
 
-import minify
 from quart import Quart, Response, request, send_from_directory, websocket
-from watchfiles import awatch
 from werkzeug.exceptions import NotFound
 
-with open(consts.SRC_DIR / "reload.js") as file:
-    RELOAD_SCRIPT = "<script>" + \
-                    minify.string(mimetype_map['.js'], file.read()) + \
-                    "</script>"
+
+@functools.cache
+def reload_script() -> str:
+    # Minified on the first page served rather than at import, loading minify's native library isn't free.
+    import minify
+    with open(consts.SRC_DIR / "reload.js") as file:
+        return "<script>" + minify.string(mimetype_map['.js'], file.read()) + "</script>"
 
 
 def inject_js_reloader(func):
@@ -22,7 +26,7 @@ def inject_js_reloader(func):
     async def wrapper(*args, **kwargs):
         html: str = await func(*args, **kwargs)
         if isinstance(html, str):
-            html += RELOAD_SCRIPT
+            html += reload_script()
         return html
 
     return wrapper
@@ -59,13 +63,20 @@ def ws(*args, **kwargs):
 
 
 class Server:
-    def __init__(self, host="0.0.0.0", port=5000, minified=False, include_drafts=False):
+    def __init__(self, host="0.0.0.0", port=5000, minified=False, include_drafts=False, request_log: Path = None):
+        """
+        :param request_log: A file to append a JSON line to for every request served, with the same breakdown of where
+        the time went that the `Server-Timing` header has.
+        """
         self.host = host
         self.port = port
         self.minified = False
         self.include_drafts = include_drafts
+        self.request_log = request_log
 
         self.app = Quart(__name__, static_folder=None)
+        self.app.before_request(self.start_trace)
+        self.app.after_request(self.finish_trace)
 
         self.builder = build.Builder(
             minified=minified,
@@ -96,7 +107,31 @@ class Server:
             for args, kwargs in zip(args_list, kwargs_list):
                 registrar(*args, **kwargs)(method)
 
+    @staticmethod
+    async def start_trace():
+        current_trace.set(Trace())
+
+    async def finish_trace(self, response: Response) -> Response:
+        trace = current_trace.get()
+        if trace is None:
+            return response
+
+        trace.finish()
+        # Shows up in the network tab of the browser's devtools, under "Timing".
+        response.headers["Server-Timing"] = trace.server_timing()
+
+        if self.request_log is not None:
+            entry = {
+                "time": time.time(), "method": request.method, "path": request.path, "status": response.status_code,
+                **trace.to_dict(),
+            }
+            with open(self.request_log, "a") as file:
+                file.write(json.dumps(entry) + "\n")
+
+        return response
+
     async def reload_on_changes(self):
+        from watchfiles import awatch
         async for changes in awatch(consts.CONTENT_DIR, consts.SRC_DIR):
             for change_type, file_path in changes:
                 if file_path == str(consts.CONTENT_DIR / "config.toml"):
@@ -118,7 +153,8 @@ class Server:
     @route("/post/<slug>")
     async def blog_post(self, slug):
         # This assumes unique slugs but that is not enforced yet, (unlikely) problem for future me.
-        file_path = tuple((consts.CONTENT_DIR / "posts/").rglob(f"*-{slug}.md"))[0]
+        with phase("rglob"):
+            file_path = tuple((consts.CONTENT_DIR / "posts/").rglob(f"*-{slug}.md"))[0]
         post = self.builder.load_post(file_path)
 
         return self.builder.build_blog_post(post)
@@ -134,6 +170,13 @@ class Server:
                 mimetype=mimetype_map[Path(file_path).suffix]
             )
 
+    @route("/content/<path:file_path>")
+    async def content_image(self, file_path):
+        # Only images are served from the content directory, everything else in there is source material.
+        if Path(file_path).suffix.lower() not in (".svg", *build.RASTER_SUFFIXES):
+            raise NotFound()
+        return await send_from_directory(consts.CONTENT_DIR, file_path)
+
     @route("/atom.xml")
     @route("/rss.xml")
     async def feeds(self):
@@ -0,0 +1,82 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List
+
+
+class Trace:
+    """
+    Where the time went while serving a single request, broken down into phases, along with the cache lookups made on
+    the way. Phases can nest (highlighting happens while rendering markdown, which can happen while rendering a template)
+    and each only counts its own time, not that of the phases inside it, so they add up to no more than the total.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: float | None = None
+        # phase -> [seconds, count]
+        self.phases: Dict[str, list] = defaultdict(lambda: [0.0, 0])
+        # namespace -> [hits, misses], like `Cache.stats`.
+        self.cache: Dict[str, list] = defaultdict(lambda: [0, 0])
+        # Time spent in nested phases, to be taken off the phase they're nested in. One entry per open phase.
+        self.nested: List[float] = []
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def total(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def server_timing(self) -> str:
+        """
+        :return: A `Server-Timing` header value, see https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing.
+        Cache lookups show up as metrics without a duration.
+        """
+        metrics = [f"total;dur={self.total * 1000:.2f}"]
+        for name, (seconds, count) in self.phases.items():
+            metrics.append(f'{name};dur={seconds * 1000:.2f};desc="{name} ({count}x)"')
+        for namespace, (hits, misses) in self.cache.items():
+            metrics.append(f'cache-{namespace};desc="{hits} hits, {misses} misses"')
+        return ", ".join(metrics)
+
+    def to_dict(self) -> dict:
+        return {
+            "total_ms": round(self.total * 1000, 3),
+            "phases": {name: {"ms": round(seconds * 1000, 3), "count": count}
+                       for name, (seconds, count) in self.phases.items()},
+            "cache": {namespace: {"hits": hits, "misses": misses} for namespace, (hits, misses) in self.cache.items()},
+        }
+
+
+# The trace of the request being served. Builds outside the live server don't set one, and then tracing does nothing.
+current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    trace.nested.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = trace.nested.pop()
+        if trace.nested:
+            trace.nested[-1] += elapsed
+
+        totals = trace.phases[name]
+        totals[0] += elapsed - nested
+        totals[1] += 1
+
+
+def record_cache_lookup(namespace: str, hit: bool):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.cache[namespace][0 if hit else 1] += 1
@@ -0,0 +1,97 @@
+import io
+import time
+import traceback
+from pathlib import Path
+from typing import Iterable, Set, Tuple
+
+from ssg.build import Builder
+from ssg.constants import *
+from ssg.images import RASTER_SUFFIXES
+from ssg.post import read_frontmatter
+
+from watchfiles import Change
+from watchfiles import watch as watch_changes
+
+
+def affected_targets(changes: Iterable[Tuple[Change, str]]) -> Set[str] | None:
+    """
+    Maps changed files to the build targets (see `Builder.build()`) that depend on them.
+
+    :return: The targets to rebuild, or None if the change could affect anything and everything has to be rebuilt.
+    """
+    targets = set()
+    for change, file_path in changes:
+        file_path = Path(file_path)
+
+        if file_path.is_relative_to(CONTENT_DIR / "posts") and file_path.suffix == ".md":
+            if change == Change.deleted:
+                # Whatever the post was built into has to go, only a full build starts from a clean slate.
+                return None
+
+            metadata, _ = read_frontmatter(file_path)
+            slug = metadata.get("slug", "-".join(file_path.stem.split("-")[1:]))
+            # The home page, blog index and feeds all list titles, dates and previews of posts.
+            targets |= {f"post/{slug}", "home", "blog", "feeds"}
+        elif file_path == CONTENT_DIR / "home.md":
+            targets.add("home")
+        elif file_path.is_relative_to(CONTENT_DIR) and file_path.suffix.lower() in (".svg", *RASTER_SUFFIXES):
+            # There's no record of which page references which image, but there aren't many pages either. Feeds and the
+            # blog index carry post content and previews too.
+            targets |= {"posts", "home", "blog", "feeds"}
+        elif file_path.is_relative_to(CONTENT_DIR) and file_path.name != "config.toml":
+            # Anything else in there is source material for posts that's linked to, not part of the build.
+            continue
+        else:
+            # Config, templates, static files and includes can end up in any page, and static files also change the
+            # hashed URLs every page links to.
+            return None
+
+    return targets
+
+
+def watch(debounce: int = 200, **builder_kwargs):
+    """
+    Rebuilds `BUILD_DIR` with production settings whenever the content or templates change, only re-running the build
+    steps affected by the change.
+
+    :param debounce: How long to wait (in milliseconds) for a burst of changes to settle before rebuilding.
+    :param builder_kwargs: Passed on to `Builder`, minification is on unless disabled here.
+    """
+    builder = Builder(**builder_kwargs)
+
+    start = time.perf_counter()
+    builder.build(output=io.StringIO())
+    print(f"Built everything in {time.perf_counter() - start:.2f}s, watching for changes...")
+
+    for changes in watch_changes(CONTENT_DIR, SRC_DIR, debounce=debounce):
+        code_changes = {
+            file_path for _, file_path in changes if file_path.endswith(".py") and Path(file_path).is_relative_to(SRC_DIR)
+        }
+        for file_path in sorted(code_changes):
+            print(f"{Path(file_path).relative_to(PROJECT_ROOT)} changed, restart to pick it up.")
+
+        changes = {(change, file_path) for change, file_path in changes if file_path not in code_changes}
+        if not changes:
+            continue
+
+        # The newest change is when the edit was saved, which is what the latency is measured from.
+        edited = max((Path(path).stat().st_mtime for _, path in changes if Path(path).exists()), default=time.time())
+
+        targets = affected_targets(changes)
+        if targets is not None and not targets:
+            continue
+        if targets is None and any(Path(path) == CONTENT_DIR / "config.toml" for _, path in changes):
+            builder.load_config()
+
+        start = time.perf_counter()
+        try:
+            builder.build(targets, output=io.StringIO())
+        except Exception:
+            traceback.print_exc()
+            print("Build failed, build/ was left as it was.")
+            continue
+
+        print(
+            f"Rebuilt {', '.join(sorted(targets)) if targets is not None else 'everything'} "
+            f"in {time.perf_counter() - start:.2f}s, {time.time() - edited:.2f}s from edit to written"
+        )